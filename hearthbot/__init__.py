@@ -7,3 +7,4 @@ sys.path.append(HEARTHBOT_HOME)
 # Set resource paths
 HEARTH_DB = os.path.join(HEARTHBOT_HOME, 'db')
 TINGLE_LOGS = os.path.join(HEARTHBOT_HOME, 'tingle_logs')
+SAMPLE_LOGS = os.path.join(HEARTHBOT_HOME, 'sample_logs')
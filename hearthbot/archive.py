@@ -0,0 +1,206 @@
+"""
+Keeps the per-game logs (hearthstone.log and tingle.log in tingle_logs/) off
+the hot path.
+
+- AsyncWriter: writes to a file from a background thread behind a bounded
+  queue, gzip compressing on the fly if the file ends in .gz. Writing never
+  blocks: if the disk can't keep up and the queue fills, data is dropped and
+  counted rather than stalling a turn.
+- AsyncLogHandler: a logging handler that writes through an AsyncWriter.
+- FlightRecorder: a ring buffer of the most recent log lines and decisions.
+  install_crash_handler dumps it, along with the backtrace, to crash.log when
+  Tingle dies on an unhandled exception, and flushes all the logs.
+"""
+
+import os, sys
+import gzip
+import time
+import Queue
+import logging
+import threading
+import traceback
+import collections
+
+logger = logging.getLogger('ARCHIVE')
+
+# Chunks of data that can wait to be written before we start dropping them
+QUEUE_SIZE = 10000
+# Seconds flush and close wait on the writer thread
+CLOSE_TIMEOUT = 5
+# zlib level: fast, still shrinks the logs ~10x
+COMPRESS_LEVEL = 6
+# Recent lines/decisions kept by the flight recorder
+RECORDER_SIZE = 2000
+
+def open_archive(filepath, mode='rb'):
+    """Open a (possibly gzipped) log file.
+    """
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, mode, COMPRESS_LEVEL)
+    return open(filepath, mode)
+
+class AsyncWriter(object):
+    def __init__(self, filepath, queue_size=QUEUE_SIZE):
+        """Write to filepath from a background thread.
+        Compresses with gzip if filepath ends with .gz.
+        """
+        self.filepath = filepath
+        self.fileobj = open_archive(filepath, 'wb')
+        self.queue = Queue.Queue(queue_size)
+        # Chunks that were thrown away because the queue was full
+        self.dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run,
+                                       name='writer-' + os.path.basename(filepath))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, data):
+        """Queue data to be written. Never blocks.
+        Returns False if the queue was full and data was dropped.
+        """
+        try:
+            self.queue.put_nowait(data)
+        except Queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def run(self):
+        try:
+            self.write_queued()
+        finally:
+            # Even if a write failed, so a .gz still gets its end
+            self.fileobj.close()
+
+    def write_queued(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                self.queue.task_done()
+                break
+            # Write everything that's waiting in one go
+            chunks = [data]
+            done = False
+            while not done and len(chunks) < 1000:
+                try:
+                    data = self.queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if data is None:
+                    done = True
+                else:
+                    chunks.append(data)
+            self.fileobj.write(''.join(chunks))
+            for _ in range(len(chunks) + done):
+                self.queue.task_done()
+            if done:
+                break
+
+    def flush(self):
+        """Block until everything queued so far has been handed to the file.
+        Gives up after CLOSE_TIMEOUT seconds, or at once if the writer thread is gone.
+        Returns whether everything was written.
+        """
+        deadline = time.time() + CLOSE_TIMEOUT
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.thread.is_alive():
+                    return False
+                # Wake up now and then to see if the thread died
+                self.queue.all_tasks_done.wait(min(remaining, 0.1))
+        return True
+
+    def close(self):
+        """Write out everything queued and close the file.
+        Gives up if the writer thread died (nothing takes from the queue) or is stuck
+        for more than CLOSE_TIMEOUT seconds.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        ended = False
+        if self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=CLOSE_TIMEOUT)
+                ended = True
+            except Queue.Full:
+                pass
+        if not ended:
+            logger.error("Writer for {} is gone, {} writes left unwritten".\
+                         format(self.filepath, self.queue.qsize()))
+            if not self.thread.is_alive():
+                self.fileobj.close()
+            return
+        self.thread.join(CLOSE_TIMEOUT)
+        if self.thread.is_alive():
+            logger.error("Writer for {} is stuck, gave up waiting for it".format(self.filepath))
+            return
+        if self.dropped:
+            logger.warn("Dropped {} writes to {}, the disk couldn't keep up".\
+                        format(self.dropped, self.filepath))
+
+class AsyncLogHandler(logging.Handler):
+    def __init__(self, filepath, level=logging.NOTSET):
+        """A logging handler that writes to filepath in the background.
+        """
+        logging.Handler.__init__(self, level)
+        self.writer = AsyncWriter(filepath)
+
+    def emit(self, record):
+        try:
+            self.writer.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+        logging.Handler.close(self)
+
+class FlightRecorder(object):
+    def __init__(self, size=RECORDER_SIZE):
+        """Remembers the last size lines and decisions, to dump when we crash.
+        """
+        self.entries = collections.deque(maxlen=size)
+
+    def record(self, text):
+        self.entries.append((time.time(), text))
+
+    def dump(self, fileobj):
+        for when, text in self.entries:
+            fileobj.write("{} {}\n".format(time.strftime('%H:%M:%S', time.localtime(when)),
+                                           text.rstrip('\n')))
+
+class RecorderHandler(logging.Handler):
+    def __init__(self, recorder, level=logging.INFO):
+        """A logging handler that keeps records in a FlightRecorder.
+        """
+        logging.Handler.__init__(self, level)
+        self.recorder = recorder
+
+    def emit(self, record):
+        self.recorder.record("[{}] {}".format(record.name, record.getMessage()))
+
+def install_crash_handler(crash_filepath, recorder, closeables=()):
+    """On an unhandled exception, write the backtrace and the flight recorder
+    to crash_filepath, then close everything in closeables and flush the logs.
+    """
+    previous_hook = sys.excepthook
+
+    def crash_handler(exc_type, exc_value, exc_tb):
+        try:
+            with open(crash_filepath, 'w') as f:
+                f.write(''.join(traceback.format_exception(exc_type, exc_value, exc_tb)))
+                f.write("\nMost recent lines and decisions:\n")
+                recorder.dump(f)
+            for closeable in closeables:
+                closeable.close()
+            logging.shutdown()
+        finally:
+            previous_hook(exc_type, exc_value, exc_tb)
+
+    sys.excepthook = crash_handler
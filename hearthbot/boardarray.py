@@ -0,0 +1,171 @@
+"""
+Each side of the board as columns of ints, for doing the maths on many boards at once.
+
+A Board has SLOTS rows: the hero in row HERO and up to 7 minions after it in
+board order. Every column (attack, health, damage, armor, flags, active, pos)
+is an array.array of C longs, so numpy can look at it without copying
+(numpy.frombuffer). Empty rows are all 0.
+
+A GameState keeps one Board per player for the whole game (see
+GameState.board), and syncing it only writes the rows that changed.
+Boards can be filled from a snapshot.Snapshot too, to score the boards a
+planner tries out.
+
+numpy is optional: without it every function here does the same in plain
+Python.
+"""
+
+import array
+import logging
+
+from carddata import TAUNT, DIVINE_SHIELD
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger('BOARD')
+
+FIELDS = ('attack', 'health', 'damage', 'armor', 'flags', 'active', 'pos')
+# The hero and 7 minions
+SLOTS = 8
+HERO = 0
+EMPTY_ROW = (0,) * len(FIELDS)
+
+def card_row(card):
+    """Returns the values of card in FIELDS order.
+    """
+    return (card.attack, card.health, card.damage, card.armor, card.flags,
+            int(card.active), card.pos or 0)
+
+class Board(object):
+    def __init__(self):
+        """An empty board (see the module docstring).
+        """
+        # field -> array of SLOTS values
+        self.columns = dict((field, array.array('l', [0] * SLOTS)) for field in FIELDS)
+        # The card id in each row, None for an empty row
+        self.ids = [None] * SLOTS
+        # What was last written to each row, to only write rows that changed
+        self.rows = [EMPTY_ROW] * SLOTS
+        self.size = 0
+        # How many rows have been written, for seeing that syncing is incremental
+        self.writes = 0
+
+    def __repr__(self):
+        return "Board({})".format(", ".join("{}:{}/{}".format(self.ids[i], self.rows[i][0],
+                                                              self.rows[i][1] - self.rows[i][2])
+                                           for i in range(SLOTS) if self.ids[i] is not None))
+
+    def fill(self, hero, minions):
+        """Make the board hold hero (or None) and minions (in board order).
+        Only rows whose card or values changed are written.
+        """
+        if len(minions) > SLOTS - 1:
+            logger.warn("{} minions on one board, only keeping {}".format(len(minions), SLOTS - 1))
+            minions = minions[:SLOTS - 1]
+        self.size = len(minions)
+        cards = [hero] + list(minions) + [None] * (SLOTS - 1 - len(minions))
+        for slot, card in enumerate(cards):
+            if card is None:
+                card_id, row = None, EMPTY_ROW
+            else:
+                card_id, row = card.id, card_row(card)
+            if card_id != self.ids[slot] or row != self.rows[slot]:
+                self.write(slot, card_id, row)
+
+    def write(self, slot, card_id, row):
+        self.ids[slot] = card_id
+        self.rows[slot] = row
+        for field, value in zip(FIELDS, row):
+            self.columns[field][slot] = value
+        self.writes += 1
+
+    def sync(self, player):
+        """Bring the board up to date with a state.Player.
+        """
+        self.fill(player.hero, player.minions)
+
+    def sync_snapshot(self, snapshot, side):
+        """Fill the board from one snapshot.Side of a snapshot.
+        """
+        hero = snapshot.card(side.hero) if side.hero is not None else None
+        self.fill(hero, snapshot.minions(side))
+
+    def column(self, field):
+        """Returns a column: a numpy array sharing the board's memory if we have numpy,
+        else the array.array itself.
+        """
+        if numpy is not None:
+            return numpy.frombuffer(self.columns[field], dtype=numpy.int_)
+        return self.columns[field]
+
+    def hero_health(self):
+        """Returns what it takes to kill the hero (health left plus armor), or 0 without one.
+        """
+        if self.ids[HERO] is None:
+            return 0
+        attack, health, damage, armor = self.rows[HERO][:4]
+        return health - damage + armor
+
+    def has_taunt(self):
+        return any(row[4] & TAUNT for row in self.rows[HERO + 1:])
+
+def total_attack(board):
+    """Returns the attack of the characters on board that can still attack.
+    """
+    if numpy is not None:
+        return int((board.column('attack') * board.column('active')).sum())
+    columns = board.columns
+    return sum(a for a, active in zip(columns['attack'], columns['active']) if active)
+
+def is_lethal(attackers, defenders):
+    """Returns True if the active characters of attackers can go face and kill the
+    hero of defenders this turn, which they can't past a taunt.
+    """
+    if defenders.ids[HERO] is None or defenders.has_taunt():
+        return False
+    return total_attack(attackers) >= defenders.hero_health()
+
+def kill_matrix(attackers, defenders):
+    """Returns which enemy minions each attacker can kill on its own:
+    result[i][j] is True if row i of attackers can attack and kill minion row j of defenders
+    (the hero row of defenders is never killable this way). A numpy bool array with numpy,
+    else a list of lists.
+    """
+    if numpy is not None:
+        attack = attackers.column('attack') * (attackers.column('active') != 0)
+        remaining = defenders.column('health') - defenders.column('damage')
+        killable = (remaining > 0) & ((defenders.column('flags') & DIVINE_SHIELD) == 0)
+        killable[HERO] = False
+        return (attack[:, None] >= remaining[None, :]) & (attack[:, None] > 0) & killable[None, :]
+
+    att_cols, def_cols = attackers.columns, defenders.columns
+    remaining = [h - d for h, d in zip(def_cols['health'], def_cols['damage'])]
+    killable = [slot != HERO and remaining[slot] > 0 and not def_cols['flags'][slot] & DIVINE_SHIELD
+                for slot in range(SLOTS)]
+    matrix = []
+    for attack, active in zip(att_cols['attack'], att_cols['active']):
+        can_attack = bool(active) and attack > 0
+        matrix.append([can_attack and killable[j] and attack >= remaining[j]
+                       for j in range(SLOTS)])
+    return matrix
+
+def score_boards(boards):
+    """Returns the score of each board in boards: the attack plus health left of its
+    minions (not its hero). A numpy array with numpy, else a list.
+    """
+    if numpy is not None:
+        if not boards:
+            return numpy.zeros(0)
+        stacked = dict((field, numpy.vstack([b.column(field) for b in boards]))
+                       for field in ('attack', 'health', 'damage'))
+        minions = slice(HERO + 1, SLOTS)
+        return (stacked['attack'][:, minions] + stacked['health'][:, minions]
+                - stacked['damage'][:, minions]).sum(axis=1)
+
+    scores = []
+    for board in boards:
+        scores.append(sum(row[0] + row[1] - row[2] for row in board.rows[HERO + 1:]))
+    return scores
@@ -6,15 +6,18 @@ This is Tingle's brain.
 - Minions spawned by special abilities aren't used to attack with:
     - Turns out hoggers gnoll wasn't introduced into the logs until after our turn started. 
       which means tingle thought it was still inactive. 
-- Minions with divine shield screw up attack calculation. (todo)
 """
 
 import logging, time, os
 #import itertools
 #import copy # for deep copies with copy.deepcopy
-from pprint import pformat
 
-from hearthbot import control, cardlogger, kooloolimpah, botalgs
+from hearthbot import control, cardlogger, kooloolimpah, botalgs, deck
+from hearthbot.tailer import LogTailer
+from hearthbot import archive, checkpoint, hotlog
+from hearthbot.positions import PositionCache
+from hearthbot.hotlog import pretty
+from hearthbot.changes import GAME_STARTED, TURN_STARTED, CARD_DRAWN, GAME_OVER
 from hearthbot import TINGLE_LOGS
 
 # The file for the hearthstone log
@@ -23,55 +26,24 @@ hearthstone_log = os.path.expanduser("~/Library/Logs/Unity/Player.log")
 # The global state of the game, used to make decisions about things.
 gstate = None
 
-logger = logging.getLogger('BOT')
+# Feeds the log to the parser as it is written
+tailer = None
 
-def attack_them(us, minions, minions_attacked, parser):
-    """Attack the list of minions provided.
-    The minions are guaranteed to be attacked.
-    Returns:
-        A list of friendly minions that have not yet attacked.
-    """
-    logger.info("Focus firing on minions: {}".format(minions))
-    us_remain = us[:]
-    them = minions[:]
-    them.sort(cmp=botalgs.highest_attack_cmp)
-    for enemy in them:
-        logger.info("Focus firing on {}".format(enemy))
-        # If we can kill this minion, do it
-        attackers = botalgs.can_kill_minion(us_remain, enemy)
-        if attackers:
-            # Since we are attacking with these, remove them from future calculations
-            for m in attackers:
-                us_remain.remove(m)
-            # Perform the attack
-                attack_minion(m, enemy)
-                minions_attacked.append(m)
-                parser.process_log()
-            # Remove the enemy from our temporary calculation
-            them.remove(enemy)
-
-    # If we haven't attacked all enemies, and we still have minions able, attack them anyway
-    if them and us_remain:
-        # Pick the weakest one
-        them.sort(cmp=lambda x,y: int(x.remaining_health()) < int(y.remaining_health()))
-        for enemy in them:
-            for m in us_remain:
-                # If we've killed this enemy, stop attacking it
-                if enemy.remaining_health() <= 0:
-                    break
-                us_remain.remove(m)
-                attack_minion(m, enemy)
-                minions_attacked.append(m)
-                parser.process_log()
-
-    assert (not [enemy for enemy in them if enemy.remaining_health() > 0]) or \
-        (not us_remain), \
-        "Enemies remain that have not been killed despite us having minions available to attack"
-    return us_remain
+# Where our cards and minions will be once the actions we took show up in the log
+positions = PositionCache()
+
+# The most recent log lines and decisions, dumped to crash.log if we die.
+recorder = archive.FlightRecorder()
+
+logger = hotlog.getLogger('BOT')
+
+# Levels for subsystems that log too much on the hot paths, e.g. {'ALGS': logging.INFO}
+SUBSYSTEM_LEVELS = {}
+# Also trace every message to trace.hbt in the game directory (see hotlog.read_trace)
+TRACE = False
 
 def attack_phase(parser):
     logger.debug("Attack phase")
-    # Make shallow copies so we can get updated locations of minions when others die
     us = gstate.tingle.minions[:]
     them = gstate.opponent.minions[:]
     minions_attacked = []
@@ -79,61 +51,33 @@ def attack_phase(parser):
     # Can't attack if we have none
     if not us:
         return
+    # Attacks are clicked where the cache says the minions will be, without waiting
+    positions.sync(gstate)
+    actions_before = parser.actions_completed
 
     # These are the potential attackers (they must be active to attack)
     us_remain = [m for m in us if m.active]
     # They must have attack value to attack
-    us_remain = [m for m in us_remain if int(m.attack) > 0]
-
-    logger.debug("Minions available to attack:\n{}".\
-                 format(pformat(us_remain)))
-
-    # Attack any minions with taunt first
-    taunters = [m for m in them if 'Taunt' in m.mechanics]
-    us_remain = attack_them(us_remain, taunters, minions_attacked, parser)
-
-    logger.debug("Minions remaining after taking out taunters:\n{}".\
-                 format(pformat(us_remain)))
-
-    # If we don't have any remaining, continue with attack
-    if not us_remain:
-        return
-
-    # Recalculate minions after attacking taunters
-    them = gstate.opponent.minions[:]
-
-    logger.debug("Enemy minions remaining to take out:\n{}".\
-                 format(pformat(them)))
-    
-    # Order them by highest attacks
-    them.sort(cmp=botalgs.highest_attack_cmp)
-    for enemy in them:
-        # If we can kill this minion, do it
-        attackers = botalgs.can_kill_minion(us_remain, enemy)
-        if attackers:
-            # Since we are attacking with these, remove them from future calculations
-            for m in attackers:
-                # If the minion got killed, stop trying
-                if enemy.remaining_health() <= 0:
-                    break
-                
-                us_remain.remove(m)
-                # Perform the attack
-                attack_minion(m, enemy)
-                minions_attacked.append(m)
-                parser.process_log()
-
-    # If we have any minions left over, attack the hero
-    for m in us_remain:
-        attack_hero(m)
-        minions_attacked.append(m)
-        parser.process_log()
-
-    # Here lies a bug: we may think we are attacking with a minion, but we click
-    # on the wrong one
-    time.sleep(1)
-    parser.process_log()
-    active_minions = [m for m in gstate.tingle.minions[:] if m.active and int(m.attack) > 0]
+    us_remain = [m for m in us_remain if m.attack > 0]
+
+    logger.debug("Minions available to attack:\n{}",
+                 pretty(us_remain))
+
+    # Decide every attack at once: taunts first, then the trades worth most, the rest face
+    trade = botalgs.plan_attacks(us_remain, them, hero=gstate.opponent.hero)
+    logger.info("Attack plan: {}", trade)
+    for attacker, defender in trade.attacks:
+        if defender is None:
+            attack_hero(attacker)
+        else:
+            attack_minion(attacker, defender)
+        minions_attacked.append(attacker)
+
+    # Wait for every attack to show up, and check the cache clicked the right minions
+    wait_for_board(actions_before, timeout=len(minions_attacked) + 1,
+                   actions=len(minions_attacked))
+    positions.reconcile(gstate)
+    active_minions = [m for m in gstate.tingle.minions[:] if m.active and m.attack > 0]
     assert not active_minions , \
         "Attack phase complete, but some minions did not attack: {}\nThought I attacked with {}".format(active_minions, minions_attacked)
 
@@ -144,24 +88,26 @@ def attack_hero(attacker):
     Store a secret object locally. If we attack, and nothing happens (secret still there), 
     move at full pace. If the secret triggers, wait, then move at full pace anyway.
     """
-    my_num_minions = len(gstate.tingle.minions)
-    control.my_click_on_minion(my_num_minions, int(attacker.pos))
+    control.my_click_on_minion(positions.board_size(gstate.tingle.name),
+                               positions.board_slot(attacker))
     control.click_opponent_hero()
+    positions.predict_attack(attacker)
 
 def attack_minion(attacker, defender):
     """Use the attacking minion to attack the defending one.
-    Wait for kill animation to end, as gstate needs to update minion count.
+    Don't wait for the kill animation: the position cache predicts which minions
+    are left and where.
     """
-    logger.info("Attack {} -> {}".format(attacker, defender))
-    my_num_minions = len(gstate.tingle.minions)
-    their_num_minions = len(gstate.opponent.minions)
+    logger.info("Attack {} -> {}", attacker, defender)
+    my_num_minions = positions.board_size(gstate.tingle.name)
+    their_num_minions = positions.board_size(gstate.opponent.name)
     assert my_num_minions
     assert their_num_minions
     assert attacker.zone == "PLAY"
     assert defender.zone == "PLAY"
-    control.my_click_on_minion(my_num_minions, int(attacker.pos))
-    control.opponent_click_on_minion(their_num_minions, int(defender.pos))
-    time.sleep(2)
+    control.my_click_on_minion(my_num_minions, positions.board_slot(attacker))
+    control.opponent_click_on_minion(their_num_minions, positions.board_slot(defender))
+    positions.predict_attack(attacker, defender)
     
 def play_phase(parser):
     """Decide which cards to play and play them.
@@ -170,29 +116,43 @@ def play_phase(parser):
     """
     logger.debug("Play phase start")
 
-    (total, cards) = botalgs.cards_to_play(gstate.tingle)
-    logger.debug("Going to play {} with {} mana".format(cards, total))
+    # Leave mana for the hero power if we'd play as many cards anyway
+    (total, cards, hero_power) = botalgs.cards_to_play(gstate.tingle, botalgs.HERO_POWER_COST)
+    logger.debug("Going to play {} with {} mana (hero power: {})", cards, total, hero_power)
 
-    if total + 2 <= gstate.tingle.mana_available():
+    if hero_power:
         # We should play the draw ability first and recalculate
         logger.info("Avail mana is greater than what we can spend; using hero power and recalculating")
         play_hero_ability()
         parser.process_log()
-        (total, cards) = botalgs.cards_to_play(gstate.tingle)
+        (total, cards, hero_power) = botalgs.cards_to_play(gstate.tingle)
     
+    # Play them back to back, the cache knows where the rest of the hand moves to
+    positions.sync(gstate)
+    actions_before = parser.actions_completed
     for card in cards:
-        num_in_hand = len(gstate.tingle.hand)
-        control.play_minion(num_in_hand, int(card.pos))
-        # We need this to get the new position of cards
-        # TODO: With a built-in cache we could predict the future positions of minions that die
-        # (assuming they don't have side-effects)
-        time.sleep(2)
-        parser.process_log()
+        control.play_minion(positions.hand_size(), positions.hand_index(card))
+        positions.predict_play(card)
+    if cards:
+        wait_for_board(actions_before, timeout=2 * len(cards), actions=len(cards))
+        positions.reconcile(gstate)
 
 def play_hero_ability():
+    actions_before = tailer.parser.actions_completed
     control.use_hero_ability()
     gstate.tingle.spend_mana(2)
-    time.sleep(2)
+    wait_for_board(actions_before)
+
+def wait_for_board(actions_before, timeout=2, actions=1):
+    """Wait for the actions we just took to show up in the game state: the attack or
+    play block of each has been applied since actions_before (parser.actions_completed),
+    and no block is half applied.
+    Gives up after timeout seconds (the old fixed sleep).
+    """
+    parser = tailer.parser
+    if not tailer.wait_until(lambda: parser.actions_completed >= actions_before + actions and \
+                             parser.board_is_consistent(), timeout):
+        logger.warn("Board did not settle within {}s", timeout)
         
 def hero_power_phase():
     """Plays our hero power if we have enough mana.
@@ -206,21 +166,29 @@ def config_main_logging(game_dir):
     """
     global logger
     os.mkdir(game_dir)
-    # The root logger (everything) logs to the log file at debug level
-    logging.basicConfig(level=logging.DEBUG,
-                        format='%(asctime)s [%(name)-8s] - <%(levelname)-5s> %(message)s',
-                        datefmt='%mm:%dd-%H:%M:%S',
-                        filename=os.path.join(game_dir, 'tingle.log'),
-                        filemode='w')
+    root = logging.getLogger('')
+    root.setLevel(logging.DEBUG)
+    # The root logger (everything) logs to the compressed log file at debug level.
+    # It's written from a background thread so the disk never holds up a turn.
+    tingle_log = archive.AsyncLogHandler(os.path.join(game_dir, 'tingle.log.gz'))
+    tingle_log.setFormatter(logging.Formatter('%(asctime)s [%(name)-8s] - <%(levelname)-5s> %(message)s',
+                                              datefmt='%mm:%dd-%H:%M:%S'))
+    root.addHandler(tingle_log)
     # And logs to the console at info level
     console = logging.StreamHandler()
     console.setLevel(logging.INFO)
     # Simple console format
     formatter = logging.Formatter('%(name)-8s: <%(levelname)-5s> %(message)s')
     console.setFormatter(formatter)
-    logging.getLogger('').addHandler(console)
-
-    logger = logging.getLogger('BOT')
+    root.addHandler(console)
+    # Decisions are kept in the flight recorder for crash reports
+    root.addHandler(archive.RecorderHandler(recorder))
+    for name, level in SUBSYSTEM_LEVELS.items():
+        hotlog.set_level(name, level)
+    if TRACE:
+        hotlog.set_trace(hotlog.TraceSink(os.path.join(game_dir, 'trace.hbt')))
+
+    logger = hotlog.getLogger('BOT')
     logger.debug("Logging configured for Tingle")
 
 def main():
@@ -230,9 +198,9 @@ def main():
     # TODO: Append the name of the heroes after the game is played
     game_dir = os.path.join(TINGLE_LOGS, time.strftime('%Y_%m_%d__%H_%M__'))
     config_main_logging(game_dir)
-    hs_log_copy = os.path.join(game_dir, 'hearthstone.log')
+    hs_log_copy = os.path.join(game_dir, 'hearthstone.log.gz')
 
-    global gstate
+    global gstate, tailer
     logger.info("STARTING IN 5 SECONDS")
     time.sleep(5)
     logger.info("Tingle Tingle! Kooloo limpah!")
@@ -240,15 +208,24 @@ def main():
     
     parser = cardlogger.Parser(hearthstone_log, hs_log_copy)
     parser.reset_log()
+    parser.recorder = recorder
     gstate = parser.gstate
+    gstate.set_deck(deck.load_deck(deck.BOT_DECK))
+    # The state at every turn and decision, to pick the game up again after a crash
+    checkpoints = checkpoint.CheckpointWriter(os.path.join(game_dir, checkpoint.CHECKPOINT_FILENAME))
+    checkpoints.follow(gstate)
+    archive.install_crash_handler(os.path.join(game_dir, 'crash.log'), recorder,
+                                  [parser, checkpoints])
+    tailer = LogTailer(parser)
+    # The changes the main loop waits on
+    changes = gstate.changes.subscribe([GAME_STARTED, TURN_STARTED, CARD_DRAWN, GAME_OVER])
     
     control.start_game()
 
     # Wait for game to load (we have cards in hand)
     while not gstate.game_started:
-        logger.info("Waiting for game state to start: {}".format(gstate))
-        time.sleep(2)
-        parser.process_log()
+        logger.info("Waiting for game state to start: {}", gstate)
+        tailer.wait_for_change(changes, 2)
 
     logger.info("Game started. Waiting for setup animation to complete (20s)")
     time.sleep(20)
@@ -262,36 +239,31 @@ def main():
     time.sleep(10)
 
     while not gstate.game_ended:
-        parser.process_log()
+        tailer.poll()
         
         # Wait for our turn
-        while not gstate.turn == "OURS":
+        while not gstate.turn == "OURS" and not gstate.game_ended:
             logger.info("Waiting for our turn...")
-            parser.process_log()
-            time.sleep(5)
+            tailer.wait_for_change(changes, 5)
 
         # Wait to draw a card
-        while not gstate.drew_card_this_turn:
+        while not gstate.drew_card_this_turn and not gstate.game_ended:
             logger.info("Waiting to draw a card...")
-            time.sleep(4)
-            parser.process_log()
+            tailer.wait_for_change(changes, 4)
+
+        if gstate.game_ended:
+            break
 
         # Animations may still be moving around
-        current_log_position = parser.pos
-        time.sleep(2)
-        parser.process_log()
-        while current_log_position != parser.pos:
-            logger.info("Log is still printing, waiting for it to queisce...")
-            current_log_position = parser.pos
-            time.sleep(2)
-            parser.process_log()
+        tailer.wait_for_quiet(2)
             
         # Play minions
         logger.info("*"*10)
         logger.info("Play Phase")
         logger.info("*"*10)
         logger.info("Tingle's Hand: ")
-        logger.info("{}".format(pformat(gstate.tingle.hand)))
+        logger.info("{}", pretty(gstate.tingle.hand))
+        checkpoints.write(gstate, "play phase")
         play_phase(parser)
         parser.process_log()
 
@@ -308,16 +280,22 @@ def main():
         logger.info("*"*10)
         logger.info("Attack Phase")
         logger.info("*"*10)
-        logger.info("{}".format(pformat(gstate.tingle.minions)))
+        logger.info("{}", pretty(gstate.tingle.minions))
+        checkpoints.write(gstate, "attack phase")
         attack_phase(parser)
         parser.process_log()
 
         # End turn
         control.end_turn()
-        # At least 10 seconds to get into the opponent's turn and start waiting.
-        time.sleep(10)
+        # What happened this turn doesn't matter any more; wait for the opponent's turn
+        changes.clear()
+        tailer.wait_for_change(changes, 10)
 
     logger.info("BOT: Game done")
+    parser.close()
+    checkpoints.close()
+    if hotlog.trace:
+        hotlog.trace.close()
 
 
 if __name__ == '__main__':
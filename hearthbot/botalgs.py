@@ -4,57 +4,335 @@ Strategies and functions for doing attacks and trading minions.
 Try to keep this module state and control free.
 """
 
-import logging
-import itertools
-#import copy # for deep copies with copy.deepcopy
-from pprint import pformat
+#import copy # for deep copies with copy.deepcopy (gstate.snapshot() is cheaper)
 
-from hearthbot import state
+from hearthbot import state, hotlog
+from hearthbot.carddata import TAUNT, DIVINE_SHIELD
+from hearthbot.hotlog import pretty
 
-logger = logging.getLogger('ALGS')
+logger = hotlog.getLogger('ALGS')
 
 ###
 # Attacking
 ###
 
-def highest_attack_cmp(min1, min2):
-    if int(min1.attack) < int(min2.attack):
-        return -1
-    elif int(min1.attack) > int(min2.attack):
-        return 1
-    else:
+class TradeObjective(object):
+    """What plan_attacks maximizes: the value of the enemy minions killed plus the damage
+    done to the enemy hero, less the value of our minions that die.
+    Subclass it and override the values to go for something else.
+    """
+    # Worth of each point of damage to the enemy hero
+    face_value = 1
+
+    def minion_value(self, minion):
+        return 2 * minion.attack + minion.remaining_health()
+
+    def kill_value(self, minion):
+        """Worth of killing an enemy minion.
+        """
+        return self.minion_value(minion)
+
+    def loss_value(self, minion):
+        """Cost of losing one of our minions.
+        """
+        return self.minion_value(minion)
+
+class LethalObjective(TradeObjective):
+    """Only the damage done to the enemy hero counts.
+    """
+    def kill_value(self, minion):
         return 0
 
-def can_kill_minion(min_list, minion):
-    """Returns a subset of minions that can be used to attack the
-    minion and kill it. Else, returns None.
-    Use as few minions as possible to kill minion.
-        - We'd have to change this to look at combinations that keep as many alive.
-    Don't worry about keeping as many minions alive as possible yet.
-    
-    Args:
-        min_list - List of state.Minion
-        minion - A state.Minion to kill
+    def loss_value(self, minion):
+        return 0
+
+class Trade(object):
+    def __init__(self, score=0):
+        """A plan for the attack phase, made by plan_attacks.
+        """
+        self.score = score
+        # (attacker, defender) in the order to attack, defender None for the enemy hero
+        self.attacks = []
+        # Enemy minions killed, and our minions that die doing it
+        self.killed = []
+        self.lost = []
+        # Damage done to the enemy hero
+        self.face = 0
+
+    def __repr__(self):
+        return "Trade(score {}, face {}, killed {}, lost {})".format(self.score, self.face,
+                                                                   self.killed, self.lost)
+
+def dies_attacking(attacker, defender):
+    return defender.attack > 0 and not attacker.has(DIVINE_SHIELD) and \
+        defender.attack >= attacker.remaining_health()
+
+def killing_sets(attackers, defender, objective, total, weakest):
+    """Returns [(mask, value)] of the sets of attackers (bit i for attackers[i]) that kill
+    defender with none to spare, best first. value is the kill less our minions that die
+    doing it.
+
+    With attackers sorted strongest first, a set has none to spare if it kills defender
+    and doesn't without its weakest. Attacking weakest first (to take a divine shield)
+    and strongest last, everyone in it then attacks while defender is alive.
+    """
+    health = defender.remaining_health()
+    shield = defender.has(DIVINE_SHIELD)
+    kill = objective.kill_value(defender)
+    losses = [objective.loss_value(a) if dies_attacking(a, defender) else 0 for a in attackers]
+    # Damage dealt and value of each set
+    dealt = [0] * len(total)
+    value = [kill] * len(total)
+    sets = []
+    for mask in range(1, len(total)):
+        low = weakest[mask]
+        rest = mask & ~(1 << low)
+        dealt[mask] = total[mask] - attackers[low].attack if shield else total[mask]
+        value[mask] = value[rest] - losses[low]
+        if dealt[mask] >= health and dealt[rest] < health:
+            sets.append((mask, value[mask]))
+    sets.sort(key=lambda s: -s[1])
+    return sets
+
+def kill_order(attackers, mask, defender):
+    """Returns the indexes of the attackers in mask in an order that kills defender with
+    each of them attacking while it's alive, or None if there's none.
+
+    The strongest goes last. With a divine shield, the first one only takes the shield:
+    it has to leave the others enough to kill without the strongest.
     """
-    logger.debug("can_kill_minion start - {}\nTo Kill:{}".format(min_list, minion))
-    for i in range(1, len(min_list)+1):
-        candidates = itertools.combinations(min_list, i)
-        #best_candidate = None   # use later
-        for c in candidates:
-            # Evaluate this candidate list
-            minion_health = int(minion.remaining_health())
-            # For every minion in this list of candidates
-            for m in c:
-                minion_health -= int(m.attack)
-
-            # this candidate list kills the minion
-            if minion_health <= 0:
-                logger.debug("can_kill_minion end - {}".format(c))
-                return c
-
-    logger.debug("can_kill_minion end - no candidates")
+    order = [i for i in range(len(attackers)) if mask & (1 << i)]
+    order.sort(key=lambda i: attackers[i].attack)
+    health = defender.remaining_health()
+    dealt = sum(attackers[i].attack for i in order)
+    before_last = dealt - attackers[order[-1]].attack
+    if not defender.has(DIVINE_SHIELD):
+        return order if dealt >= health and before_last < health else None
+    for k, i in enumerate(order[:-1]):
+        if dealt - attackers[i].attack >= health and before_last - attackers[i].attack < health:
+            return [i] + order[:k] + order[k + 1:]
     return None
 
+def hit_taunts(attackers, taunts, objective, total, beat=None):
+    """Returns the best Trade that sends every attacker at a taunt and leaves one alive,
+    or None if it can't score more than beat.
+
+    Each taunt gets any set of the attackers: one that kills it, all of them attacking
+    while it's alive, or one that doesn't. Unlike search_trades every set counts, since
+    the attackers can't go anywhere else.
+    """
+    full = len(total) - 1
+    # options[j][mask]: [(value, kills)] of the ways the attackers in mask can all attack
+    # taunts[j], killing it or not
+    options = []
+    for taunt in taunts:
+        health = taunt.remaining_health()
+        shield = taunt.has(DIVINE_SHIELD)
+        lost = [0] * len(total)
+        option = [[(0, False)]] + [[] for mask in range(full)]
+        for mask in range(1, len(total)):
+            # Attackers are strongest first, so that's the lowest bit
+            strongest = (mask & -mask).bit_length() - 1
+            rest = mask & ~(1 << strongest)
+            lost[mask] = lost[rest]
+            if dies_attacking(attackers[strongest], taunt):
+                lost[mask] += objective.loss_value(attackers[strongest])
+            # Strongest first, so a divine shield takes the most
+            if total[mask] - (attackers[strongest].attack if shield else 0) < health:
+                option[mask].append((-lost[mask], False))
+            if kill_order(attackers, mask, taunt) is not None:
+                option[mask].append((objective.kill_value(taunt) - lost[mask], True))
+        options.append(option)
+    upper = [0] * (len(taunts) + 1)
+    for j in reversed(range(len(taunts))):
+        upper[j] = upper[j + 1] + max(v for o in options[j] for v, kills in o)
+    if beat is not None and upper[0] <= beat:
+        return None
+
+    # (j, attackers left, a taunt left alive) -> (best score from there, sets chosen)
+    memo = {}
+    def search(j, mask, alive):
+        key = (j, mask, alive)
+        if key in memo:
+            return memo[key]
+        best = (None, None)
+        if j == len(taunts) - 1:
+            # The last taunt takes everyone left
+            for value, kills in options[j][mask]:
+                if (alive or not kills) and (best[0] is None or value > best[0]):
+                    best = (value, ((j, mask, kills), None))
+            memo[key] = best
+            return best
+        sub = mask
+        while True:
+            for value, kills in options[j][sub]:
+                if best[0] is not None and value + upper[j + 1] <= best[0]:
+                    continue
+                score, sets = search(j + 1, mask & ~sub, alive or not kills)
+                if score is not None and (best[0] is None or value + score > best[0]):
+                    best = (value + score, ((j, sub, kills), sets))
+            if not sub:
+                break
+            sub = (sub - 1) & mask
+        memo[key] = best
+        return best
+
+    (score, sets) = search(0, full, False)
+    if score is None or beat is not None and score <= beat:
+        return None
+    trade = Trade(score)
+    while sets:
+        (j, mask, kills), sets = sets
+        taunt = taunts[j]
+        if kills:
+            order = kill_order(attackers, mask, taunt)
+            trade.killed.append(taunt)
+        else:
+            # Strongest first
+            order = [i for i in range(len(attackers)) if mask & (1 << i)]
+        for i in order:
+            trade.attacks.append((attackers[i], taunt))
+            if dies_attacking(attackers[i], taunt):
+                trade.lost.append(attackers[i])
+    return trade
+
+def search_trades(attackers, defenders, taunts, objective, total, weakest, beat=None):
+    """Returns the best Trade that kills every taunt, or None if the attackers can't or
+    can't score more than beat.
+    """
+    full = len(total) - 1
+    face = objective.face_value
+    # Taunts first, then the most valuable
+    order = taunts + sorted([d for d in defenders if d not in taunts],
+                            key=lambda d: -objective.kill_value(d))
+    sets = [killing_sets(attackers, d, objective, total, weakest) for d in order]
+    must_kill = [d in taunts for d in order]
+
+    for j in range(len(order)):
+        if not must_kill[j]:
+            # A kill worth less than its killers' damage to the hero is never better than
+            # leaving the defender: they can go for the hero instead
+            sets[j] = [(mask, v) for mask, v in sets[j] if v > face * total[mask]]
+        sets[j].sort(key=lambda s: face * total[s[0]] - s[1])
+
+    # The most each defender can add over sending its killers at the hero
+    gains = []
+    for j in range(len(order)):
+        if not sets[j]:
+            if must_kill[j]:
+                return None
+            gains.append(0)
+            continue
+        best_set = face * -total[sets[j][0][0]] + sets[j][0][1]
+        gains.append(best_set if must_kill[j] else max(best_set, 0))
+    upper = [0] * (len(order) + 1)
+    for j in reversed(range(len(order))):
+        upper[j] = upper[j + 1] + gains[j]
+    if beat is not None and face * total[full] + upper[0] <= beat:
+        return None
+
+    # (j, attackers left) -> (best score from there, kills chosen)
+    memo = {}
+    def search(j, mask):
+        key = (j, mask)
+        if key in memo:
+            return memo[key]
+        if j == len(order):
+            best = (face * total[mask], None)
+            memo[key] = best
+            return best
+
+        best = (None, None)
+        for kill_mask, value in sets[j]:
+            if kill_mask & mask != kill_mask:
+                continue
+            rest = mask & ~kill_mask
+            # Sets are best first, so this often stops the search early
+            if best[0] is not None and value + face * total[rest] + upper[j + 1] <= best[0]:
+                continue
+            score, kills = search(j + 1, rest)
+            if score is not None and (best[0] is None or value + score > best[0]):
+                best = (value + score, ((j, kill_mask), kills))
+        if not must_kill[j] and (best[0] is None or face * total[mask] + upper[j + 1] > best[0]):
+            score, kills = search(j + 1, mask)
+            if score is not None and (best[0] is None or score > best[0]):
+                best = (score, kills)
+        memo[key] = best
+        return best
+
+    (score, kills) = search(0, full)
+    if score is None or beat is not None and score <= beat:
+        return None
+
+    trade = Trade(score)
+    mask = full
+    while kills:
+        (j, kill_mask), kills = kills
+        mask &= ~kill_mask
+        defender = order[j]
+        # Weakest first, strongest last
+        for i in reversed(range(len(attackers))):
+            if kill_mask & (1 << i):
+                trade.attacks.append((attackers[i], defender))
+                if dies_attacking(attackers[i], defender):
+                    trade.lost.append(attackers[i])
+        trade.killed.append(defender)
+    for i, attacker in enumerate(attackers):
+        if mask & (1 << i):
+            trade.attacks.append((attacker, None))
+            trade.face += attacker.attack
+    return trade
+
+def plan_attacks(attackers, defenders, objective=None, hero=None):
+    """Returns the Trade that sends every attacker at an enemy minion or the enemy hero,
+    all decided at once, scoring best under objective (a TradeObjective).
+    If hero (the enemy hero) is given and the attackers can kill it, that's the plan.
+
+    Either every taunt is killed and the other attackers are free (search_trades), or
+    every attacker attacks a taunt and one is left alive (hit_taunts). Apart from hitting
+    taunts, attackers only attack a minion to kill it: damage that doesn't kill is worth
+    nothing.
+
+    The plans are searched over the defenders (taunts first), choosing which of the
+    attackers left attack each one, if any, remembering the best for every defender and
+    attackers left. A branch is cut as soon as even the best of every defender left
+    couldn't beat what's been found.
+
+    Args:
+        - attackers: Our minions that can attack
+        - defenders: The enemy minions
+        - objective: A TradeObjective, TradeObjective() if None
+        - hero: The enemy hero, to look for lethal
+    """
+    objective = objective or TradeObjective()
+    # Strongest first, so the weakest of a set is its highest bit
+    attackers = sorted(attackers, key=lambda m: -m.attack)
+    defenders = [d for d in defenders if d.remaining_health() > 0]
+    taunts = [d for d in defenders if d.has(TAUNT)]
+    # The attack of each set of attackers, and its weakest
+    total = [0] * (1 << len(attackers))
+    weakest = [0] * (1 << len(attackers))
+    for mask in range(1, len(total)):
+        low = mask.bit_length() - 1
+        weakest[mask] = low
+        total[mask] = total[mask & ~(1 << low)] + attackers[low].attack
+
+    if hero is not None:
+        lethal = search_trades(attackers, defenders, taunts, LethalObjective(), total, weakest)
+        if lethal and lethal.face >= hero.remaining_health() + hero.armor:
+            logger.info("Lethal: {}", lethal)
+            return lethal
+
+    trade = search_trades(attackers, defenders, taunts, objective, total, weakest)
+    if taunts:
+        hitting = hit_taunts(attackers, taunts, objective, total,
+                             trade.score if trade else None)
+        if hitting and (trade is None or hitting.score > trade.score):
+            trade = hitting
+    trade = trade or Trade()
+    logger.debug("Attack plan: {}", trade)
+    return trade
+
 ###
 # Spending
 ###
@@ -64,136 +342,150 @@ def cost_to_play_cards(cards):
     """
     total = 0
     for card in cards:
-        total += int(card.cost)
+        total += card.cost
     return total
 
-def spend_max_mana(player):
+# Minions a player can have on the board
+MAX_MINIONS = 7
+# What the hero power costs
+HERO_POWER_COST = 2
+
+def best_plays(hand, max_mana, slots=MAX_MINIONS):
+    """Returns the best play of hand for every amount of mana up to max_mana:
+    a list where [mana] is the (cards played, mana spent, indexes in hand) of the play
+    with the most cards that costs at most mana, spending as much as it can.
+    No more than slots cards are played.
+
+    It's a knapsack over (cards played, mana spent): for every card, every play
+    found so far that can take it makes a play of one more card. There are at most
+    (slots+1) * (max_mana+1) plays to keep, so it's cheap whatever the size of hand.
+    """
+    # reach[k][mana]: the indexes of k cards costing mana in all (the first found)
+    reach = [{} for k in range(slots + 1)]
+    reach[0][0] = ()
+    for i, card in enumerate(hand):
+        if card.cost > max_mana:
+            continue
+        # Fewest cards last, so a card only goes into plays made without it
+        for k in reversed(range(min(i, slots - 1) + 1)):
+            for mana, picked in reach[k].items():
+                total = mana + card.cost
+                if total <= max_mana and total not in reach[k + 1]:
+                    reach[k + 1][total] = picked + (i,)
+
+    # The best play costing at most mana is the best costing exactly that, or the best for less
+    best = []
+    play = (0, 0, ())
+    for mana in range(max_mana + 1):
+        for k in range(slots + 1):
+            if mana in reach[k] and (k, mana) > play[:2]:
+                play = (k, mana, reach[k][mana])
+        best.append(play)
+    return best
+
+def pick_play(best, mana, hero_power_cost=None):
+    """Returns the (mana spent, indexes in hand, use hero power) of the best play with mana,
+    from a best_plays table. With hero_power_cost, the hero power is used when a play of as
+    many cards leaves enough mana for it and spends more in all.
+    """
+    if mana < 0:
+        return (0, (), False)
+    play = best[mana]
+    spent, picked, hero_power = play[1], play[2], False
+    if hero_power_cost is not None and mana >= hero_power_cost:
+        power_play = best[mana - hero_power_cost]
+        if power_play[0] == play[0] and power_play[1] + hero_power_cost > spent:
+            spent, picked, hero_power = power_play[1] + hero_power_cost, power_play[2], True
+    return (spent, picked, hero_power)
+
+def spend_max_mana(player, slots=MAX_MINIONS, hero_power_cost=None):
     """Return how much mana would be spent this turn playing cards from hand, 
     and the cards needed to play them.
     
     Right now, play as many cards as possible.
 
     Args:
-        The player to play with.
+        - player: The player to play with.
+        - slots: The most minions that can be played (free board slots).
+        - hero_power_cost: If given, leave mana for the hero power when a play of
+          as many cards can (see pick_play).
     
     Returns:
-        (mana, cards) : (Int, [state.Card])
-        Returns (0, []) if no play is possible.
+        (mana, cards, hero_power) : (Int, [state.Card], Bool)
+        Returns (0, [], False) if no play is possible.
+        With the coin, the coin is the first card and mana counts it as 1 more.
+        hero_power is True if the play counts on using the hero power as well
+        (mana doesn't include it).
     
     Limitations:
         Only calculates mana spending with minions. Spell support forthcoming...
-
-    Notes:
-        This can easily be turned into a dynamic programming solution. Calculate 
-        the best play for every subset, then build up the solution.
-        best_play(mana, avail_cards) = 
-                [play_card(c_i)] + best_play(mana - cost(c_i), avail_cards - c_i)
     """
     avail_mana = player.mana_available()
     coin = player.has_card("The Coin")
     
-    logger.info("Spend max mana. Available mana to spend: {}".format(avail_mana))
+    logger.info("Spend max mana. Available mana to spend: {}", avail_mana)
     hand = player.hand[:] # shallow copy (so we still get updates to contents)
 
     # Remove any cards that are not minions
     hand = [c for c in hand if isinstance(c, state.Minion)]
-    # Remove any cards that cost more than the mana we can spend
-    coin_hand = [c for c in hand if c.cost <= (avail_mana + 1)]
-    hand = [c for c in hand if c.cost <= avail_mana]
 
-    logger.info("Cards that cost less than {}:\n{}".format(avail_mana, pformat(hand)))
-    play = play_with_max_mana(hand, avail_mana)
+    # One table has the plays with and without the coin
+    best = best_plays(hand, max(avail_mana + (1 if coin else 0), 0), slots)
+    (spent, picked, hero_power) = pick_play(best, avail_mana, hero_power_cost)
+    play = (spent - (hero_power_cost if hero_power else 0), [hand[i] for i in picked], hero_power)
 
-    logger.info("Potential play is: {} Mana\n{}".format(play[0], pformat(play[1])))
+    logger.info("Potential play is: {} Mana\n{}", play[0], pretty(play[1]))
     # If the play found without using the coin does not use the maximum amount of mana
-    if coin and (play[0] < avail_mana):
-        # Calculate a second play with the coin involved
+    if coin and (spent < avail_mana):
+        # Look for a better play with the coin involved
         logger.info("Coin detected and play is sub-optimal. Looking for better play...")
-        play_coin = play_with_max_mana(coin_hand, avail_mana+1)
-        play_coin[1].insert(0, coin)
-        logger.info("Coin play is: {} Mana\n{}".format(play_coin[0], pformat(play_coin[1])))
+        (coin_spent, coin_picked, coin_hero_power) = pick_play(best, avail_mana + 1,
+                                                               hero_power_cost)
+        play_coin = (coin_spent - (hero_power_cost if coin_hero_power else 0),
+                     [coin] + [hand[i] for i in coin_picked], coin_hero_power)
+        logger.info("Coin play is: {} Mana\n{}", play_coin[0], pretty(play_coin[1]))
         # Judge based on efficiency
-        play_eff = avail_mana - play[0]
-        logger.debug("Play without coin wastes {} mana.".format(play_eff))
-        play_coin_eff = avail_mana+1 - play_coin[0]
-        logger.debug("Play with coin wastes {} mana.".format(play_coin_eff))
+        play_eff = avail_mana - spent
+        logger.debug("Play without coin wastes {} mana.", play_eff)
+        play_coin_eff = avail_mana+1 - coin_spent
+        logger.debug("Play with coin wastes {} mana.", play_coin_eff)
         if (play_coin_eff < play_eff):
-            logger.info("Coin play is chosen due to higher efficiency: {} remaining (vs. {} without coin)".\
-                        format(play_eff, play_coin_eff))
+            logger.info("Coin play is chosen due to higher efficiency: {} remaining (vs. {} without coin)",
+                        play_coin_eff, play_eff)
             play = play_coin
         else:
-            logger.info("Non-coin play is chosen: wasted mana: {} non-coin vs. {} coin".\
-                        format(play_eff, play_coin_eff))
+            logger.info("Non-coin play is chosen: wasted mana: {} non-coin vs. {} coin",
+                        play_eff, play_coin_eff)
             
     return play
 
-
-def play_with_max_mana(hand, avail_mana):
+def play_with_max_mana(hand, avail_mana, slots=MAX_MINIONS):
     """Returns a (mana cost, list of cards) tuple describing the play in this hand
-    that costs the most mana under avail_mana.
+    with the most cards (at most slots) under avail_mana, spending the most mana.
     """
-    ultimate_play = (0, [])
-    
-    # Try to play as many cards as possible, so consider more first
-    for i in reversed(range(1, len(hand)+1)):
-        if ultimate_play[0] > 0:       # Already have a play
-            break
-        # The amount of mana that would be spent by the current candidate play
-        pot_mana_spent = 0
-        pot_play = None
-        # These are all the combinations of cards that can be played of size i
-        play_combs = itertools.combinations(hand, i)
-        for play in play_combs:
-            mana_spent = cost_to_play_cards(play)
-            logger.debug("Possible combination with cost {}: {}".format(mana_spent, play))
-            # We can't play this hand
-            if mana_spent > avail_mana:
-                continue
-            # This is the new potential candidate
-            if mana_spent > pot_mana_spent:
-                pot_mana_spent = mana_spent
-                pot_play = play
-        #END play_combs of size i
-
-        # This is the end of all plays of size i
-        # If we have one, play it. Otherwise, keep looking
-        if pot_play:
-            assert pot_mana_spent
-            ultimate_play = (pot_mana_spent, list(pot_play))
-            break
-    #END for all play combs of size i
-
-    return ultimate_play
-
-def cards_to_play(player):
+    (count, mana, picked) = best_plays(hand, max(avail_mana, 0), slots)[max(avail_mana, 0)]
+    return (mana, [hand[i] for i in picked])
+
+def cards_to_play(player, hero_power_cost=None):
     """Given a player, decide which cards should be played from the players hand
     incorporating the current minions the player has already played.
     
     Args: 
-        A state.Player
+        - player: A state.Player
+        - hero_power_cost: If given, leave mana for the hero power when it costs no cards
     Returns:
-        (total_mana, cards): (Int, [carddata.Card]) - The mana required and list of cards to play
+        (total_mana, cards, hero_power): (Int, [carddata.Card], Bool) - The mana required and
+        list of cards to play, and whether to use the hero power too (see spend_max_mana)
     """
     num_in_field = len(player.minions)
     
-    if num_in_field >= 7:
+    if num_in_field >= MAX_MINIONS:
         logger.info("Maximum minions on the field, cannot play anymore.")
-        (total, cards) = (0, [])
-        
-    elif num_in_field == 6:
-        # play the most expensive card (This is an optimization over spend_max_mana)
-        logger.info("I can only play one minion, so I'm going to play the most expensive one.")
-        cards = player.hand[:] # Shallow
-        cards = [c for c in cards if c.cost <= player.mana_available()]
-        logger.info("The cards I can play with {} mana are:\n{}".\
-                    format(player.mana_available(), pformat(cards)))
-        cards.sort(cmp=lambda x,y: int(x.cost) > int(y.cost))
-        logger.info("Sorted cards: {}".format(cards))
-        card = cards[0]
-        # Rewrite cards with the one expensive card
-        (total, cards) = (card.cost, [card])
+        (total, cards, hero_power) = (0, [], False)
         
     else:
-        (total, cards) = spend_max_mana(player)
+        # Only as many minions as there are free slots
+        (total, cards, hero_power) = spend_max_mana(player, MAX_MINIONS - num_in_field,
+                                                    hero_power_cost)
 
-    return (total, cards)
+    return (total, cards, hero_power)
@@ -1,35 +1,262 @@
 """Provides the hearthstone card database to clients.
+
+Parsing db/AllSets.json takes a while, so the fields we use are compiled
+into a marshal cache next to it (AllSets.json.cache). The cache is rebuilt
+when the json changes: it's trusted if the json's mtime and size match, and
+otherwise if the json still hashes the same.
+
+The database is loaded the first time get_card_data() is called.
 """
 
+import os
 import json, logging
+import marshal
+import hashlib
 from hearthbot import HEARTH_DB
 
 logger = logging.getLogger('CARD-DATA')
 
+DB_FILEPATH = os.path.join(HEARTH_DB, 'AllSets.json')
+CACHE_SUFFIX = '.cache'
+# Bump when the cached fields or layout change
+CACHE_VERSION = 2
+# The fields of a card we keep, everything else in the json is dropped
+CARD_FIELDS = ('id', 'name', 'type', 'playerClass', 'rarity', 'collectible',
+               'cost', 'attack', 'health', 'durability', 'mechanics')
+
+def normalize_name(name):
+    """Returns the form of a card name used for lookups:
+    lowercase, letters and digits only, single spaces.
+    "Gul'dan" and "gul dan " are both "guldan".
+    """
+    kept = ''.join(c for c in name.lower() if c.isalnum() or c.isspace())
+    return ' '.join(kept.split())
+
+def compile_db(raw):
+    """Returns the card db (set -> list of card dicts) of a json string,
+    keeping only CARD_FIELDS, and the normalized name of every cardId.
+    """
+    cardDB = {}
+    name_keys = {}
+    for card_set, cards in json.loads(raw).items():
+        cardDB[card_set] = [dict((k, d[k]) for k in CARD_FIELDS if k in d) for d in cards]
+        for d in cards:
+            name_keys[d['id']] = normalize_name(d['name'])
+    return cardDB, name_keys
+
 class CardData(object):
-    def __init__(self, filepath=HEARTH_DB+"/AllSets.json"):
-        """Holds the data of all the cards"""
+    def __init__(self, filepath=DB_FILEPATH, use_cache=True):
+        """Holds the data of all the cards.
+
+        Args:
+            - filepath: The AllSets.json to load
+            - use_cache: Whether to load from (and save) the compiled cache next to it
+        """
         self.filepath = filepath
-        self.cardDB = json.loads(file(self.filepath, 'r').read())
+        self.cache_filepath = filepath + CACHE_SUFFIX
+        if use_cache:
+            self.cardDB, name_keys = self.load_cached()
+        else:
+            with open(self.filepath, 'rb') as f:
+                self.cardDB, name_keys = compile_db(f.read())
+        self.build_indexes(name_keys)
+
+    def load_cached(self):
+        """Returns the card db and name keys from the cache, rebuilding the cache if it's stale.
+        """
+        st = os.stat(self.filepath)
+        cached = None
+        try:
+            with open(self.cache_filepath, 'rb') as f:
+                cached = marshal.load(f)
+            if cached.get('version') != CACHE_VERSION:
+                cached = None
+        except (IOError, EOFError, ValueError, TypeError, AttributeError):
+            cached = None
+        if cached and (cached['mtime'], cached['size']) == (st.st_mtime, st.st_size):
+            return cached['cards'], cached['name_keys']
+
+        with open(self.filepath, 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha1(raw).hexdigest()
+        if cached and cached['sha1'] == digest:
+            # Touched but not changed
+            cardDB, name_keys = cached['cards'], cached['name_keys']
+        else:
+            logger.info("Compiling card database {}".format(self.filepath))
+            cardDB, name_keys = compile_db(raw)
+        self.save_cache({'version': CACHE_VERSION, 'mtime': st.st_mtime, 'size': st.st_size,
+                         'sha1': digest, 'cards': cardDB, 'name_keys': name_keys})
+        return cardDB, name_keys
+
+    def save_cache(self, cached):
+        tmp_filepath = self.cache_filepath + '.tmp'
+        try:
+            with open(tmp_filepath, 'wb') as f:
+                marshal.dump(cached, f)
+            os.rename(tmp_filepath, self.cache_filepath)
+        except (IOError, OSError) as e:
+            logger.warn("Could not save card database cache {}: {}".format(self.cache_filepath, e))
+
+    def build_indexes(self, name_keys):
+        """Index the cards so every lookup is a dict hit.
+        The indexes all share the card dicts of cardDB, so don't modify what they return.
+
+        Args:
+            - name_keys: cardId -> normalized name of every card
+        """
+        self.by_id = {}
+        self.by_name = {}
+        self.by_type = {}
+        self.by_set = {}
+        self.by_cost = {}
+        # cardId -> CardTemplate, made as they're asked for
+        self.templates = {}
+        for card_set, cards in self.cardDB.items():
+            self.by_set[card_set] = cards
+            for d in cards:
+                self.by_id[d['id']] = d
+                self.by_name.setdefault(name_keys[d['id']], []).append(d)
+                self.by_type.setdefault(d.get('type'), []).append(d)
+                if 'cost' in d:
+                    self.by_cost.setdefault(d['cost'], []).append(d)
 
     def find_card(self, cardId):
-        """Don't prematurely optimize.
-        Returns a dict that represents this card with its values.
+        """Returns a dict that represents the card with cardId (e.g. CS2_065), or None.
         """
-        for k in self.cardDB.keys():
-            for d in self.cardDB[k]:
-                if d.get('id') == cardId:
-                    return d
-        return None
+        return self.by_id.get(cardId)
+
+    def find_by_name(self, name):
+        """Returns the dicts of all the cards called name (there can be a few,
+        e.g. Nefarian the hero and Nefarian the minion). Case and punctuation don't matter.
+        """
+        return self.by_name.get(normalize_name(name), [])
+
+    def cards_of_type(self, card_type):
+        """Returns the dicts of all cards of a type: Minion, Spell, Weapon, Hero, Hero Power, Enchantment.
+        """
+        return self.by_type.get(card_type, [])
+
+    def cards_in_set(self, card_set):
+        """Returns the dicts of all cards in a set, e.g. Basic or Goblins vs Gnomes.
+        """
+        return self.by_set.get(card_set, [])
+
+    def template(self, cardId):
+        """Returns the shared CardTemplate of cardId, or None if there's no such card.
+        """
+        template = self.templates.get(cardId)
+        if template is None:
+            data = self.by_id.get(cardId)
+            if data is None:
+                return None
+            template = self.templates[cardId] = CardTemplate(data)
+        return template
+
+    def cards_costing(self, cost):
+        """Returns the dicts of all cards with a mana cost.
+        """
+        return self.by_cost.get(cost, [])
+
+# Singleton, see get_card_data()
+card_data = None
+
+def get_card_data():
+    """Returns the shared CardData, loading it the first time.
+    """
+    global card_data
+    if card_data is None:
+        card_data = CardData()
+    return card_data
+
+###
+# Mechanics
+###
+
+# Mechanics are bits of an int, so checking one is a single &.
+# Mechanics not listed here get a bit the first time a card has them.
+MECHANIC_NAMES = ['Taunt', 'Charge', 'Stealth', 'Divine Shield', 'Windfury', 'Poisonous',
+                  'Enrage', 'Battlecry', 'Deathrattle', 'Spellpower', 'Freeze', 'Secret',
+                  'Aura', 'Combo', 'Silence',
+                  # Only ever set by tags during a game
+                  'Frozen', 'Silenced', 'Immune']
+mechanic_bits = {}
+
+def mechanic_bit(name):
+    """Returns the bit of a mechanic, giving it one if it's new.
+    """
+    bit = mechanic_bits.get(name)
+    if bit is None:
+        bit = mechanic_bits[name] = 1 << len(mechanic_bits)
+    return bit
+
+for _name in MECHANIC_NAMES:
+    mechanic_bit(_name)
 
-# Singleton
-card_data = CardData()
+TAUNT = mechanic_bits['Taunt']
+CHARGE = mechanic_bits['Charge']
+STEALTH = mechanic_bits['Stealth']
+DIVINE_SHIELD = mechanic_bits['Divine Shield']
+WINDFURY = mechanic_bits['Windfury']
+FROZEN = mechanic_bits['Frozen']
+SILENCED = mechanic_bits['Silenced']
+IMMUNE = mechanic_bits['Immune']
+
+# Tags that turn a mechanic on (value 1) or off (value 0) during a game
+TAG_MECHANICS = {'TAUNT': TAUNT, 'CHARGE': CHARGE, 'STEALTH': STEALTH,
+                 'DIVINE_SHIELD': DIVINE_SHIELD, 'WINDFURY': WINDFURY,
+                 'FROZEN': FROZEN, 'SILENCED': SILENCED, 'IMMUNE': IMMUNE}
+
+def mechanics_mask(names):
+    """Returns the bits of a list of mechanic names.
+    """
+    mask = 0
+    for name in names:
+        mask |= mechanic_bit(name)
+    return mask
+
+def mechanic_names(mask):
+    """Returns the names of the mechanics in mask.
+    """
+    return tuple(name for name, bit in sorted(mechanic_bits.items(), key=lambda nb: nb[1])
+                 if mask & bit)
+
+class CardTemplate(object):
+    """The static data of a card, shared by every entity of that card in a game.
+    Immutable: per-entity changes go on the Card.
+    """
+    __slots__ = ('cardId', 'name', 'type', 'cost', 'attack', 'health', 'durability',
+                 'mechanics', 'mechanics_mask')
+
+    def __init__(self, data):
+        set_field = object.__setattr__
+        set_field(self, 'cardId', data['id'])
+        set_field(self, 'name', data['name'])
+        set_field(self, 'type', data.get('type'))
+        set_field(self, 'cost', data.get('cost', 0))
+        set_field(self, 'attack', data.get('attack', 0))
+        set_field(self, 'health', data.get('health', 0))
+        set_field(self, 'durability', data.get('durability', 0))
+        # Any card can have mechanics. They are strings.
+        set_field(self, 'mechanics', tuple(data.get('mechanics', ())))
+        set_field(self, 'mechanics_mask', mechanics_mask(self.mechanics))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Card templates can't be changed")
+
+    def __repr__(self):
+        return "CardTemplate({})".format(self.cardId)
 
 class Card(object):
-    def __init__(self, data, card_id):
-        self.name = data['name']
-        self.cost = data.get('cost', 0)
-        self.health = data.get('health', 0)
+    # Everything about one entity in a game that can change; the rest is in template
+    __slots__ = ('template', 'id', 'zone', 'pos', 'cost', 'attack', 'health', 'damage',
+                 'armor', 'flags', 'active', '_has_attacked')
+
+    def __init__(self, template, card_id):
+        self.template = template
+        self.cost = template.cost
+        self.attack = template.attack
+        self.health = template.health
         # Every card in the game has a unique id
         self.id = card_id
         # A card's zone can be PLAY, HAND, GRAVEYARD
@@ -38,10 +265,44 @@ class Card(object):
         self.pos = None
         # The amount of damage a card has taken
         self.damage = 0
+        self.armor = 0
+        # The card's mechanics as bits (see mechanic_bit), kept up to date by tag changes
+        self.flags = template.mechanics_mask
         # Whether or not a card can be used (minion summoning sickness or having attacked)
         self.active = False
-        # Any card can have mechanics. They are strings.
-        self.mechanics = data.get('mechanics', [])
+        self._has_attacked = False
+
+    @property
+    def name(self):
+        return self.template.name
+
+    @property
+    def mechanics(self):
+        """The names of the mechanics the card has right now.
+        """
+        return mechanic_names(self.flags)
+
+    def has(self, bit):
+        return bool(self.flags & bit)
+
+    def set_flag(self, bit, on):
+        if on:
+            self.flags |= bit
+        else:
+            self.flags &= ~bit
+
+    def key(self):
+        """Returns a hashable tuple of what matters about this entity in a fight.
+        """
+        return (self.template.cardId, self.attack, self.health, self.damage, self.flags)
+
+    def copy(self):
+        """Returns a copy of this entity (sharing its template), e.g. to try out moves on.
+        """
+        clone = object.__new__(self.__class__)
+        for name in Card.__slots__:
+            setattr(clone, name, getattr(self, name))
+        return clone
 
     def activate(self):
         self.active = True
@@ -50,39 +311,32 @@ class Card(object):
         self.active = False
 
 class Hero(Card):
-    def __init__(self, data, card_id):
-        Card.__init__(self, data, card_id)
-        self.attack = data.get('attack', 0)
-        self.damage = 0
-        self._has_attacked = False
+    __slots__ = ()
 
     def __repr__(self):
         return "{} ({}/{}) - (id:{})".format(self.name, self.attack,
                                              self.health, self.id)
 
     def remaining_health(self):
-        return int(self.health) - int(self.damage)
+        return self.health - self.damage
 
     def performs_attack(self):
         self._has_attacked = True
         self.deactivate()       # Can't attack anymore
 
 class HeroPower(Card):
-    def __init__(self, data, card_id):
-        Card.__init__(self, data, card_id)
+    __slots__ = ()
 
     def __repr__(self):
         return "{} - (id:{})".format(self.name, self.id)
     
 class Minion(Card):
-    def __init__(self, data, card_id):
+    __slots__ = ()
+
+    def __init__(self, template, card_id):
         """Battlecry-triggered events will change the minion state appropriately after they occur.
         """
-        Card.__init__(self, data, card_id)
-        self.attack = data['attack']
-        self.health = data['health']
-        self.damage = 0
-        self._has_attacked = False
+        Card.__init__(self, template, card_id)
 
         # Check for specific mechanics
         if self.has_charge():
@@ -93,10 +347,10 @@ class Minion(Card):
                                                        self.attack, self.health, self.id, self.pos)
             
     def has_charge(self):
-        return 'Charge' in self.mechanics
+        return bool(self.flags & CHARGE)
 
     def has_stealth(self):
-        return (not self.has_attacked()) and 'Stealth' in self.mechanics
+        return (not self.has_attacked()) and bool(self.flags & STEALTH)
 
     def has_attacked(self):
         return self._has_attacked
@@ -110,62 +364,51 @@ class Minion(Card):
         self.deactivate()       # Can't attack anymore
     
     def remaining_health(self):
-        return int(self.health) - int(self.damage)
+        return self.health - self.damage
 
 class Spell(Card):
-    def __init__(self, data, card_id):
-        Card.__init__(self, data, card_id)
+    __slots__ = ()
 
     def __repr__(self):
         return "{} - {} mana (id:{})".format(self.name, self.cost, self.id)
 
 class Weapon(Card):
-    def __init__(self, data, card_id):
-        Card.__init__(self, data, card_id)
-        self.attack = data['attack']
+    __slots__ = ()
+
+    def __init__(self, template, card_id):
+        Card.__init__(self, template, card_id)
         # For the purposes of scorekeeping, a weapon's durability is basically health
         # (Weapons take damage when they lose durability)
-        self.health = data['durability']
-        self.damage = 0
+        self.health = template.durability
 
     def __repr__(self):
         return "{} ({}/{}) - {} mana (id:{})".format(self.name, self.attack,
                                                      self.health, self.cost, self.id)
 
     def remaining_health(self):
-        return int(self.health) - int(self.damage)
+        return self.health - self.damage
 
 class Enchantment(Card):
-    def __init__(self, data, card_id):
-        Card.__init__(self, data, card_id)
+    __slots__ = ()
 
     def __repr__(self):
         return "{} - {} mana (id:{})".format(self.name, self.cost, self.id)
 
+# The class of each card type
+CARD_CLASSES = {'Minion': Minion, 'Weapon': Weapon, 'Spell': Spell,
+                'Enchantment': Enchantment, 'Hero': Hero, 'Hero Power': HeroPower}
+
 def card_from_id(cardId, card_id):
     """Given a string that is the name of a card,
     return the entity as an instance of our classes.
     Give the entity an id provided by the game log.
     """
-    data = card_data.find_card(cardId)
-    if not data:
+    template = get_card_data().template(cardId)
+    if not template:
         return None
 
-    card = None
-    
-    if data['type'] == 'Minion':
-        card = Minion(data, card_id)
-    elif data['type'] == 'Weapon':
-        card = Weapon(data, card_id)
-    elif data['type'] == 'Spell':
-        card = Spell(data, card_id)
-    elif data['type'] == 'Enchantment':
-        card = Enchantment(data, card_id)
-    elif data['type'] == 'Hero':
-        card = Hero(data, card_id)
-    elif data['type'] == 'Hero Power':
-        card = HeroPower(data, card_id)
-    else:
+    card_class = CARD_CLASSES.get(template.type)
+    if card_class is None:
         logger.error("No card type found for cardId: "+cardId)
-
-    return card
+        return None
+    return card_class(template, card_id)
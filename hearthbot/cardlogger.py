@@ -16,53 +16,336 @@ import time
 import logging
 
 import state
+import events
+import logindex
+from archive import AsyncWriter
+from logreader import LogReader
+from tailer import LogTailer
 
 # The parser's debug file logger
 logger = logging.getLogger('parser')
 
 player_name = "tingle"
 
+# Log channels a line can come from
+POWER = '[Power]'
+ZONE = '[Zone]'
+
+# Keywords used to route lines to rules
+TAG_CHANGE = 'TAG_CHANGE'
+ARROW = '->'
+
+# Power log lines that open and close an action block
+# [Power] GameState.DebugPrintPower() - ACTION_START Entity=[name=Goblin Auto-Barber id=48 zone=PLAY zonePos=1 cardId=GVG_023 player=2] SubType=ATTACK Index=-1 Target=[name=Anduin Wrynn id=4 zone=PLAY zonePos=0 cardId=HERO_09 player=1]
+# [Power] GameState.DebugPrintPower() - ACTION_END
+ACTION_START = 'ACTION_START'
+ACTION_END = 'ACTION_END'
+action_start_re = re.compile(r'.*ACTION_START Entity=(.*) SubType=([A-Z_]+) Index=-?[0-9]+ Target=(.*)$')
+entity_player_re = re.compile(r'.* player=([0-9]+)\]$')
+# The subtypes of the blocks our own clicks make (deaths and triggers get blocks of their own)
+ACTION_SUBTYPES = ('ATTACK', 'PLAY')
+
+class Rule(object):
+    def __init__(self, name, pattern, action, keywords=(), channels=(POWER, ZONE), final=True):
+        """A pattern to look for in a line of the log, and what to do when we see it.
+
+        Args:
+            - name: Used to report how often the rule matches
+            - pattern: The regex, matched from the start of the line
+            - action: Called with (match, line) when the pattern matches
+            - keywords: Substrings that must all be in a line for the pattern to match
+            - channels: The log channels ([Power], [Zone]) the rule's lines come from
+            - final: If False, keep trying later rules after this one matches
+        """
+        self.name = name
+        self.regex = re.compile(pattern)
+        self.action = action
+        self.keywords = keywords
+        self.channels = channels
+        self.final = final
+        self.needs_tag_change = TAG_CHANGE in keywords
+        self.needs_arrow = ARROW in keywords
+        # Number of lines this rule has matched
+        self.hits = 0
+
+    def __repr__(self):
+        return "Rule({}, hits={})".format(self.name, self.hits)
+
+    def apply(self, line):
+        """Run the action if the line matches.
+        Returns True if it did.
+        """
+        for k in self.keywords:
+            if k not in line:
+                return False
+        match = self.regex.match(line)
+        if not match:
+            return False
+        self.hits += 1
+        self.action(match, line)
+        return True
+
 class Parser(object):
     def __init__(self, hs_filepath, output_filepath):
         """Create a new game parser.
         
         Args:
             - hs_filepath: The source of the Hearthstone logs
-            - output_filepath: A destination filepath to store lines that are parsed
+            - output_filepath: A destination filepath to store lines that are parsed,
+              gzipped if it ends in .gz. Written in the background. None to not store them.
         """
         self.hs_filepath = hs_filepath
-        self.logfile = file(self.hs_filepath, 'r')
+        self.logfile = file(self.hs_filepath, 'rb')
         
         self.output_filepath = output_filepath
-        self.outfile = file(self.output_filepath, 'w')
+        self.outfile = None
+        if output_filepath:
+            self.outfile = AsyncWriter(self.output_filepath)
+        # Lines parsed in this batch, waiting to be written to outfile
+        self.out_lines = []
+        # Keeps the most recent lines for crash reports (see archive.FlightRecorder)
+        self.recorder = None
 
         # Position in the HS log
         self.pos = 0
+        # Offset of the line that raised, if processing one did
+        self.failed_at = None
+        # Where the games and turns are in the HS log (built on demand)
+        self.log_index = None
+        # Where to record the events we find (see record_journal)
+        self.journal = None
+        # The innermost ACTION_START block we are in, and the events waiting for
+        # the outermost block to end
+        self.block = None
+        self.pending = []
+        # Number of outermost blocks applied so far
+        self.blocks_completed = 0
+        # Number of those that were Tingle's own attacks and plays
+        self.actions_completed = 0
         # The state of the game
         self.gstate = state.GameState()
 
+        self.build_rules()
+
     def reset_log(self):
         """Read until the end of the log, not processing any of
         the events to the game state.
         """
         logger.info("Skipping to end of log file")
-        self.logfile.seek(self.pos)
-        self.logfile.readlines()
+        self.logfile.seek(0, os.SEEK_END)
         self.pos = self.logfile.tell()
+
+    def index(self):
+        """Returns the LogIndex of the games in the log, rebuilding it if the
+        log has changed.
+        """
+        if self.log_index is None or self.log_index.is_stale():
+            self.log_index = logindex.load_index(self.hs_filepath)
+        return self.log_index
+
+    def seek_game(self, game_num):
+        """Start reading from the CREATE_GAME line of game game_num (starting from 1),
+        forgetting the current game state.
+        """
+        offset = self.index().game_offset(game_num)
+        logger.info("Seeking to game {} at offset {}".format(game_num, offset))
+        self.reset_blocks()
+        self.gstate.init()
+        self.pos = offset
+
+    def seek_turn(self, game_num, turn):
+        """Replay game game_num up to the start of turn (starting from 1), so the
+        game state is as it was when that turn began.
+        """
+        offset = self.index().turn_offset(game_num, turn)
+        self.seek_game(game_num)
+        self.process_until(offset)
+
+    def process_until(self, offset):
+        """Process the log line by line until reaching offset (None for the
+        end of the log).
+
+        Returns:
+            The number of lines processed.
+        """
+        num_lines = 0
+        reader = LogReader(self.logfile, self.pos, offset)
+        try:
+            for line in reader:
+                self.parse_next_line(line)
+                num_lines += 1
+        except Exception:
+            self.failed_at = reader.line_pos
+            raise
+        self.pos = reader.pos
+        # Hand our copy of the lines to the writer in one piece
+        if self.out_lines:
+            self.outfile.write(''.join(self.out_lines))
+            self.out_lines = []
+        if self.journal:
+            self.journal.flush()
+        return num_lines
         
     def process_log(self):
         """Process the log, line by line, updating the state as necessary,
         until the log has no more data to provide for the time being.
-        The log will close it's file handle, and we'll remember where we were
-        for next time.
+        We'll remember where we were for next time. Only [Power] and [Zone]
+        lines are parsed (see logreader).
+
+        Returns:
+            The number of lines processed.
         """
-        self.logfile.seek(self.pos)
-        line = self.logfile.readline()
-        while line:
-            self.parse_next_line(line)
-            line = self.logfile.readline()
-        self.pos = self.logfile.tell()
+        return self.process_until(None)
+
+    def close(self):
+        """Close the log and finish writing our copy of it and the journal.
+        """
+        self.logfile.close()
+        if self.outfile:
+            self.outfile.close()
+        if self.journal:
+            self.journal.close()
+
+    def restart_log(self):
+        """The log was truncated or recreated (Hearthstone restarted).
+        Reopen it, read it from the start and forget the old game.
+        """
+        logger.info("Restarting log file {}".format(self.hs_filepath))
+        self.logfile.close()
+        self.logfile = file(self.hs_filepath, 'rb')
+        self.pos = 0
+        self.reset_blocks()
+        self.gstate.init()
         
+    def build_rules(self):
+        """Compile the parse rules and the routing table that decides which rules
+        a line is tried against. Done once per parser.
+
+        The rules are kept in the order they were always checked in, so the state
+        sees the same calls in the same order. Each rule names the log channel it
+        lives on and the literal keywords its pattern can't match without, which
+        lets us throw away most lines with a few substring tests.
+        """
+        self.gamestart_rule = Rule('gamestart', r'.*CREATE_GAME', self.on_gamestart,
+                                   keywords=('CREATE_GAME',))
+        self.rules = [
+            # Figure out if we are player 1 or 2: we see 'friendly play'
+            #    2535:[Zone] ZoneChangeList.ProcessChanges() - TRANSITIONING card [name=Jaina Proudmoore id=4 zone=PLAY zonePos=0 cardId=HERO_08 player=1] to FRIENDLY PLAY (Hero)
+            Rule('player_num', r'.*TRANSITIONING.*player=(1|2)] to FRIENDLY PLAY \(Hero\)',
+                 self.on_player_num, channels=(ZONE,),
+                 keywords=('TRANSITIONING', 'FRIENDLY PLAY (Hero)')),
+            # If we win or lose (other rules may still match this line)
+            # [Power] GameState.DebugPrintPower() - TAG_CHANGE Entity=bish3al tag=PLAYSTATE value=WON
+            Rule('playstate', r'.*TAG_CHANGE Entity='+re.escape(player_name)+' tag=PLAYSTATE value=(.*)',
+                 self.on_playstate, channels=(POWER,), final=False,
+                 keywords=(TAG_CHANGE, 'tag=PLAYSTATE')),
+            # Every tag of every entity goes to the tag store (other rules may still match this line)
+            # [Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=[name=Frostbolt id=27 zone=PLAY zonePos=0 cardId=CS2_024 player=1] tag=FROZEN value=1
+            Rule('entity_tag', r'.*TAG_CHANGE Entity=\[.*id=([0-9]+).*\] tag=([A-Z_0-9]+) value=([A-Za-z_0-9-]+)',
+                 self.on_entity_tag, channels=(POWER,), final=False,
+                 keywords=(TAG_CHANGE, 'Entity=[')),
+            # Set current player (and as such, the start of their turn)
+            # [Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=bish3al tag=CURRENT_PLAYER value=0
+            # [Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=The Innkeeper tag=CURRENT_PLAYER value=1
+            Rule('current_player', r'.*TAG_CHANGE Entity='+re.escape(player_name)+r' tag=CURRENT_PLAYER value=([0-9])',
+                 self.on_current_player, channels=(POWER,),
+                 keywords=(TAG_CHANGE, 'tag=CURRENT_PLAYER')),
+            # Draw a card
+            # [Zone] ZoneChangeList.ProcessChanges() - id=1 local=False [name=Spider Tank id=6 zone=HAND zonePos=2 cardId=GVG_044 player=1] zone from  -> FRIENDLY HAND
+            Rule('draw', r'.*id=([0-9]+).*cardId=([a-zA-Z0-9_]+) .*-> FRIENDLY HAND',
+                 self.on_draw, channels=(ZONE,),
+                 keywords=(ARROW, '-> FRIENDLY HAND')),
+            # Opponent plays a hero, hero power, or minion
+            # [Zone] ZoneChangeList.ProcessChanges() - id=75 local=False [name=Lightwarden id=79 zone=PLAY zonePos=2 cardId=EX1_001 player=2] zone from  -> OPPOSING PLAY
+            # [Zone] ZoneChangeList.ProcessChanges() - id=1 local=False [name=Anduin Wrynn id=4 zone=PLAY zonePos=0 cardId=HERO_09 player=1] zone from  -> OPPOSING PLAY (Hero)
+            Rule('opp_play', r'.*id=([0-9]+).*zonePos=([0-9]).*cardId=([a-zA-Z0-9_]+) .* -> OPPOSING PLAY',
+                 self.on_opp_play, channels=(ZONE,),
+                 keywords=(ARROW, ' -> OPPOSING PLAY')),
+            # We play a minion
+            # Doesn't have to be from hand
+            # [Zone] ZoneChangeList.ProcessChanges() - id=2 local=True [name=Twilight Drake id=66 zone=HAND zonePos=2 cardId=EX1_043 player=2] zone from FRIENDLY HAND -> FRIENDLY PLAY
+            Rule('our_play', r'.*id=([0-9]+).*cardId=([a-zA-Z0-9_]+) .* -> FRIENDLY PLAY',
+                 self.on_our_play, channels=(ZONE,),
+                 keywords=(ARROW, ' -> FRIENDLY PLAY')),
+            # Minion goes to graveyard
+            # [Zone] ZoneChangeList.ProcessChanges() - id=16 local=False [name=Wolfrider id=47 zone=GRAVEYARD zonePos=1 cardId=CS2_124 player=2] zone from OPPOSING PLAY -> OPPOSING GRAVEYARD
+            Rule('graveyard', r'.*id=([0-9]+).* -> OPPOSING GRAVEYARD',
+                 self.on_graveyard, channels=(ZONE,),
+                 keywords=(ARROW, ' -> OPPOSING GRAVEYARD')),
+            # Update zone of a card
+            # [Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=[name=The Coin id=68 zone=HAND zonePos=4 cardId=GAME_005 player=1] tag=ZONE value=PLAY
+            #    9876:[Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=[name=Amani Berserker id=13 zone=PLAY zonePos=1 cardId=EX1_393 player=1] tag=ZONE value=GRAVEYARD
+            Rule('zone', r'.* TAG_CHANGE .*id=([0-9]+).*player=(1|2)] tag=ZONE value=(.*)',
+                 self.on_zone, channels=(POWER,),
+                 keywords=(TAG_CHANGE, '] tag=ZONE value=')),
+            # Update the location of a card/minion
+            #   13768:[Zone] ZoneChangeList.ProcessChanges() - id=32 local=False [name=Sludge Belcher id=48 zone=PLAY zonePos=1 cardId=FP1_012 player=2] pos from 2 -> 1
+            Rule('position', r'.*name=(.*)id=([0-9]+).*pos from.*-> ([0-9])',
+                 self.on_position, channels=(ZONE,),
+                 keywords=(ARROW, 'pos from')),
+            # Figure out which card attacked which
+            # [Power] GameState.DebugPrintPower() - ACTION_START Entity=[name=Goblin Auto-Barber id=48 zone=PLAY zonePos=1 cardId=GVG_023 player=2] SubType=ATTACK Index=-1 Target=[name=Anduin Wrynn id=4 zone=PLAY zonePos=0 cardId=HERO_09 player=1]
+            Rule('attack', r'.*name=(.*)id=([0-9]+).*zonePos=([0-9]).*ATTACK.*name=(.*)id=([0-9]+).*zonePos=([0-9])',
+                 self.on_attack, channels=(POWER, ZONE),
+                 keywords=('ATTACK',)),
+            # Numerical value tags
+            # [Power] GameState.DebugPrintPower() -         TAG_CHANGE Entity=[name=Garrosh Hellscream id=4 zone=PLAY zonePos=0 cardId=HERO_01 player=1] tag=ARMOR value=2
+            # [Power] GameState.DebugPrintPower() - TAG_CHANGE Entity=[name=Flamestrike id=27 zone=HAND zonePos=2 cardId=CS2_032 player=1] tag=COST value=12
+            Rule('tag', r'.*TAG_CHANGE.*id=([0-9]+).*tag=([A-Z]+) value=([0-9]+)$',
+                 self.on_tag, channels=(POWER, ZONE),
+                 keywords=(TAG_CHANGE, 'tag=')),
+            # Opponent plays a spell
+            # [Zone] ZoneChangeList.ProcessChanges() - id=63 local=False [name=Polymorph id=61 zone=PLAY zonePos=5 cardId=CS2_022 player=2] zone from OPPOSING HAND ->
+            Rule('opp_spell', r'.*id=([0-9]+).*cardId=([a-zA-Z0-9_]+) .* from OPPOSING HAND ->',
+                 self.on_opp_spell, channels=(ZONE,),
+                 keywords=(ARROW, ' from OPPOSING HAND ->')),
+            # A spell has a target
+            # [Zone] ZoneChangeList.ProcessChanges() - processing index=5 change=powerTask=[power=[type=TAG_CHANGE entity=[id=61 cardId=CS2_022 name=Polymorph] tag=CARD_TARGET value=13] complete=False] entity=[name=Polymorph id=61 zone=PLAY zonePos=0 cardId=CS2_022 player=2] srcZoneTag=INVALID srcPos= dstZoneTag=INVALID dstPos=
+            # [Zone] ZoneChangeList.ProcessChanges() - processing index=5 change=powerTask=[power=[type=TAG_CHANGE entity=[id=54 cardId=EX1_334 name=Shadow Madness] tag=CARD_TARGET value=6] complete=False] entity=[name=Shadow Madness id=54 zone=PLAY zonePos=0 cardId=EX1_334 player=2] srcZoneTag=INVALID srcPos= dstZoneTag=INVALID dstPos=
+            Rule('spell_target', r'[Zone].*TAG_CHANGE.*id=([0-9]+).*CARD_TARGET value=([0-9]+).*',
+                 self.on_spell_target, channels=(ZONE,),
+                 keywords=(TAG_CHANGE, 'CARD_TARGET value=')),
+            # Hero power with target
+            # [Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=[name=Fireblast id=5 zone=PLAY zonePos=0 cardId=CS2_034 player=1] tag=CARD_TARGET value=59
+            # [Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=[name=Lesser Heal id=37 zone=PLAY zonePos=0 cardId=CS1h_001 player=2] tag=CARD_TARGET value=36
+            Rule('hero_power', r'[Power].*TAG_CHANGE.*id=([0-9]+).*player=(1|2)] tag=CARD_TARGET value=([0-9]+)$',
+                 self.on_hero_power, channels=(POWER,),
+                 keywords=(TAG_CHANGE, '] tag=CARD_TARGET value=')),
+            # Hero power without target
+            # [Power] GameState.DebugPrintPower() - ACTION_START Entity=[name=Dagger Mastery id=37 zone=PLAY zonePos=0 cardId=CS2_083b player=2] SubType=PLAY Index=0 Target=0
+            # TODO
+        ]
+
+        # Every combination of (channel, has TAG_CHANGE, has ->) gets the ordered
+        # list of rules that could possibly match such a line.
+        self.routes = {}
+        for channel in (POWER, ZONE, None):
+            for has_tag in (False, True):
+                for has_arrow in (False, True):
+                    self.routes[(channel, has_tag, has_arrow)] = tuple(
+                        r for r in self.rules
+                        if channel in r.channels
+                        and (has_tag or not r.needs_tag_change)
+                        and (has_arrow or not r.needs_arrow))
+
+    def route(self, line):
+        """Returns the rules a line should be tried against.
+        """
+        if line.startswith('[Power]'):
+            channel = POWER
+        elif line.startswith('[Zone]'):
+            channel = ZONE
+        else:
+            channel = None
+        return self.routes[(channel, TAG_CHANGE in line, ARROW in line)]
+
+    def rule_hits(self):
+        """Returns a dict of rule name to the number of lines it has matched.
+        """
+        hits = dict((r.name, r.hits) for r in self.rules)
+        hits[self.gamestart_rule.name] = self.gamestart_rule.hits
+        return hits
+
     def parse_next_line(self, line):
         """Parse the next line of the log and update state as necessary.
         
@@ -71,10 +354,7 @@ class Parser(object):
         """
         # This is the start of the game
         # [Power] GameState.DebugPrintPower() - CREATE_GAME
-        gamestart_re = re.compile(r'.*CREATE_GAME')
-        match = gamestart_re.match(line)
-        if match:
-            self.gstate.start_game()
+        if self.gamestart_rule.apply(line):
             return True
 
         # If the game hasn't started, don't try to decode any lines (we don't care about them)
@@ -82,179 +362,197 @@ class Parser(object):
             return True
 
         # If we get past this line, we have started the game
-        self.outfile.write(line)
-        
-        # Figure out if we are player 1 or 2: we see 'friendly play'
-        #    2535:[Zone] ZoneChangeList.ProcessChanges() - TRANSITIONING card [name=Jaina Proudmoore id=4 zone=PLAY zonePos=0 cardId=HERO_08 player=1] to FRIENDLY PLAY (Hero)
-        pl_re = re.compile(r'.*TRANSITIONING.*player=(1|2)] to FRIENDLY PLAY \(Hero\)')
-        match = pl_re.match(line)
-        if match:
-            self.gstate.set_player_number(match.group(1))
-            return True
-        
-        # If we win or lose
-        # [Power] GameState.DebugPrintPower() - TAG_CHANGE Entity=bish3al tag=PLAYSTATE value=WON
-        win_re = re.compile(r'.*TAG_CHANGE Entity='+player_name+' tag=PLAYSTATE value=(.*)')
-        match = win_re.match(line)
-        if match:
-            win_value = match.group(1)
-            if win_value == "WON":
-                self.gstate.set_won()
-            elif win_value == "LOST":
-                self.gstate.set_lost()
-            else:
-                pass
-                #logger.error("Unknown tag for win state: {}".format(win_value))
-
-        # Set current player (and as such, the start of their turn)
-        # [Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=bish3al tag=CURRENT_PLAYER value=0
-        # [Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=The Innkeeper tag=CURRENT_PLAYER value=1
-        curr_player = re.compile(r'.*TAG_CHANGE Entity='+player_name+r' tag=CURRENT_PLAYER value=([0-9])')
-        match = curr_player.match(line)
-        if match:
-            playing = match.group(1)
-            if playing == '0':
-                self.gstate.set_opponent_turn()
-            elif playing == '1':
-                self.gstate.set_our_turn()
-            else:
-                logger.fatal("UNKNOWN CURRENT_PLAYER VALUE")
-                sys.exit(1)
-            return True
+        if self.outfile:
+            self.out_lines.append(line)
+        if self.recorder:
+            self.recorder.record(line)
 
-        # Draw a card
-        # [Zone] ZoneChangeList.ProcessChanges() - id=1 local=False [name=Spider Tank id=6 zone=HAND zonePos=2 cardId=GVG_044 player=1] zone from  -> FRIENDLY HAND
-        hand_draw = re.compile(r'.*id=([0-9]+).*cardId=([a-zA-Z0-9_]+) .*-> FRIENDLY HAND')
-        match = hand_draw.match(line)
-        if match:
-            card_id = match.group(1)
-            cardId = match.group(2)
-            self.gstate.add_card_to_hand(cardId, card_id)
-            return True
+        # Keep track of the action blocks, so their events are applied together
+        if line.startswith(POWER):
+            if ACTION_START in line:
+                self.start_block(line)
+            elif ACTION_END in line:
+                self.end_block()
 
-        # Opponent plays a hero, hero power, or minion 
-        # [Zone] ZoneChangeList.ProcessChanges() - id=75 local=False [name=Lightwarden id=79 zone=PLAY zonePos=2 cardId=EX1_001 player=2] zone from  -> OPPOSING PLAY
-        # [Zone] ZoneChangeList.ProcessChanges() - id=1 local=False [name=Anduin Wrynn id=4 zone=PLAY zonePos=0 cardId=HERO_09 player=1] zone from  -> OPPOSING PLAY (Hero)
-        opposing_play = re.compile(r'.*id=([0-9]+).*zonePos=([0-9]).*cardId=([a-zA-Z0-9_]+) .* -> OPPOSING PLAY')
-        match = opposing_play.match(line)
-        if match:
-            logger.debug(line)
-            card_id = match.group(1)
-            pos = match.group(2)
-            cardId = match.group(3)
-            self.gstate.opp_play_minion(cardId, card_id, pos=pos)
-            return True
+        for rule in self.route(line):
+            if rule.apply(line) and rule.final:
+                return True
 
-        # We play a minion
-        # Doesn't have to be from hand
-        # [Zone] ZoneChangeList.ProcessChanges() - id=2 local=True [name=Twilight Drake id=66 zone=HAND zonePos=2 cardId=EX1_043 player=2] zone from FRIENDLY HAND -> FRIENDLY PLAY
-        our_play = re.compile(r'.*id=([0-9]+).*cardId=([a-zA-Z0-9_]+) .* -> FRIENDLY PLAY')
-        match = our_play.match(line)
-        if match:
-            logger.debug(line)
-            card_id = match.group(1)
-            cardId = match.group(2)
-            self.gstate.play_minion(cardId, card_id)
-            return True
+        # No match...
+        return True
 
-        # Minion goes to graveyard
-        # [Zone] ZoneChangeList.ProcessChanges() - id=16 local=False [name=Wolfrider id=47 zone=GRAVEYARD zonePos=1 cardId=CS2_124 player=2] zone from OPPOSING PLAY -> OPPOSING GRAVEYARD
-        grave_re = re.compile(r'.*id=([0-9]+).* -> OPPOSING GRAVEYARD')
-        match = grave_re.match(line)
-        if match:
-            logger.debug(line)
-            card_id = match.group(1)
-            self.gstate.send_to_graveyard(card_id)
-            return True
-        
-        # Update zone of a card
-        # [Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=[name=The Coin id=68 zone=HAND zonePos=4 cardId=GAME_005 player=1] tag=ZONE value=PLAY
-        #    9876:[Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=[name=Amani Berserker id=13 zone=PLAY zonePos=1 cardId=EX1_393 player=1] tag=ZONE value=GRAVEYARD
-        zone_re = re.compile(r'.* TAG_CHANGE .*id=([0-9]+).*player=(1|2)] tag=ZONE value=(.*)')
-        match = zone_re.match(line)
-        if match:
-            #logger.debug(line)
-            card_id = match.group(1)
-            player = match.group(2)
-            zone = match.group(3)
-            self.gstate.update_zone(card_id, player, zone)
-            return True
+    def record_journal(self, journal_filepath):
+        """Also write every event we emit to a binary journal, so the game can
+        be replayed later without parsing the log.
+        """
+        self.journal = events.JournalWriter(file(journal_filepath, 'wb'))
 
-        # Update the location of a card/minion
-        #   13768:[Zone] ZoneChangeList.ProcessChanges() - id=32 local=False [name=Sludge Belcher id=48 zone=PLAY zonePos=1 cardId=FP1_012 player=2] pos from 2 -> 1
-        location = re.compile(r'.*name=(.*)id=([0-9]+).*pos from.*-> ([0-9])')
-        match = location.match(line)
-        if  match:
-            name = match.group(1)
-            card_id = match.group(2)
-            pos = match.group(3)
-            self.gstate.update_card_pos(card_id, pos)
-            return True
+    def emit(self, event):
+        """Hand an event found in the log to the game state. Events inside an
+        action block wait until the whole block has been read.
+        """
+        if self.journal:
+            self.journal.write(event)
+        if self.block:
+            self.block.children.append(event)
+            self.pending.append(event)
+        else:
+            self.gstate.apply_event(event)
 
-        # Figure out which card attacked which
-        # 
-        attacking_play = re.compile(r'.*name=(.*)id=([0-9]+).*zonePos=([0-9]).*ATTACK.*name=(.*)id=([0-9]+).*zonePos=([0-9])')
-        match = attacking_play.match(line)
-        if match:
-            logger.debug(line)
-            att_id = match.group(2)
-            def_id = match.group(5)
-            self.gstate.perform_attack(att_id, def_id)
-            return True
+    ###
+    # Action blocks
+    ###
 
-        # Numerical value tags
-        # [Power] GameState.DebugPrintPower() -         TAG_CHANGE Entity=[name=Garrosh Hellscream id=4 zone=PLAY zonePos=0 cardId=HERO_01 player=1] tag=ARMOR value=2
-        # [Power] GameState.DebugPrintPower() - TAG_CHANGE Entity=[name=Flamestrike id=27 zone=HAND zonePos=2 cardId=CS2_032 player=1] tag=COST value=12
-        tag_re = re.compile(r'.*TAG_CHANGE.*id=([0-9]+).*tag=([A-Z]+) value=([0-9]+)$')
-        match = tag_re.match(line)
+    def start_block(self, line):
+        """An ACTION_START line opens a (possibly nested) block.
+        """
+        match = action_start_re.match(line)
         if match:
-            logger.debug(line)
-            card_id = match.group(1)
-            tag = match.group(2)
-            value = match.group(3)
-            self.gstate.update_card_tag(card_id, tag, value)
-            return True
+            block = events.Block(match.group(1), match.group(2), match.group(3), self.block)
+        else:
+            logger.warn("Can't read action block start: {}".format(line))
+            block = events.Block(None, None, None, self.block)
+        if self.block:
+            self.block.children.append(block)
+        self.block = block
 
-        # Opponent plays a spell
-        # [Zone] ZoneChangeList.ProcessChanges() - id=63 local=False [name=Polymorph id=61 zone=PLAY zonePos=5 cardId=CS2_022 player=2] zone from OPPOSING HAND -> 
-        opposing_spell = re.compile(r'.*id=([0-9]+).*cardId=([a-zA-Z0-9_]+) .* from OPPOSING HAND ->')
-        match = opposing_spell.match(line)
-        if match:
-            card_id = match.group(1)
-            cardId = match.group(2)
-            self.gstate.opp_play_spell(cardId, card_id)
-            return True
+    def end_block(self):
+        """An ACTION_END line closes the innermost block. When the outermost
+        block closes, all of its events are applied to the game state at once.
+        """
+        if not self.block:
+            logger.warn("ACTION_END without an ACTION_START")
+            return
+        block = self.block
+        self.block = block.parent
+        if self.block:
+            return
 
-        # A spell has a target
-        # [Zone] ZoneChangeList.ProcessChanges() - processing index=5 change=powerTask=[power=[type=TAG_CHANGE entity=[id=61 cardId=CS2_022 name=Polymorph] tag=CARD_TARGET value=13] complete=False] entity=[name=Polymorph id=61 zone=PLAY zonePos=0 cardId=CS2_022 player=2] srcZoneTag=INVALID srcPos= dstZoneTag=INVALID dstPos=
-        # [Zone] ZoneChangeList.ProcessChanges() - processing index=5 change=powerTask=[power=[type=TAG_CHANGE entity=[id=54 cardId=EX1_334 name=Shadow Madness] tag=CARD_TARGET value=6] complete=False] entity=[name=Shadow Madness id=54 zone=PLAY zonePos=0 cardId=EX1_334 player=2] srcZoneTag=INVALID srcPos= dstZoneTag=INVALID dstPos=
-        opposing_spell_target = re.compile(r'[Zone].*TAG_CHANGE.*id=([0-9]+).*CARD_TARGET value=([0-9]+).*')
-        match = opposing_spell_target.match(line)
-        if match:
-            logger.debug(line)
-            card_id = match.group(1)
-            target = match.group(2)
-            self.gstate.add_target_to_card(card_id, target)
-            return True
+        pending = self.pending
+        self.pending = []
+        for event in pending:
+            self.gstate.apply_event(event)
+        self.blocks_completed += 1
+        if self.is_tingle_action(block):
+            self.actions_completed += 1
 
-        # Hero power with target
-        # [Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=[name=Fireblast id=5 zone=PLAY zonePos=0 cardId=CS2_034 player=1] tag=CARD_TARGET value=59
-        # [Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=[name=Lesser Heal id=37 zone=PLAY zonePos=0 cardId=CS1h_001 player=2] tag=CARD_TARGET value=36
-        opposing_power = re.compile(r'[Power].*TAG_CHANGE.*id=([0-9]+).*player=(1|2)] tag=CARD_TARGET value=([0-9]+)$')
-        match = opposing_power.match(line)
-        if match:
-            card_id = match.group(1)
-            player = match.group(2)
-            target_id = match.group(3)
-            self.gstate.hero_power(player, card_id, target_id)
-            return True
+    def is_tingle_action(self, block):
+        """True if block is an attack or play by one of Tingle's cards.
+        """
+        if block.subtype not in ACTION_SUBTYPES or not block.entity:
+            return False
+        match = entity_player_re.match(block.entity)
+        return bool(match) and match.group(1) == self.gstate.num
 
-        # Hero power without target
-        # [Power] GameState.DebugPrintPower() - ACTION_START Entity=[name=Dagger Mastery id=37 zone=PLAY zonePos=0 cardId=CS2_083b player=2] SubType=PLAY Index=0 Target=0
-        # TODO
+    def reset_blocks(self):
+        """Forget any open blocks and their events.
+        """
+        if self.block:
+            logger.warn("Dropping {} events of an unfinished action block".format(len(self.pending)))
+        self.block = None
+        self.pending = []
 
-        # No match...
-        return True
+    def board_is_consistent(self):
+        """True if no action is half applied: every block that has been started
+        in the log has also been applied to the game state.
+        """
+        return self.block is None
+
+    ###
+    # Rule actions: turn a match into an event
+    ###
+
+    def on_gamestart(self, match, line):
+        self.reset_blocks()
+        self.emit(events.GameStart())
+
+    def on_player_num(self, match, line):
+        self.emit(events.PlayerNumber(match.group(1)))
+
+    def on_playstate(self, match, line):
+        win_value = match.group(1)
+        if win_value == "WON" or win_value == "LOST":
+            self.emit(events.PlayState(win_value))
+        else:
+            pass
+            #logger.error("Unknown tag for win state: {}".format(win_value))
+
+    def on_entity_tag(self, match, line):
+        card_id = match.group(1)
+        tag = match.group(2)
+        value = match.group(3)
+        self.emit(events.EntityTag(card_id, tag, value))
+
+    def on_current_player(self, match, line):
+        playing = match.group(1)
+        if playing != '0' and playing != '1':
+            logger.fatal("UNKNOWN CURRENT_PLAYER VALUE")
+            sys.exit(1)
+        self.emit(events.TurnChange(playing))
+
+    def on_draw(self, match, line):
+        card_id = match.group(1)
+        cardId = match.group(2)
+        self.emit(events.DrawCard(cardId, card_id))
+
+    def on_opp_play(self, match, line):
+        logger.debug(line)
+        card_id = match.group(1)
+        pos = match.group(2)
+        cardId = match.group(3)
+        self.emit(events.OpponentPlay(cardId, card_id, pos))
+
+    def on_our_play(self, match, line):
+        logger.debug(line)
+        card_id = match.group(1)
+        cardId = match.group(2)
+        self.emit(events.FriendlyPlay(cardId, card_id))
+
+    def on_graveyard(self, match, line):
+        logger.debug(line)
+        card_id = match.group(1)
+        self.emit(events.Graveyard(card_id))
+
+    def on_zone(self, match, line):
+        card_id = match.group(1)
+        player = match.group(2)
+        zone = match.group(3)
+        self.emit(events.ZoneChange(card_id, player, zone))
+
+    def on_position(self, match, line):
+        card_id = match.group(2)
+        pos = match.group(3)
+        self.emit(events.PositionChange(card_id, pos))
+
+    def on_attack(self, match, line):
+        logger.debug(line)
+        att_id = match.group(2)
+        def_id = match.group(5)
+        self.emit(events.Attack(att_id, def_id))
+
+    def on_tag(self, match, line):
+        logger.debug(line)
+        card_id = match.group(1)
+        tag = match.group(2)
+        value = match.group(3)
+        self.emit(events.TagChange(card_id, tag, value))
+
+    def on_opp_spell(self, match, line):
+        card_id = match.group(1)
+        cardId = match.group(2)
+        self.emit(events.OpponentSpell(cardId, card_id))
+
+    def on_spell_target(self, match, line):
+        logger.debug(line)
+        card_id = match.group(1)
+        target = match.group(2)
+        self.emit(events.SpellTarget(card_id, target))
+
+    def on_hero_power(self, match, line):
+        card_id = match.group(1)
+        player = match.group(2)
+        target_id = match.group(3)
+        self.emit(events.HeroPower(player, card_id, target_id))
 
 # Actual hearthstone log
 #filename = os.path.expanduser("~/Library/Logs/Unity/Player.log")
@@ -268,12 +566,13 @@ filename = os.path.expanduser("~/Documents/hearthbot/sample_logs/tingle_bug_1.lo
 
 def main():
     """Just read the log and output the state changes. 
-    Used for testing.
+    Used for testing. The log can be given on the command line.
+    To check every log we have, use hearthbot.replay instead.
     """
-    parser = Parser(filename, '/tmp/output_hs.log')
-    while True:
-        parser.process_log()
-        time.sleep(2)               # So we don't read the file too often
+    hs_filepath = sys.argv[1] if len(sys.argv) > 1 else filename
+    parser = Parser(hs_filepath, '/tmp/output_hs.log')
+    tailer = LogTailer(parser)
+    tailer.run()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,128 @@
+"""
+Notifications of the changes to a GameState that the bot waits on.
+
+The GameState publishes a Change to its ChangeFeed (gstate.changes) when a game
+starts, a turn starts, Tingle draws a card, a minion dies, a card changes
+position and when the game is over. Subscribers pick the kinds of change they
+want and either get a callback for each one, or have them queued to take
+one at a time (get, or wait with a timeout).
+
+The state only changes while the parser reads the log, so waiting needs
+something to read it: Subscription.wait takes a pump, such as
+LogTailer.wait_for_batch (see LogTailer.wait_for_change).
+"""
+
+import time
+import collections
+
+from hearthbot import hotlog
+
+logger = hotlog.getLogger('CHANGES')
+
+# Kinds of change
+GAME_STARTED = 'GAME_STARTED'
+TURN_STARTED = 'TURN_STARTED'
+CARD_DRAWN = 'CARD_DRAWN'
+MINION_DIED = 'MINION_DIED'
+POSITION_CHANGED = 'POSITION_CHANGED'
+GAME_OVER = 'GAME_OVER'
+KINDS = (GAME_STARTED, TURN_STARTED, CARD_DRAWN, MINION_DIED, POSITION_CHANGED, GAME_OVER)
+
+class Change(object):
+    __slots__ = ('kind', 'player', 'card', 'value')
+
+    def __init__(self, kind, player=None, card=None, value=None):
+        """Args:
+            - kind: One of KINDS
+            - player: The name of the player it happened to, if any
+            - card: The card it happened to, if any
+            - value: What changed to (the new position, WON or LOST, the zone a minion died to)
+        """
+        self.kind = kind
+        self.player = player
+        self.card = card
+        self.value = value
+
+    def __repr__(self):
+        return "Change({} {} {} {})".format(self.kind, self.player, self.card, self.value)
+
+class Subscription(object):
+    def __init__(self, kinds=None, callback=None):
+        """Made by ChangeFeed.subscribe.
+        """
+        self.kinds = frozenset(kinds) if kinds else None
+        self.callback = callback
+        # Changes waiting to be taken, when there's no callback
+        self.queue = collections.deque()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def deliver(self, change):
+        if self.callback:
+            self.callback(change)
+        else:
+            self.queue.append(change)
+
+    def get(self):
+        """Returns the oldest change not taken yet, or None.
+        """
+        if self.queue:
+            return self.queue.popleft()
+        return None
+
+    def clear(self):
+        self.queue.clear()
+
+    def wait(self, pump, timeout=None):
+        """Returns the oldest change not taken yet, calling pump(seconds left) to
+        read more of the log until there is one. Returns None after timeout seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.queue:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+            pump(remaining)
+        return self.queue.popleft()
+
+class ChangeFeed(object):
+    def __init__(self):
+        """Where a GameState publishes its changes.
+        """
+        # kind -> the subscriptions that want it
+        self.subscribers = collections.defaultdict(list)
+        # Subscriptions that want every kind
+        self.everything = []
+
+    def subscribe(self, kinds=None, callback=None):
+        """Returns a Subscription to the changes of kinds (all kinds if None).
+        With a callback, callback(change) is called for each one, else they are queued.
+        """
+        subscription = Subscription(kinds, callback)
+        if subscription.kinds is None:
+            self.everything.append(subscription)
+        else:
+            for kind in subscription.kinds:
+                if kind not in KINDS:
+                    raise ValueError("No kind of change called {!r}".format(kind))
+                self.subscribers[kind].append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        if subscription in self.everything:
+            self.everything.remove(subscription)
+        for subscriptions in self.subscribers.values():
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+
+    def publish(self, kind, player=None, card=None, value=None):
+        subscriptions = self.subscribers.get(kind)
+        if not subscriptions and not self.everything:
+            return
+        change = Change(kind, player, card, value)
+        logger.debug("{}", change)
+        for subscription in (subscriptions or []) + self.everything:
+            subscription.deliver(change)
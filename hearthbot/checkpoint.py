@@ -0,0 +1,348 @@
+"""
+Checkpoints of the GameState, so a game can be picked up at any turn without
+replaying its log.
+
+The bot writes a checkpoint at the start of every turn and before every
+decision to checkpoints.hbc in the game directory. A checkpoint is the state
+broken into sections (the cards, the zones, the players, the tags...); most
+of them are only a delta against the checkpoint before: the entries of a
+section that changed and the keys that went away. Every KEYFRAME_EVERY
+checkpoints (and at the start of a game) the whole state is written, so
+restoring one never has to apply more than a few deltas. Writing doesn't
+block: if the disk falls behind and a checkpoint is dropped, the next one is
+a keyframe.
+
+File format:
+    'HBC2' header, then records of
+        <I length of the payload> <B 1 if a keyframe> <H turn> <payload>
+    The payload is marshal.dumps((label, sections)), where sections are the
+    whole state for a keyframe, else a delta (see diff).
+
+Restoring (CheckpointReader.restore) gives a new GameState with the cards,
+zones, players, tags, held back tag updates and what's left of the deck as
+they were. The tag history isn't kept.
+
+To list the checkpoints of a game and time restoring one:
+    python -m hearthbot.checkpoint tingle_logs/<game>/checkpoints.hbc [turn]
+"""
+
+import sys
+import time
+import struct
+import marshal
+import logging
+import collections
+
+from hearthbot import state, changes
+from hearthbot.archive import AsyncWriter
+from hearthbot.carddata import card_from_id, mechanic_names, mechanics_mask
+from hearthbot.tagstore import TagStore
+
+logger = logging.getLogger('CHECKPOINT')
+
+MAGIC = 'HBC2'
+CHECKPOINT_FILENAME = 'checkpoints.hbc'
+# A whole state is written this often, so at most this many minus one deltas are applied
+KEYFRAME_EVERY = 16
+
+record_struct = struct.Struct('<IBH')
+
+# Tag columns are kept in chunks of this many entities, so a delta only carries the
+# chunks that changed
+TAG_CHUNK = 16
+
+# Kinds of section in a delta
+REPLACE = 0
+DICT_DELTA = 1
+
+# The attributes of a Card kept in a checkpoint, after its cardId. flags are kept as
+# the names of the mechanics: the bits of those outside carddata.MECHANIC_NAMES depend
+# on the order the cards were loaded in.
+CARD_FIELDS = ('zone', 'pos', 'cost', 'attack', 'health', 'damage', 'armor',
+               'flags', 'active', '_has_attacked')
+
+def card_id_of(card):
+    return card.id if card else None
+
+def tag_chunks(tags):
+    """Returns the tag columns of a TagStore as {(tag code, first entity): [values]}.
+    """
+    chunks = {}
+    for code, column in enumerate(tags.columns):
+        for start in range(0, len(column), TAG_CHUNK):
+            chunks[(code, start)] = column[start:start + TAG_CHUNK].tolist()
+    return chunks
+
+def capture(gstate):
+    """Returns the state of gstate as a dict of sections, made of things marshal can write.
+    """
+    # Every card the state knows of, by id
+    known = dict(gstate.all_cards)
+    known.update(gstate.cards_in_play)
+    known.update(gstate.graveyard)
+    for zone_cards in gstate.zones.zones.values():
+        known.update(zone_cards)
+    players = {}
+    for player in (gstate.tingle, gstate.opponent):
+        for card in (player.hero, player.weapon):
+            if card:
+                known[card.id] = card
+        players[player.name] = (player.num, card_id_of(player.weapon), card_id_of(player.hero),
+                                player.mana, player.mana_spent, player.max_mana)
+
+    cards = {}
+    for card_id, card in known.items():
+        cards[card_id] = (card.template.cardId,) + tuple(
+            mechanic_names(card.flags) if f == 'flags' else getattr(card, f) for f in CARD_FIELDS)
+
+    tags = gstate.tags
+    pending = gstate.pending_tags
+    tracker = gstate.deck_tracker
+    if tracker:
+        deck = (tracker.remaining, tracker.size, tracker.curve, tracker.cost_counts,
+                tracker.type_counts, tracker.unknown_draws)
+    else:
+        deck = None
+    return {
+        'game': (gstate.turn, gstate.game_started, gstate.game_ended, gstate.num,
+                 gstate.opp_num, gstate.drew_card_this_turn),
+        'players': players,
+        'cards': cards,
+        'all_cards': sorted(gstate.all_cards),
+        'in_play': sorted(gstate.cards_in_play),
+        'graveyard': sorted(gstate.graveyard),
+        'zones': dict((key, list(zone_cards)) for key, zone_cards in gstate.zones.zones.items()
+                      if zone_cards),
+        'tag_names': list(tags.tag_names),
+        'words': list(tags.words),
+        'tag_columns': tag_chunks(tags),
+        'pending': dict((card_id, list(updates)) for card_id, updates in pending.pending.items()),
+        'pending_clock': (pending.clock, pending.last_sweep, pending.hits, pending.misses,
+                          pending.evictions),
+        'deck': deck,
+    }
+
+def diff(old, new):
+    """Returns the delta that turns the sections old into new.
+    Dict sections only keep the entries that changed and the keys that went away,
+    other sections that changed are kept whole.
+    """
+    delta = {}
+    for section, value in new.items():
+        before = old.get(section)
+        if value == before:
+            continue
+        if isinstance(value, dict) and isinstance(before, dict):
+            changed = dict((k, v) for k, v in value.items() if k not in before or before[k] != v)
+            removed = [k for k in before if k not in value]
+            delta[section] = (DICT_DELTA, changed, removed)
+        else:
+            delta[section] = (REPLACE, value)
+    return delta
+
+def patch(sections, delta):
+    """Returns new sections: sections with a delta (from diff) applied.
+    """
+    patched = dict(sections)
+    for section, change in delta.items():
+        if change[0] == DICT_DELTA:
+            value = dict(patched[section])
+            value.update(change[1])
+            for key in change[2]:
+                del value[key]
+            patched[section] = value
+        else:
+            patched[section] = change[1]
+    return patched
+
+def rebuild(sections, deck=None):
+    """Returns a new state.GameState from captured sections.
+
+    Args:
+        - sections: From capture (or CheckpointReader.load)
+        - deck: The deck.Deck Tingle was playing, to restore what's left of it
+    """
+    gstate = state.GameState(deck)
+    cards = {}
+    for card_id, fields in sections['cards'].items():
+        card = card_from_id(fields[0], card_id)
+        if not card:
+            logger.warn("No card {} for id {}, leaving it out".format(fields[0], card_id))
+            continue
+        for name, value in zip(CARD_FIELDS, fields[1:]):
+            setattr(card, name, mechanics_mask(value) if name == 'flags' else value)
+        cards[card_id] = card
+
+    gstate.all_cards = dict((i, cards[i]) for i in sections['all_cards'] if i in cards)
+    gstate.cards_in_play = dict((i, cards[i]) for i in sections['in_play'] if i in cards)
+    gstate.graveyard = dict((i, cards[i]) for i in sections['graveyard'] if i in cards)
+    for (controller, zone), ids in sections['zones'].items():
+        for card_id in ids:
+            if card_id in cards:
+                gstate.zones.move(cards[card_id], controller, zone)
+
+    for player in (gstate.tingle, gstate.opponent):
+        num, weapon, hero, player.mana, player.mana_spent, player.max_mana = \
+            sections['players'][player.name]
+        player.num = num
+        player.weapon = cards.get(weapon)
+        player.hero = cards.get(hero)
+    (gstate.turn, gstate.game_started, gstate.game_ended, gstate.num, gstate.opp_num,
+     gstate.drew_card_this_turn) = sections['game']
+
+    tags = gstate.tags = TagStore()
+    for name in sections['tag_names']:
+        tags.tag_code(name)
+    for word in sections['words']:
+        tags.word_codes[word] = len(tags.words)
+        tags.words.append(word)
+    for (code, start), values in sorted(sections['tag_columns'].items()):
+        tags.column(code).extend(values)
+
+    pending = gstate.pending_tags
+    pending.pending = dict((card_id, collections.deque(updates))
+                           for card_id, updates in sections['pending'].items())
+    (pending.clock, pending.last_sweep, pending.hits, pending.misses,
+     pending.evictions) = sections['pending_clock']
+
+    tracker = gstate.deck_tracker
+    if tracker and sections['deck']:
+        (remaining, tracker.size, curve, cost_counts, type_counts,
+         tracker.unknown_draws) = sections['deck']
+        tracker.remaining = dict(remaining)
+        tracker.curve = list(curve)
+        tracker.cost_counts = dict(cost_counts)
+        tracker.type_counts = dict(type_counts)
+    return gstate
+
+class CheckpointWriter(object):
+    def __init__(self, filepath, keyframe_every=KEYFRAME_EVERY):
+        """Write checkpoints to filepath, from a background thread (see archive.AsyncWriter).
+        """
+        self.filepath = filepath
+        self.keyframe_every = keyframe_every
+        self.writer = AsyncWriter(filepath)
+        self.writer.write(MAGIC)
+        # The sections of the last checkpoint, to write the next as a delta against
+        self.last = None
+        self.written = 0
+        # Turns started this game
+        self.turn = 0
+
+    def follow(self, gstate):
+        """Write a checkpoint of gstate at the start of every turn.
+        """
+        gstate.changes.subscribe([changes.GAME_STARTED, changes.TURN_STARTED],
+                                 lambda change: self.on_change(gstate, change))
+
+    def on_change(self, gstate, change):
+        if change.kind == changes.GAME_STARTED:
+            self.turn = 0
+            # A new game doesn't share much with the last one
+            self.last = None
+        else:
+            self.turn += 1
+            self.write(gstate, "{} turn".format(change.player))
+
+    def write(self, gstate, label):
+        """Write a checkpoint of gstate now, e.g. before a decision. label says why.
+        """
+        sections = capture(gstate)
+        keyframe = self.last is None or self.written % self.keyframe_every == 0
+        body = sections if keyframe else diff(self.last, sections)
+        payload = marshal.dumps((label, body))
+        if not self.writer.write(record_struct.pack(len(payload), keyframe, self.turn) + payload):
+            # The next delta would be against a checkpoint that isn't in the file
+            logger.warn("Dropped checkpoint '{}', the next one is a keyframe".format(label))
+            self.last = None
+            return
+        self.last = sections
+        self.written += 1
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+class CheckpointReader(object):
+    def __init__(self, filepath):
+        """Read the checkpoints in filepath. Only the record headers are read up front.
+        """
+        self.filepath = filepath
+        self.fileobj = open(filepath, 'rb')
+        if self.fileobj.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a checkpoint file".format(filepath))
+        # (offset of payload, length, keyframe, turn) of every checkpoint
+        self.records = []
+        while True:
+            header = self.fileobj.read(record_struct.size)
+            if len(header) < record_struct.size:
+                break
+            length, keyframe, turn = record_struct.unpack(header)
+            offset = self.fileobj.tell()
+            self.fileobj.seek(length, 1)
+            if self.fileobj.tell() - offset < length:
+                logger.warn("{} ends in a partial checkpoint".format(filepath))
+                break
+            self.records.append((offset, length, keyframe, turn))
+
+    def __len__(self):
+        return len(self.records)
+
+    def close(self):
+        self.fileobj.close()
+
+    def read_payload(self, index):
+        offset, length = self.records[index][:2]
+        self.fileobj.seek(offset)
+        return marshal.loads(self.fileobj.read(length))
+
+    def label(self, index):
+        return self.read_payload(index)[0]
+
+    def turn(self, index):
+        return self.records[index][3]
+
+    def find_turn(self, turn):
+        """Returns the index of the first checkpoint of a turn, or None.
+        """
+        for index, record in enumerate(self.records):
+            if record[3] == turn:
+                return index
+        return None
+
+    def load(self, index):
+        """Returns the sections of checkpoint index: its keyframe with the deltas after it applied.
+        """
+        start = index
+        while not self.records[start][2]:
+            start -= 1
+        sections = self.read_payload(start)[1]
+        for i in range(start + 1, index + 1):
+            sections = patch(sections, self.read_payload(i)[1])
+        return sections
+
+    def restore(self, index, deck=None):
+        """Returns a new state.GameState as it was at checkpoint index.
+        """
+        return rebuild(self.load(index), deck)
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    reader = CheckpointReader(sys.argv[1])
+    if len(sys.argv) < 3:
+        for index in range(len(reader)):
+            print("{:>4} turn {:>3}  {}".format(index, reader.turn(index), reader.label(index)))
+        return
+    index = reader.find_turn(int(sys.argv[2]))
+    if index is None:
+        sys.exit("No checkpoint for turn {}".format(sys.argv[2]))
+    start = time.time()
+    gstate = reader.restore(index)
+    print("Restored turn {} in {:.1f}ms".format(sys.argv[2], (time.time() - start) * 1e3))
+    print("TINGLE: {}".format(gstate.tingle.minions))
+    print("OPPONENT: {}".format(gstate.opponent.minions))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+Tingle's deck: what's in it, and what's left in it during a game.
+
+A deck file has one card per line, either "2 River Crocolisk" or just
+"River Crocolisk" (see db/bot_deck.txt and sample_deck.hsdeck). The names are
+resolved to cardIds through the card database once, when the deck is loaded,
+and everything the strategy might ask about the deck (the mana curve, how many
+cards of each cost or type) is counted up front.
+
+A Deck never changes. A DeckTracker follows a game: the GameState tells it about
+every draw (and every card put back during the mulligan), and it keeps the
+counts of what's left up to date so they can be asked for in O(1).
+"""
+
+import os
+import logging
+
+from hearthbot import HEARTH_DB
+from carddata import get_card_data
+
+logger = logging.getLogger('DECK')
+
+# The deck Tingle plays
+BOT_DECK = os.path.join(HEARTH_DB, 'bot_deck.txt')
+# Copies of a card when a line doesn't say (decks are usually 15 pairs)
+DEFAULT_COPIES = 2
+# Costs of this or more share the last bar of the mana curve
+CURVE_MAX = 7
+# The types of card that can be put in a deck
+DECK_TYPES = ('Minion', 'Spell', 'Weapon')
+
+def curve_bar(cost):
+    """Returns the bar of the mana curve a card of cost goes in.
+    """
+    return min(cost, CURVE_MAX)
+
+def resolve_card(name):
+    """Returns the card dict that a deck line means by name.
+    Of the cards with that name, collectible ones that can go in a deck win.
+    Raises ValueError if there's no such card.
+    """
+    candidates = get_card_data().find_by_name(name)
+    if not candidates:
+        raise ValueError("No card named {!r}".format(name))
+    candidates = sorted(candidates, key=lambda d: (not d.get('collectible'),
+                                                   d.get('type') not in DECK_TYPES))
+    return candidates[0]
+
+def parse_deck_line(line, default_copies=DEFAULT_COPIES):
+    """Returns (copies, name) of a deck file line, or None if it's blank.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    count, _, rest = line.partition(' ')
+    if count.isdigit() and rest.strip():
+        return int(count), rest.strip()
+    return default_copies, line
+
+class Deck(object):
+    """The cards in a deck, counted every way the strategy needs. Immutable.
+    """
+    __slots__ = ('name', 'counts', 'costs', 'types', 'size', 'curve', 'cost_counts', 'type_counts')
+
+    def __init__(self, name, counts):
+        """Args:
+            - name: What to call the deck
+            - counts: [(cardId, copies)]
+        """
+        set_field = object.__setattr__
+        data = get_card_data()
+        cards = dict(counts)
+        costs = dict((cardId, data.find_card(cardId).get('cost', 0)) for cardId in cards)
+        types = dict((cardId, data.find_card(cardId).get('type')) for cardId in cards)
+        curve = [0] * (CURVE_MAX + 1)
+        cost_counts = {}
+        type_counts = {}
+        for cardId, copies in cards.items():
+            curve[curve_bar(costs[cardId])] += copies
+            cost_counts[costs[cardId]] = cost_counts.get(costs[cardId], 0) + copies
+            type_counts[types[cardId]] = type_counts.get(types[cardId], 0) + copies
+
+        set_field(self, 'name', name)
+        # cardId -> copies
+        set_field(self, 'counts', cards)
+        # cardId -> mana cost and card type
+        set_field(self, 'costs', costs)
+        set_field(self, 'types', types)
+        set_field(self, 'size', sum(cards.values()))
+        # Cards per mana cost, with everything from CURVE_MAX up in the last bar
+        set_field(self, 'curve', tuple(curve))
+        set_field(self, 'cost_counts', cost_counts)
+        set_field(self, 'type_counts', type_counts)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Decks can't be changed, use a DeckTracker")
+
+    def __repr__(self):
+        return "Deck({}: {} cards, curve {})".format(self.name, self.size, list(self.curve))
+
+    def count(self, cardId):
+        return self.counts.get(cardId, 0)
+
+    def average_cost(self):
+        if not self.size:
+            return 0.0
+        return sum(self.costs[c] * n for c, n in self.counts.items()) / float(self.size)
+
+def load_deck(filepath=BOT_DECK, default_copies=DEFAULT_COPIES):
+    """Returns the Deck in a deck file.
+    Raises ValueError if a line names a card we don't know.
+    """
+    counts = {}
+    with open(filepath, 'r') as f:
+        for line in f:
+            parsed = parse_deck_line(line, default_copies)
+            if parsed is None:
+                continue
+            copies, name = parsed
+            cardId = resolve_card(name)['id']
+            counts[cardId] = counts.get(cardId, 0) + copies
+    deck = Deck(os.path.basename(filepath), counts.items())
+    if deck.size != 30:
+        logger.warn("{} has {} cards, not 30".format(deck.name, deck.size))
+    return deck
+
+class DeckTracker(object):
+    def __init__(self, deck):
+        """Follows what's left of deck during a game.
+        """
+        self.deck = deck
+        self.remaining = dict(deck.counts)
+        self.size = deck.size
+        self.curve = list(deck.curve)
+        self.cost_counts = dict(deck.cost_counts)
+        self.type_counts = dict(deck.type_counts)
+        # Cards drawn that we didn't expect to be in the deck (e.g. The Coin)
+        self.unknown_draws = 0
+
+    def __repr__(self):
+        return "DeckTracker({}: {} left, curve {})".format(self.deck.name, self.size, self.curve)
+
+    def _move(self, cardId, amount):
+        cost = self.deck.costs[cardId]
+        self.remaining[cardId] += amount
+        self.size += amount
+        self.curve[curve_bar(cost)] += amount
+        self.cost_counts[cost] += amount
+        self.type_counts[self.deck.types[cardId]] += amount
+
+    def draw(self, cardId):
+        """A card with cardId was drawn. Returns False if it can't have come from the deck.
+        """
+        if not self.remaining.get(cardId):
+            self.unknown_draws += 1
+            return False
+        self._move(cardId, -1)
+        return True
+
+    def put_back(self, cardId):
+        """A card with cardId went back into the deck (the mulligan).
+        """
+        if self.remaining.get(cardId, 0) >= self.deck.count(cardId):
+            logger.warn("{} put back in the deck, but we never drew it".format(cardId))
+            return
+        self._move(cardId, 1)
+
+    def left(self, cardId):
+        return self.remaining.get(cardId, 0)
+
+    def left_costing(self, cost):
+        """Returns how many cards left in the deck cost exactly cost.
+        """
+        return self.cost_counts.get(cost, 0)
+
+    def left_of_type(self, card_type):
+        return self.type_counts.get(card_type, 0)
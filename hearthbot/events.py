@@ -0,0 +1,298 @@
+"""
+The events the parser finds in the log, and a compact binary journal of them.
+
+The parser turns each interesting line into one of these events and hands it
+to the GameState, which applies it. Since the events hold everything the state
+needs, a game can be recorded to a journal once and replayed later without
+touching the log (or a regex) again.
+
+Journal format:
+    'HBJ1' header, then records of
+        <H length of the rest of the record> <B kind> <H string index>...
+    Every field is a string. The first time a string is used it is defined by
+    a STRING record (kind 0) holding its bytes, after that it is referred to by
+    its index in the order of definition. Index 0xFFFF means None.
+"""
+
+import struct
+import logging
+
+logger = logging.getLogger('EVENTS')
+
+class Event(object):
+    """Base of all events. Subclasses list their fields in __slots__
+    and give themselves a unique KIND for the journal.
+    """
+    __slots__ = ()
+    KIND = None
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__,
+                               ", ".join(repr(getattr(self, name)) for name in self.__slots__))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.values() == other.values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def apply(self, gstate):
+        """Apply this event to a state.GameState.
+        """
+        raise NotImplementedError
+
+class GameStart(Event):
+    __slots__ = ()
+    KIND = 1
+
+    def apply(self, gstate):
+        gstate.start_game()
+
+class PlayerNumber(Event):
+    __slots__ = ('num',)
+    KIND = 2
+
+    def apply(self, gstate):
+        gstate.set_player_number(self.num)
+
+class PlayState(Event):
+    """Tingle won or lost. value is WON or LOST.
+    """
+    __slots__ = ('value',)
+    KIND = 3
+
+    def apply(self, gstate):
+        if self.value == "WON":
+            gstate.set_won()
+        elif self.value == "LOST":
+            gstate.set_lost()
+
+class TurnChange(Event):
+    """playing is '1' if it's our turn, '0' if it's the opponent's.
+    """
+    __slots__ = ('playing',)
+    KIND = 4
+
+    def apply(self, gstate):
+        if self.playing == '1':
+            gstate.set_our_turn()
+        else:
+            gstate.set_opponent_turn()
+
+class DrawCard(Event):
+    __slots__ = ('cardId', 'card_id')
+    KIND = 5
+
+    def apply(self, gstate):
+        gstate.add_card_to_hand(self.cardId, self.card_id)
+
+class OpponentPlay(Event):
+    __slots__ = ('cardId', 'card_id', 'pos')
+    KIND = 6
+
+    def apply(self, gstate):
+        gstate.opp_play_minion(self.cardId, self.card_id, pos=self.pos)
+
+class FriendlyPlay(Event):
+    __slots__ = ('cardId', 'card_id')
+    KIND = 7
+
+    def apply(self, gstate):
+        gstate.play_minion(self.cardId, self.card_id)
+
+class Graveyard(Event):
+    __slots__ = ('card_id',)
+    KIND = 8
+
+    def apply(self, gstate):
+        gstate.send_to_graveyard(self.card_id)
+
+class ZoneChange(Event):
+    __slots__ = ('card_id', 'player', 'zone')
+    KIND = 9
+
+    def apply(self, gstate):
+        gstate.update_zone(self.card_id, self.player, self.zone)
+
+class PositionChange(Event):
+    __slots__ = ('card_id', 'pos')
+    KIND = 10
+
+    def apply(self, gstate):
+        gstate.update_card_pos(self.card_id, self.pos)
+
+class Attack(Event):
+    __slots__ = ('att_id', 'def_id')
+    KIND = 11
+
+    def apply(self, gstate):
+        gstate.perform_attack(self.att_id, self.def_id)
+
+class TagChange(Event):
+    __slots__ = ('card_id', 'tag', 'value')
+    KIND = 12
+
+    def apply(self, gstate):
+        gstate.update_card_tag(self.card_id, self.tag, self.value)
+
+class OpponentSpell(Event):
+    __slots__ = ('cardId', 'card_id')
+    KIND = 13
+
+    def apply(self, gstate):
+        gstate.opp_play_spell(self.cardId, self.card_id)
+
+class SpellTarget(Event):
+    __slots__ = ('card_id', 'target_id')
+    KIND = 14
+
+    def apply(self, gstate):
+        gstate.add_target_to_card(self.card_id, self.target_id)
+
+class HeroPower(Event):
+    __slots__ = ('player', 'card_id', 'target_id')
+    KIND = 15
+
+    def apply(self, gstate):
+        gstate.hero_power(self.player, self.card_id, self.target_id)
+
+class EntityTag(Event):
+    """Any tag change of an entity, kept in the game's tag store.
+    """
+    __slots__ = ('card_id', 'tag', 'value')
+    KIND = 16
+
+    def apply(self, gstate):
+        gstate.record_tag(self.card_id, self.tag, self.value)
+
+class Block(object):
+    """An ACTION_START ... ACTION_END block from the power log: the events
+    (and nested blocks) caused by one action.
+    """
+    __slots__ = ('entity', 'subtype', 'target', 'parent', 'children')
+
+    def __init__(self, entity, subtype, target, parent=None):
+        self.entity = entity
+        self.subtype = subtype
+        self.target = target
+        self.parent = parent
+        self.children = []
+
+    def __repr__(self):
+        return "Block({} {} -> {}: {} children)".format(self.subtype, self.entity,
+                                                       self.target, len(self.children))
+
+    def events(self):
+        """Returns all the events in this block and its nested blocks, in order.
+        """
+        found = []
+        for child in self.children:
+            if isinstance(child, Block):
+                found.extend(child.events())
+            else:
+                found.append(child)
+        return found
+
+EVENT_TYPES = dict((cls.KIND, cls) for cls in
+                   (GameStart, PlayerNumber, PlayState, TurnChange, DrawCard,
+                    OpponentPlay, FriendlyPlay, Graveyard, ZoneChange, PositionChange,
+                    Attack, TagChange, OpponentSpell, SpellTarget, HeroPower, EntityTag))
+
+###
+# Journal
+###
+
+MAGIC = 'HBJ1'
+STRING = 0
+NONE_INDEX = 0xFFFF
+MAX_STRINGS = NONE_INDEX
+
+header_struct = struct.Struct('<HB')
+
+class JournalWriter(object):
+    def __init__(self, fileobj):
+        """Write events to a binary journal.
+
+        Args:
+            - fileobj: A file opened for binary writing
+        """
+        self.fileobj = fileobj
+        self.strings = {}
+        self.fileobj.write(MAGIC)
+
+    def intern(self, value):
+        """Returns the index of a string, defining it in the journal if it is new.
+        """
+        if value is None:
+            return NONE_INDEX
+        index = self.strings.get(value)
+        if index is None:
+            if len(self.strings) >= MAX_STRINGS:
+                raise ValueError("Too many distinct strings for one journal")
+            index = len(self.strings)
+            self.strings[value] = index
+            data = value.encode('utf-8') if isinstance(value, unicode) else value
+            self.fileobj.write(header_struct.pack(len(data) + 1, STRING))
+            self.fileobj.write(data)
+        return index
+
+    def write(self, event):
+        indexes = [self.intern(v) for v in event.values()]
+        self.fileobj.write(header_struct.pack(1 + 2*len(indexes), event.KIND))
+        if indexes:
+            self.fileobj.write(struct.pack('<{}H'.format(len(indexes)), *indexes))
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        self.fileobj.close()
+
+def read_journal(data):
+    """Yields the events in a journal, given its contents as a string.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not an event journal")
+    strings = []
+    offset = len(MAGIC)
+    end = len(data)
+    unpack_header = header_struct.unpack_from
+    header_size = header_struct.size
+    while offset + header_size <= end:
+        length, kind = unpack_header(data, offset)
+        start = offset + header_size
+        offset = start + length - 1
+        if kind == STRING:
+            strings.append(data[start:offset])
+            continue
+        cls = EVENT_TYPES.get(kind)
+        if cls is None:
+            logger.error("Skipping unknown event kind {} in journal".format(kind))
+            continue
+        num_fields = (length - 1) // 2
+        indexes = struct.unpack_from('<{}H'.format(num_fields), data, start)
+        yield cls(*[None if i == NONE_INDEX else strings[i] for i in indexes])
+
+def load_journal(filepath):
+    """Returns the list of events in a journal file.
+    """
+    with open(filepath, 'rb') as f:
+        return list(read_journal(f.read()))
+
+def replay_journal(filepath, gstate):
+    """Apply every event in a journal file to gstate, without parsing the log.
+    Returns the number of events applied.
+    """
+    num_events = 0
+    with open(filepath, 'rb') as f:
+        for event in read_journal(f.read()):
+            gstate.apply_event(event)
+            num_events += 1
+    return num_events
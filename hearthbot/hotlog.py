@@ -0,0 +1,195 @@
+"""
+Logging for the hot paths (parsing events, planning plays) that costs next to
+nothing when nobody is listening.
+
+A HotLogger wraps a logging.Logger of a subsystem (STATE, ALGS, BOT...) and
+takes the message as a format string and its arguments:
+    logger.info("{} has {} ATTACK", card, card.attack)
+If the subsystem's level (see set_level) is above the message's, that's one
+isEnabledFor check and nothing is formatted. Otherwise the record carries a
+Message that formats itself only when a handler asks for the text. Wrap
+arguments that are expensive to turn into text in pretty() to pformat them,
+also only when needed.
+
+For post-mortems, a TraceSink can be set (set_trace) to get every message of
+every subsystem from trace_level up, whatever the logging levels, as compact
+binary records written in the background. The format strings are stored once
+and numbers and strings are stored as they are (anything else as its repr),
+so tracing costs much less than text logging. read_trace turns a trace back
+into text.
+
+Trace format:
+    'HBT2' header, then records of
+        <I length of the rest of the record> <B kind>
+    A STRING record (kind 0) defines the next string index (logger names and
+    format strings). An ENTRY record (kind 1) is
+        <d time> <B level> <H logger name index> <H format index> <marshal'd args>
+"""
+
+import time
+import struct
+import marshal
+import logging
+import pprint
+
+from archive import AsyncWriter
+
+# Where traced messages go, None to not trace (see set_trace)
+trace = None
+# The lowest level traced
+trace_level = logging.DEBUG
+
+TRACE_MAGIC = 'HBT2'
+STRING = 0
+ENTRY = 1
+record_struct = struct.Struct('<IB')
+entry_struct = struct.Struct('<dBHH')
+# Argument types written as they are, everything else is written as its repr
+PLAIN_TYPES = (int, long, float, str, unicode, bool, type(None))
+
+class Message(object):
+    """A log message that isn't formatted until it's turned into text.
+    """
+    __slots__ = ('fmt', 'args', 'text')
+
+    def __init__(self, fmt, args):
+        self.fmt = fmt
+        self.args = args
+        self.text = None
+
+    def __str__(self):
+        # Every handler asks, only format once
+        if self.text is None:
+            self.text = self.fmt.format(*self.args)
+        return self.text
+
+class pretty(object):
+    """An argument that is pprint.pformat'ed when (if) the message is formatted.
+    """
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __format__(self, spec):
+        return pprint.pformat(self.obj)
+
+    def __repr__(self):
+        return pprint.pformat(self.obj)
+
+class HotLogger(object):
+    def __init__(self, name):
+        """The hot path logger of the subsystem name. Use getLogger.
+        """
+        self.name = name
+        self.logger = logging.getLogger(name)
+
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, fmt, *args):
+        if trace is not None and level >= trace_level:
+            trace.write(level, self.name, fmt, args)
+        if self.logger.isEnabledFor(level):
+            self.logger._log(level, Message(fmt, args) if args else fmt, ())
+
+    def debug(self, fmt, *args):
+        self.log(logging.DEBUG, fmt, *args)
+
+    def info(self, fmt, *args):
+        self.log(logging.INFO, fmt, *args)
+
+    def warn(self, fmt, *args):
+        self.log(logging.WARNING, fmt, *args)
+
+    warning = warn
+
+    def error(self, fmt, *args):
+        self.log(logging.ERROR, fmt, *args)
+
+    def fatal(self, fmt, *args):
+        self.log(logging.CRITICAL, fmt, *args)
+
+    critical = fatal
+
+hot_loggers = {}
+
+def getLogger(name):
+    """Returns the HotLogger of a subsystem.
+    """
+    logger = hot_loggers.get(name)
+    if logger is None:
+        logger = hot_loggers[name] = HotLogger(name)
+    return logger
+
+def set_level(name, level):
+    """Only log messages of level and up from the subsystem name.
+    """
+    logging.getLogger(name).setLevel(level)
+
+def plain(arg):
+    if isinstance(arg, PLAIN_TYPES):
+        return arg
+    return repr(arg)
+
+class TraceSink(object):
+    def __init__(self, filepath):
+        """Write traced messages to filepath in the background (see archive.AsyncWriter).
+        """
+        self.filepath = filepath
+        self.writer = AsyncWriter(filepath)
+        self.writer.write(TRACE_MAGIC)
+        self.strings = {}
+        self.entries = 0
+
+    def intern(self, value):
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+            self.writer.write(record_struct.pack(len(value) + 1, STRING) + value)
+        return index
+
+    def write(self, level, name, fmt, args):
+        body = entry_struct.pack(time.time(), level, self.intern(name), self.intern(fmt))
+        try:
+            body += marshal.dumps(args)
+        except ValueError:
+            body += marshal.dumps(tuple(plain(arg) for arg in args))
+        self.writer.write(record_struct.pack(len(body) + 1, ENTRY) + body)
+        self.entries += 1
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+
+def set_trace(sink, level=logging.DEBUG):
+    """Trace every message of level and up to sink (a TraceSink), or stop tracing with None.
+    """
+    global trace, trace_level
+    trace = sink
+    trace_level = level
+
+def read_trace(filepath):
+    """Returns the messages in a trace as [(time, level, logger name, text)].
+    """
+    messages = []
+    strings = []
+    with open(filepath, 'rb') as f:
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError("{} is not a trace".format(filepath))
+        while True:
+            header = f.read(record_struct.size)
+            if len(header) < record_struct.size:
+                break
+            length, kind = record_struct.unpack(header)
+            body = f.read(length - 1)
+            if kind == STRING:
+                strings.append(body)
+                continue
+            when, level, name, fmt = entry_struct.unpack_from(body)
+            args = marshal.loads(body[entry_struct.size:])
+            text = strings[fmt].format(*args) if args else strings[fmt]
+            messages.append((when, level, strings[name], text))
+    return messages
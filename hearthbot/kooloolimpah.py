@@ -2,6 +2,9 @@ from subprocess import call
 
 afplay = "afplay wavs/{}"
 
+# Set to False to keep Tingle quiet (replaying logs, running tests)
+enabled = True
+
 hup = "WW_Tingle_Hup.wav"
 yoop = "WW_Tingle_Yoop.wav"
 kooloo = "WW_Tingle_KoolooLim.wav"
@@ -11,14 +14,18 @@ limpah = "MM_Tingle_Magic.wav"
 
 grouch_wav = "WW_Tingle_Grouch.wav"
 
+def play(wav):
+    if enabled:
+        call(afplay.format(wav), shell=True)
+
 def kooloo_limpah():
-    call(afplay.format(hup), shell=True)
-    call(afplay.format(yoop), shell=True)
-    call(afplay.format(kooloo), shell=True)
-    call(afplay.format(pah), shell=True)
+    play(hup)
+    play(yoop)
+    play(kooloo)
+    play(pah)
 
 def magic():
-    call(afplay.format(limpah), shell=True)
+    play(limpah)
 
 def grouch():
-    call(afplay.format(grouch_wav), shell=True)
+    play(grouch_wav)
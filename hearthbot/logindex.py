@@ -0,0 +1,160 @@
+"""
+An index of where every game, turn and result starts in a hearthstone log.
+
+The log is scanned once through mmap (so it's never read into memory) and the
+byte offsets of these lines are recorded:
+- CREATE_GAME: the start of a game
+- TAG_CHANGE Entity=... tag=CURRENT_PLAYER value=1: the start of a turn
+- TAG_CHANGE Entity=... tag=PLAYSTATE value=WON/LOST/TIED: the end of a game
+
+The index is saved next to the log (Player.log -> Player.log.idx) and reused
+as long as the log's size and mtime haven't changed.
+"""
+
+import os
+import re
+import json
+import mmap
+import logging
+
+logger = logging.getLogger('LOG-INDEX')
+
+INDEX_SUFFIX = '.idx'
+
+# Bump this when the saved format changes
+INDEX_VERSION = 1
+
+# Every line we care about is a [Power] line, so anchor on that and let the regex
+# engine do the scanning.
+boundary_re = re.compile(r'^\[Power\] GameState\.DebugPrintPower\(\) - +'
+                         r'(?:(CREATE_GAME)'
+                         r'|TAG_CHANGE Entity=(.*) tag=(CURRENT_PLAYER|PLAYSTATE) value=([A-Z0-9]+))',
+                         re.MULTILINE)
+
+END_STATES = ('WON', 'LOST', 'TIED')
+
+class LogIndex(object):
+    def __init__(self, filepath, size=0, mtime=0, games=None):
+        """The boundaries of the games in one log file.
+
+        Each game is a dict:
+            - start: offset of its CREATE_GAME line
+            - turns: [(offset, player name)] of each CURRENT_PLAYER change, turn 1 first
+            - results: [(offset, player name, WON/LOST/TIED)]
+            - end: offset of the first result line, or None if the game is unfinished
+        """
+        self.filepath = filepath
+        self.size = size
+        self.mtime = mtime
+        self.games = games or []
+
+    def __repr__(self):
+        return "LogIndex({}: {} games)".format(self.filepath, len(self.games))
+
+    def __len__(self):
+        return len(self.games)
+
+    def game(self, game_num):
+        """Returns the game with number game_num (starting from 1).
+        """
+        if game_num < 1 or game_num > len(self.games):
+            raise IndexError("{} has no game {} (it has {})".\
+                             format(self.filepath, game_num, len(self.games)))
+        return self.games[game_num - 1]
+
+    def game_offset(self, game_num):
+        return self.game(game_num)['start']
+
+    def turn_offset(self, game_num, turn):
+        """Returns the offset of the line starting turn (starting from 1) of a game.
+        """
+        turns = self.game(game_num)['turns']
+        if turn < 1 or turn > len(turns):
+            raise IndexError("Game {} has no turn {} (it has {})".\
+                             format(game_num, turn, len(turns)))
+        return turns[turn - 1][0]
+
+    def game_end(self, game_num):
+        """Returns the offset where a game's lines end: the start of the next game,
+        or the end of the log.
+        """
+        if game_num < len(self.games):
+            return self.games[game_num]['start']
+        return self.size
+
+    def is_stale(self):
+        try:
+            st = os.stat(self.filepath)
+        except OSError:
+            return True
+        return st.st_size != self.size or int(st.st_mtime) != self.mtime
+
+    def save(self, index_path=None):
+        index_path = index_path or self.filepath + INDEX_SUFFIX
+        data = {'version': INDEX_VERSION,
+                'size': self.size,
+                'mtime': self.mtime,
+                'games': self.games}
+        try:
+            with open(index_path, 'w') as f:
+                json.dump(data, f)
+        except IOError as e:
+            logger.warn("Could not save log index {}: {}".format(index_path, e))
+
+def build_index(filepath):
+    """Scan a log once and return its LogIndex.
+    """
+    st = os.stat(filepath)
+    index = LogIndex(filepath, st.st_size, int(st.st_mtime))
+    if not st.st_size:
+        return index
+
+    game = None
+    with open(filepath, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for match in boundary_re.finditer(mm):
+                offset = match.start()
+                if match.group(1):
+                    game = {'start': offset, 'turns': [], 'results': [], 'end': None}
+                    index.games.append(game)
+                elif game is None:
+                    # Tags from before the first game in the log
+                    continue
+                elif match.group(3) == 'CURRENT_PLAYER':
+                    if match.group(4) == '1':
+                        game['turns'].append((offset, match.group(2)))
+                elif match.group(4) in END_STATES:
+                    game['results'].append((offset, match.group(2), match.group(4)))
+                    if game['end'] is None:
+                        game['end'] = offset
+        finally:
+            mm.close()
+
+    logger.info("Indexed {}: {} games".format(filepath, len(index.games)))
+    return index
+
+def load_index(filepath, save=True):
+    """Returns the index of a log, using the saved one next to it unless the log
+    has changed since. A rebuilt index is saved if save is True.
+    """
+    index_path = filepath + INDEX_SUFFIX
+    try:
+        with open(index_path, 'r') as f:
+            data = json.load(f)
+        if data.get('version') == INDEX_VERSION:
+            games = data['games']
+            # json gives back lists, we want tuples
+            for game in games:
+                game['turns'] = [tuple(t) for t in game['turns']]
+                game['results'] = [tuple(r) for r in game['results']]
+            index = LogIndex(filepath, data['size'], data['mtime'], games)
+            if not index.is_stale():
+                return index
+    except (IOError, ValueError, KeyError):
+        pass
+
+    index = build_index(filepath)
+    if save:
+        index.save(index_path)
+    return index
@@ -0,0 +1,64 @@
+"""
+Reads the hearthstone log in large blocks and hands out only the lines the
+parser could care about.
+
+Most of the Unity log is noise (GL extension dumps, asset loading, the
+"(Filename: ...)" line after every message, [Bob] lines). Only [Power] and
+[Zone] lines ever match a parser rule, so those are picked out of each block
+with one regex scan and everything else is dropped without being looked at
+line by line.
+
+A line that hasn't been completely written yet (no newline) is left for the
+next read, so the parser never sees half a line.
+"""
+
+import re
+
+# How much of the log to read at a time
+BLOCK_SIZE = 256 * 1024
+
+relevant_re = re.compile(r'^\[(?:Power|Zone)\][^\n]*\n', re.MULTILINE)
+
+class LogReader(object):
+    def __init__(self, fileobj, pos, end=None, block_size=BLOCK_SIZE):
+        """Iterate over the relevant lines of a log.
+
+        Args:
+            - fileobj: The log, opened in binary mode
+            - pos: The offset to start reading from (the start of a line)
+            - end: The offset to stop at (the start of a line), or None for the end of the file
+            - block_size: How many bytes to read at a time
+
+        After iterating, pos is the offset just past the last complete line read.
+        While iterating, line_pos is the offset of the line last handed out.
+        """
+        self.fileobj = fileobj
+        self.pos = pos
+        self.line_pos = None
+        self.end = end
+        self.block_size = block_size
+
+    def __iter__(self):
+        self.fileobj.seek(self.pos)
+        # The start of a partial line left over from the last block
+        carry = ''
+        while True:
+            size = self.block_size
+            if self.end is not None:
+                size = min(size, self.end - self.pos - len(carry))
+                if size <= 0:
+                    break
+            data = self.fileobj.read(size)
+            if not data:
+                break
+            block = carry + data
+            last_newline = block.rfind('\n')
+            if last_newline < 0:
+                carry = block
+                continue
+            for match in relevant_re.finditer(block, 0, last_newline + 1):
+                # The block starts at pos, with the carried start of a line
+                self.line_pos = self.pos + match.start()
+                yield match.group(0)
+            self.pos += last_newline + 1
+            carry = block[last_newline + 1:]
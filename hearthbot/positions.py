@@ -0,0 +1,130 @@
+"""
+Where Tingle's hand cards and everybody's minions will be once the actions we
+just took have happened, so the bot can click the next one straight away
+instead of waiting for the log to tell it.
+
+A PositionCache starts from the game state (sync) and applies the effects of
+our own actions to its own copy of the board (a snapshot.Snapshot) as soon as
+we take them: a played card leaves the hand and the cards after it move left,
+a minion goes on the board and the minions after it move right, and minions
+that die in an attack leave the board. Once the log has caught up, reconcile
+compares the predictions with the state, logs (and counts) any that were
+wrong, and starts again from the state.
+"""
+
+from zones import by_position
+from carddata import Minion
+import hotlog
+
+logger = hotlog.getLogger('POSITIONS')
+
+def drop_slot(num_minions):
+    """Returns the board index a minion lands at when it's dropped in the middle of the
+    board (where control.play_minion drops it) with num_minions minions already there:
+    to the right of every minion whose center is left of the drop point, which is
+    the right half of the board, rounding the middle minion left.
+    """
+    return (num_minions + 1) // 2
+
+class PositionCache(object):
+    def __init__(self):
+        """Call sync before using it.
+        """
+        self.gstate = None
+        # The board as we predict it
+        self.snapshot = None
+        # The ids of Tingle's hand cards, in hand order
+        self.hand = []
+        # Predictions made, and how many reconciles found some of them wrong
+        self.predictions = 0
+        self.mispredictions = 0
+        # Predictions since the last sync
+        self.unconfirmed = 0
+
+    def __repr__(self):
+        return "PositionCache({} predictions, {} wrong)".format(self.predictions,
+                                                                self.mispredictions)
+
+    def sync(self, gstate):
+        """Start predicting from the state as it is now.
+        """
+        self.gstate = gstate
+        self.snapshot = gstate.snapshot()
+        self.hand = [c.id for c in sorted(gstate.tingle.hand, key=by_position)]
+        self.unconfirmed = 0
+
+    def side(self, player_name):
+        return self.snapshot.tingle if player_name == self.snapshot.tingle.name \
+            else self.snapshot.opponent
+
+    def hand_size(self):
+        return len(self.hand)
+
+    def hand_index(self, card):
+        """Returns the position (from 1) card will be at in Tingle's hand.
+        """
+        return self.hand.index(card.id) + 1
+
+    def board_size(self, player_name):
+        return len(self.side(player_name).minions)
+
+    def board_slot(self, card):
+        """Returns the position (from 1) a minion will be at on its board.
+        """
+        side = self.snapshot.side(card.id)
+        return side.minions.index(card.id) + 1
+
+    def minions(self, player_name):
+        """Returns the minions (from the game state) that will be on a player's board, in order.
+        """
+        return [self.gstate.card_with_id(card_id) for card_id in self.side(player_name).minions]
+
+    def remaining_health(self, card):
+        return self.snapshot.card(card.id).remaining_health()
+
+    def predict_play(self, card):
+        """Tingle plays card from hand (dropped in the middle of the board if it's a minion).
+        """
+        self.hand.remove(card.id)
+        if isinstance(card, Minion):
+            slot = drop_slot(len(self.snapshot.tingle.minions))
+            self.snapshot.play_minion(card.id, slot)
+        else:
+            side = self.snapshot.tingle
+            side.hand = tuple(c for c in side.hand if c != card.id)
+            side.mana_spent += card.cost
+        self.predictions += 1
+        self.unconfirmed += 1
+
+    def predict_attack(self, attacker, defender=None):
+        """attacker attacks defender (a minion, or the hero if None). Minions that die leave
+        the board.
+        """
+        if defender is None or defender.id not in self.snapshot.cards:
+            self.snapshot.mutable(attacker.id).performs_attack()
+        else:
+            self.snapshot.attack(attacker.id, defender.id)
+        self.predictions += 1
+        self.unconfirmed += 1
+
+    def reconcile(self, gstate=None):
+        """Once the log has caught up with our actions, check the predictions against the
+        state and start again from it. Returns False if any were wrong.
+        """
+        gstate = gstate or self.gstate
+        predicted = [('hand', self.hand),
+                     (gstate.tingle.name, list(self.snapshot.tingle.minions)),
+                     (gstate.opponent.name, list(self.snapshot.opponent.minions))]
+        actual = {'hand': [c.id for c in sorted(gstate.tingle.hand, key=by_position)],
+                  gstate.tingle.name: [c.id for c in gstate.tingle.minions],
+                  gstate.opponent.name: [c.id for c in gstate.opponent.minions]}
+        right = True
+        for where, ids in predicted:
+            if ids != actual[where]:
+                logger.warn("Mispredicted {} after {} actions: {}, it's {}",
+                            where, self.unconfirmed, ids, actual[where])
+                right = False
+        if not right:
+            self.mispredictions += 1
+        self.sync(gstate)
+        return right
@@ -0,0 +1,206 @@
+"""
+Replays every log we have through the parser and game state, to check that
+they still make sense of real games.
+
+The work is split into one task per game (found with logindex) and spread
+over a process pool. Each worker runs a Parser headless and reports the final
+boards, the warnings/errors the state logged and how fast it went. The reports
+are merged into one summary.
+
+Usage:
+    python -m hearthbot.replay [-j PROCESSES] [--json] [LOG ...]
+
+With no logs given, replays sample_logs/*.log and tingle_logs/*/hearthstone.log(.gz).
+Gzipped logs are unpacked to a temporary directory first.
+"""
+
+import os, sys
+import glob
+import json
+import shutil
+import tempfile
+import time
+import logging
+import argparse
+import traceback
+import multiprocessing
+
+from hearthbot import cardlogger, logindex, kooloolimpah, archive
+from hearthbot import SAMPLE_LOGS, TINGLE_LOGS
+
+logger = logging.getLogger('REPLAY')
+
+# How many logged problems to keep per game
+MAX_MESSAGES = 20
+
+def corpus_logs():
+    """Returns all the logs we keep around for testing.
+    """
+    logs = sorted(glob.glob(os.path.join(SAMPLE_LOGS, '*.log')))
+    logs += sorted(glob.glob(os.path.join(TINGLE_LOGS, '*', 'hearthstone.log')))
+    logs += sorted(glob.glob(os.path.join(TINGLE_LOGS, '*', 'hearthstone.log.gz')))
+    return logs
+
+def unpack_log(log, tmpdir):
+    """Returns the path of a plain copy of log in tmpdir if it is gzipped,
+    otherwise log itself.
+    """
+    if not log.endswith('.gz'):
+        return log
+    unpacked = os.path.join(tmpdir, str(len(os.listdir(tmpdir))) + '.log')
+    src = archive.open_archive(log)
+    with open(unpacked, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    src.close()
+    return unpacked
+
+def replay_tasks(logs):
+    """Split the logs into (log, game_num, num_bytes) tasks, biggest first.
+
+    The hearthstone.log copies written by the bot start after CREATE_GAME, so
+    a log without any games is replayed whole as one already started game
+    (game_num None).
+    """
+    tasks = []
+    for log in logs:
+        index = logindex.load_index(log, save=False)
+        if not index.size:
+            continue
+        if not index.games:
+            tasks.append((log, None, index.size))
+        for game_num in range(1, len(index) + 1):
+            num_bytes = index.game_end(game_num) - index.game_offset(game_num)
+            tasks.append((log, game_num, num_bytes))
+    tasks.sort(key=lambda t: t[2], reverse=True)
+    return tasks
+
+class ProblemCounter(logging.Handler):
+    """Counts (and keeps the first few of) the warnings and errors logged.
+    """
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.counts = {}
+        self.messages = []
+
+    def emit(self, record):
+        self.counts[record.levelname] = self.counts.get(record.levelname, 0) + 1
+        if len(self.messages) < MAX_MESSAGES:
+            self.messages.append("{}: {}".format(record.levelname, record.getMessage()))
+
+def describe_player(player):
+    return {'hero': repr(player.hero),
+            'mana': player.mana,
+            'hand': [repr(c) for c in player.hand],
+            'minions': [repr(m) for m in player.minions]}
+
+def replay_game(task):
+    """Replay one game of a log headless. Runs in a worker process.
+    Returns a dict summary of the game.
+    """
+    log, game_num, num_bytes = task
+    kooloolimpah.enabled = False
+
+    counter = ProblemCounter()
+    root = logging.getLogger()
+    root.handlers = [counter]
+    root.setLevel(logging.WARNING)
+
+    summary = {'log': log, 'game': game_num, 'bytes': num_bytes,
+               'lines': 0, 'seconds': 0.0, 'exception': None}
+    start = time.time()
+    parser = cardlogger.Parser(log, None)
+    try:
+        if game_num is None:
+            parser.gstate.start_game()
+            end = num_bytes
+        else:
+            parser.seek_game(game_num)
+            end = parser.index().game_end(game_num)
+        summary['lines'] = parser.process_until(end)
+    except Exception:
+        summary['exception'] = traceback.format_exc()
+        # The offset of the line that broke us
+        summary['failed_at'] = parser.failed_at
+    summary['seconds'] = time.time() - start
+
+    gstate = parser.gstate
+    summary['turn'] = gstate.turn
+    summary['game_ended'] = gstate.game_ended
+    summary['tingle'] = describe_player(gstate.tingle)
+    summary['opponent'] = describe_player(gstate.opponent)
+    summary['problems'] = counter.counts
+    summary['pending_tags'] = gstate.pending_tags.stats()
+    summary['messages'] = counter.messages
+    return summary
+
+def replay_corpus(logs, processes=None):
+    """Replay all games in logs across a pool of processes.
+    Returns (summaries, seconds taken).
+    """
+    start = time.time()
+    tmpdir = tempfile.mkdtemp(prefix='hearthbot-replay-')
+    pool = multiprocessing.Pool(processes)
+    try:
+        sources = dict((unpack_log(log, tmpdir), log) for log in logs)
+        tasks = replay_tasks(sorted(sources))
+        summaries = pool.map(replay_game, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(tmpdir)
+    for s in summaries:
+        s['log'] = sources[s['log']]
+    summaries.sort(key=lambda s: (s['log'], s['game']))
+    return summaries, time.time() - start
+
+def format_report(summaries, seconds):
+    """Merge the game summaries into one human readable report.
+    """
+    lines = []
+    total_lines = 0
+    total_problems = {}
+    total_pending = {}
+    failed = 0
+    for s in summaries:
+        total_lines += s['lines']
+        for level, count in s['problems'].items():
+            total_problems[level] = total_problems.get(level, 0) + count
+        for counter, count in s['pending_tags'].items():
+            total_pending[counter] = total_pending.get(counter, 0) + count
+        rate = s['lines'] / s['seconds'] if s['seconds'] else 0
+        game = s['game'] if s['game'] is not None else '-'
+        lines.append("{} game {}: {} lines ({:.0f} lines/s) {}".format(
+            os.path.relpath(s['log']), game, s['lines'], rate,
+            ' '.join('{}={}'.format(k, v) for k, v in sorted(s['problems'].items()))))
+        for side in ('tingle', 'opponent'):
+            lines.append("    {:<8} {} minions: {}".format(side, s[side]['hero'], s[side]['minions']))
+        if s['exception']:
+            failed += 1
+            lines.append("    EXCEPTION at byte {}: {}".format(
+                s['failed_at'], s['exception'].strip().splitlines()[-1]))
+
+    lines.append("")
+    lines.append("{} games, {} lines in {:.2f}s ({:.0f} lines/s), {} failed, {}".format(
+        len(summaries), total_lines, seconds, total_lines / seconds if seconds else 0, failed,
+        ' '.join('{}={}'.format(k, v) for k, v in sorted(total_problems.items()))))
+    lines.append("Held back tag updates: {}".format(
+        ' '.join('{}={}'.format(k, v) for k, v in sorted(total_pending.items()))))
+    return '\n'.join(lines)
+
+def main():
+    argparser = argparse.ArgumentParser(description="Replay hearthstone logs through the parser")
+    argparser.add_argument('logs', nargs='*', help="Logs to replay (default: the whole corpus)")
+    argparser.add_argument('-j', '--processes', type=int, default=None,
+                           help="Worker processes (default: one per cpu)")
+    argparser.add_argument('--json', action='store_true', help="Print the summaries as json")
+    args = argparser.parse_args()
+
+    logs = args.logs or corpus_logs()
+    summaries, seconds = replay_corpus(logs, args.processes)
+    if args.json:
+        json.dump({'seconds': seconds, 'games': summaries}, sys.stdout, indent=2)
+    else:
+        print(format_report(summaries, seconds))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Cheap snapshots of a GameState for trying out plays.
+
+A Snapshot holds what matters for a turn: both heroes, hands and boards,
+and the mana. Taking one copies only those cards (a few dozen at most, never
+the whole all_cards history), so the parser can keep updating the live state
+while a planner works on the snapshot.
+
+Snapshots fork copy-on-write: a fork shares every card with the snapshot it
+came from and only copies a card the first time the fork changes it (through
+mutable()). Planners can fork thousands of hypothetical turns without
+copying boards that don't change.
+"""
+
+import logging
+
+from carddata import DIVINE_SHIELD
+from zones import PLAY, GRAVEYARD
+
+logger = logging.getLogger('SNAPSHOT')
+
+class Side(object):
+    """One player's part of a snapshot. Hands and boards are tuples of card ids,
+    replaced (not changed) when a fork changes them.
+    """
+    __slots__ = ('name', 'hero', 'hand', 'minions', 'mana', 'mana_spent')
+
+    def __init__(self, name, hero, hand, minions, mana, mana_spent):
+        self.name = name
+        self.hero = hero
+        self.hand = hand
+        self.minions = minions
+        self.mana = mana
+        self.mana_spent = mana_spent
+
+    def copy(self):
+        return Side(self.name, self.hero, self.hand, self.minions, self.mana, self.mana_spent)
+
+    def mana_available(self):
+        return self.mana - self.mana_spent
+
+class Snapshot(object):
+    def __init__(self, cards, tingle, opponent):
+        """Use take_snapshot() or fork() to make one.
+
+        Args:
+            - cards: card id -> Card of every card in the snapshot
+            - tingle, opponent: The Side of each player
+        """
+        self.cards = cards
+        self.tingle = tingle
+        self.opponent = opponent
+        # Ids of the cards this snapshot copied for itself
+        self.owned = set()
+
+    def __repr__(self):
+        return "Snapshot(TINGLE {} vs OPPONENT {})".format(list(self.tingle.minions),
+                                                          list(self.opponent.minions))
+
+    def fork(self):
+        """Returns a snapshot that shares everything with this one until either changes it.
+        """
+        fork = Snapshot(dict(self.cards), self.tingle.copy(), self.opponent.copy())
+        # The cards are shared now, so this one copies them again before changing them too
+        self.owned = set()
+        return fork
+
+    def card(self, card_id):
+        """Returns a card to look at. Don't change it, use mutable().
+        """
+        return self.cards[card_id]
+
+    def mutable(self, card_id):
+        """Returns a card this snapshot may change, copying it the first time.
+        """
+        if card_id not in self.owned:
+            self.cards[card_id] = self.cards[card_id].copy()
+            self.owned.add(card_id)
+        return self.cards[card_id]
+
+    def side(self, card_id):
+        """Returns the Side whose board or hand card_id is on, or None.
+        """
+        for side in (self.tingle, self.opponent):
+            if card_id in side.minions or card_id in side.hand or card_id == side.hero:
+                return side
+        return None
+
+    def hand(self, side):
+        return [self.cards[c] for c in side.hand]
+
+    def minions(self, side):
+        return [self.cards[c] for c in side.minions]
+
+    def play_minion(self, card_id, slot=None):
+        """A minion goes from Tingle's hand to the board, paid for.
+        It goes in before the minion at index slot (at the right end if None).
+        """
+        side = self.tingle
+        card = self.mutable(card_id)
+        if slot is None:
+            slot = len(side.minions)
+        side.hand = tuple(c for c in side.hand if c != card_id)
+        side.minions = side.minions[:slot] + (card_id,) + side.minions[slot:]
+        side.mana_spent += card.cost
+        card.zone = PLAY
+        card.pos = slot + 1
+
+    def attack(self, att_id, def_id):
+        """att_id attacks def_id: both take the other's attack, and the dead are removed.
+        """
+        attacker = self.mutable(att_id)
+        defender = self.mutable(def_id)
+        self.take_damage(defender, attacker.attack)
+        self.take_damage(attacker, defender.attack)
+        attacker.performs_attack()
+        for card in (attacker, defender):
+            if card.remaining_health() <= 0:
+                self.kill(card.id)
+
+    def take_damage(self, card, amount):
+        if amount <= 0:
+            return
+        if card.flags & DIVINE_SHIELD:
+            card.set_flag(DIVINE_SHIELD, False)
+            return
+        card.damage += amount
+
+    def kill(self, card_id):
+        """Take a minion off the board.
+        """
+        side = self.side(card_id)
+        if side is None or card_id not in side.minions:
+            return
+        side.minions = tuple(c for c in side.minions if c != card_id)
+        self.mutable(card_id).zone = GRAVEYARD
+
+def take_side(player, cards):
+    """Copy the cards of a player into cards and return its Side.
+    """
+    hand = []
+    for card in player.hand:
+        cards[card.id] = card.copy()
+        hand.append(card.id)
+    minions = []
+    for card in player.minions:
+        cards[card.id] = card.copy()
+        minions.append(card.id)
+    hero = None
+    if player.hero:
+        cards[player.hero.id] = player.hero.copy()
+        hero = player.hero.id
+    return Side(player.name, hero, tuple(hand), tuple(minions), player.mana, player.mana_spent)
+
+def take_snapshot(gstate):
+    """Returns a Snapshot of gstate's heroes, hands, boards and mana.
+    Later changes to gstate don't show in it, and changes to it don't touch gstate.
+    """
+    cards = {}
+    tingle = take_side(gstate.tingle, cards)
+    opponent = take_side(gstate.opponent, cards)
+    return Snapshot(cards, tingle, opponent)
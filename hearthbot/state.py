@@ -7,23 +7,108 @@ If a card has no position, it is not considered to be in play and usable
 (hero, hero power)
 """
 
-import logging
-import pprint
+import collections
 
 import kooloolimpah
+from tagstore import TagStore, typed_value
+from deck import DeckTracker
+from zones import ZoneIndex, HAND, PLAY, DECK, GRAVEYARD, SETASIDE, DEAD_ZONES
 from carddata import card_from_id
-from carddata import HeroPower, Weapon, Hero, Minion
+from carddata import HeroPower, Weapon, Hero, Minion, TAG_MECHANICS
+from snapshot import take_snapshot
+from boardarray import Board
+import changes
+import hotlog
+from hotlog import pretty
+
+logger = hotlog.getLogger('STATE')
+
+# Tag updates held back for one entity that hasn't been revealed yet
+PENDING_PER_ENTITY = 32
+# How many tag updates later a held back update is considered stale
+PENDING_MAX_AGE = 2000
+
+class PendingTags(object):
+    def __init__(self, per_entity=PENDING_PER_ENTITY, max_age=PENDING_MAX_AGE):
+        """Holds tag updates for entities we don't know yet, until they are revealed.
+
+        Age is counted in tag updates seen (the log's own clock), not seconds,
+        so replaying a log behaves the same as playing it live.
+
+        Args:
+            - per_entity: The most updates kept for one entity, older ones are evicted first
+            - max_age: Updates older than this many tag updates are evicted
+        """
+        self.per_entity = per_entity
+        self.max_age = max_age
+        # card_id -> deque of (clock, tag, value)
+        self.pending = {}
+        self.clock = 0
+        self.last_sweep = 0
+        # Updates for an entity we didn't have (and held back)
+        self.misses = 0
+        # Held back updates applied once their entity showed up
+        self.hits = 0
+        # Held back updates thrown away for being too many or too old
+        self.evictions = 0
+
+    def __len__(self):
+        return sum(len(updates) for updates in self.pending.values())
+
+    def tick(self):
+        """Count a tag update, and evict stale ones every so often.
+        """
+        self.clock += 1
+        if self.clock - self.last_sweep >= self.max_age // 4:
+            self.evict_stale()
 
-logger = logging.getLogger('STATE')
+    def hold(self, card_id, tag, value):
+        """Keep a tag update for card_id until the card is revealed.
+        """
+        self.misses += 1
+        updates = self.pending.get(card_id)
+        if updates is None:
+            updates = self.pending[card_id] = collections.deque()
+        elif len(updates) >= self.per_entity:
+            updates.popleft()
+            self.evictions += 1
+        updates.append((self.clock, tag, value))
+
+    def evict_stale(self):
+        self.last_sweep = self.clock
+        oldest = self.clock - self.max_age
+        for card_id in self.pending.keys():
+            updates = self.pending[card_id]
+            while updates and updates[0][0] < oldest:
+                updates.popleft()
+                self.evictions += 1
+            if not updates:
+                del self.pending[card_id]
+
+    def release(self, card_id):
+        """Returns the fresh [(tag, value)] held for card_id, oldest first, and forgets them.
+        """
+        updates = self.pending.pop(card_id, None)
+        if not updates:
+            return []
+        oldest = self.clock - self.max_age
+        fresh = [(tag, value) for when, tag, value in updates if when >= oldest]
+        self.evictions += len(updates) - len(fresh)
+        self.hits += len(fresh)
+        return fresh
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'pending': len(self)}
 
 class Player(object):
-    def __init__(self, name):
+    def __init__(self, name, zones):
+        """A player, whose cards are kept in zones (a zones.ZoneIndex) under name.
+        """
         self.name = name
+        self.zones = zones
         # whether a player goes first or second
         self.num = None
-        self.hand = []
-        # players minions on the field
-        self.minions = []
         self.weapon = None
         self.hero = None
         # The amount of mana a player has available this turn
@@ -32,12 +117,24 @@ class Player(object):
         self.mana_spent = 0
         self.max_mana = 10
 
+    @property
+    def hand(self):
+        """A new list of the cards in the player's hand.
+        """
+        return self.zones.cards(self.name, HAND)
+
+    @property
+    def minions(self):
+        """A new list of the player's minions on the field, in board order.
+        """
+        return self.zones.cards(self.name, PLAY)
+
     def mana_available(self):
-        return int(self.mana) - int(self.mana_spent)
+        return self.mana - self.mana_spent
 
     def spend_mana(self, amount):
         self.mana_spent += amount
-        logger.info("Spending {} mana. Total spent = {}".format(amount, self.mana_spent))
+        logger.info("Spending {} mana. Total spent = {}", amount, self.mana_spent)
 
     def prepare_for_new_turn(self):
         """Prepares a player for their turn.
@@ -65,17 +162,34 @@ class Player(object):
         return None
 
 class GameState(object):
-    def __init__(self):
-        "Tracks the game state."
+    def __init__(self, deck=None, debug_zones=None):
+        """Tracks the game state.
+
+        Args:
+            - deck: The deck.Deck Tingle is playing, if we know it
+            - debug_zones: Check every zone after every move (see zones.ZoneIndex)
+        """
+        self.deck = deck
+        self.deck_tracker = DeckTracker(deck) if deck else None
+        # Where changes are published, for this game and the next (see changes.py)
+        self.changes = changes.ChangeFeed()
+        # Where every card is
+        self.zones = ZoneIndex(debug_zones)
         # Players
-        self.tingle = Player("TINGLE")
-        self.opponent = Player("OPPONENT")
+        self.tingle = Player("TINGLE", self.zones)
+        self.opponent = Player("OPPONENT", self.zones)
+        # Each player's side of the board as arrays (see board())
+        self.boards = {self.tingle.name: Board(), self.opponent.name: Board()}
 
         # Tracking all cards
         # id to card object mapping
         self.all_cards = {}     # All cards seen (a history)
         self.cards_in_play = {} # Cards currently active (in play or hand)
         self.graveyard = {}     # Cards in the graveyard
+        # Every tag of every entity, by id
+        self.tags = TagStore()
+        # Tag updates for cards that haven't been revealed yet
+        self.pending_tags = PendingTags()
 
         # Game state
         self.turn = "OURS"      # or "THEIRS"
@@ -91,15 +205,23 @@ class GameState(object):
     def init(self):
         """Initialize all aspects of the game.
         """
+        # Where every card is
+        self.zones = ZoneIndex(self.zones.debug)
         # Players
-        self.tingle = Player("TINGLE")
-        self.opponent = Player("OPPONENT")
+        self.tingle = Player("TINGLE", self.zones)
+        self.opponent = Player("OPPONENT", self.zones)
+        # Each player's side of the board as arrays (see board())
+        self.boards = {self.tingle.name: Board(), self.opponent.name: Board()}
 
         # Tracking all cards
         # id to card object mapping
         self.all_cards = {}     # All cards seen (a history)
         self.cards_in_play = {} # Cards currently active (in play or hand)
         self.graveyard = {}     # Cards in the graveyard
+        # Every tag of every entity, by id
+        self.tags = TagStore()
+        # Tag updates for cards that haven't been revealed yet
+        self.pending_tags = PendingTags()
 
         # Game state
         self.turn = "OURS"      # or "THEIRS"
@@ -107,11 +229,25 @@ class GameState(object):
         self.game_ended = False
         self.num = None
         self.opp_num = None
-        self.drew_card_this_turn = False        
+        self.drew_card_this_turn = False
+        # What's left of our deck this game
+        self.deck_tracker = DeckTracker(self.deck) if self.deck else None
         
+    def set_deck(self, deck):
+        """Tell the state which deck.Deck Tingle is playing, for this game and the next.
+        """
+        self.deck = deck
+        self.deck_tracker = DeckTracker(deck)
+
+    def apply_event(self, event):
+        """Update the state with an event from the parser (see events.py).
+        """
+        event.apply(self)
+
     def start_game(self):
         self.init()
         self.game_started = True
+        self.changes.publish(changes.GAME_STARTED)
         logger.info("*"*26)
         logger.info("*"*5+" STARTING GAME "+"*"*5)
         logger.info("*"*26)
@@ -121,44 +257,44 @@ class GameState(object):
         self.tingle.prepare_for_new_turn()
         self.drew_card_this_turn = False
         logger.info("*"*10)
-        logger.info("TINGLE's TURN - {} mana".format(self.tingle.mana_available()))
+        logger.info("TINGLE's TURN - {} mana", self.tingle.mana_available())
         logger.info("*"*10)
+        self.changes.publish(changes.TURN_STARTED, self.tingle.name)
 
     def set_opponent_turn(self):
         self.turn = "THEIRS"
         logger.info("*"*10)
         logger.info("OPPONENT TURN")
         logger.info("*"*10)
+        self.changes.publish(changes.TURN_STARTED, self.opponent.name)
 
     def set_player_number(self, number):
         self.tingle.num = number
-        self.opponent.num = "1" if self.num == "2" else "2"
-        logger.info("TINGLE is player {}".format(self.tingle.num))
-        logger.info("OPPONENT is player {}".format(self.opponent.num))
+        self.opponent.num = "1" if number == "2" else "2"
+        self.num = self.tingle.num
+        self.opp_num = self.opponent.num
+        logger.info("TINGLE is player {}", self.tingle.num)
+        logger.info("OPPONENT is player {}", self.opponent.num)
         self.game_started = True
 
-    def send_to_graveyard(self, card_id):
-        """Send a card to the graveyard. If it's already there,
-        just ignore this update.
+    def send_to_graveyard(self, card_id, zone=GRAVEYARD):
+        """Send a card to the graveyard (or SETASIDE, which is as good as). If it's
+        already there, just ignore this update.
         """
         card = self.card_with_id(card_id)
         if card:
-            if card.zone == "GRAVEYARD":
+            if card.zone in DEAD_ZONES:
                 return
+            where = self.zones.where(card)
             self.graveyard[card_id] = card
             self.cards_in_play.pop(card_id)
-            if card in self.tingle.minions:
-                self.tingle.minions.remove(card)
-            if card in self.opponent.minions:
-                self.opponent.minions.remove(card)
-            card.zone = "GRAVEYARD"
-            logger.info("{} has been moved to graveyard".format(card))
+            self.zones.move(card, None, zone)
+            logger.info("{} has been moved to {}", card, zone.lower())
+            assert card_id not in self.cards_in_play
+            if where and where[1] == PLAY:
+                self.changes.publish(changes.MINION_DIED, where[0], card, zone)
         else:
-            logger.error("Can't find {} to send to graveyard".format(card))
-
-        assert card not in self.opponent.minions
-        assert card not in self.tingle.minions
-        assert card not in self.cards_in_play.values()
+            logger.error("Can't find {} to send to graveyard", card)
             
     def add_card_to_game(self, card):
         """Add a card to this game's state. Keep track of the card by id.
@@ -167,16 +303,25 @@ class GameState(object):
             self.all_cards[card.id] = card
             if card.zone == "PLAY" or card.zone == "HAND":
                 self.cards_in_play[card.id] = card
-                logger.info("Adding {} to active cards in zone {}".format(card, card.zone))
+                logger.info("Adding {} to active cards in zone {}", card, card.zone)
             #logger.debug("Cards in play:\n"+pprint.pformat(self.cards_in_play))
+            self.sync_flags(card)
+            self.apply_pending_tags(card)
             return True
         elif self.graveyard.has_key(card.id):
-            logger.warn("Trying to add card to play but its already in the graveyard, so skipping: {}".format(card))
+            logger.warn("Trying to add card to play but its already in the graveyard, so skipping: {}", card)
             return False
         else:
-            logger.error("Adding card to play but it already exists and is not in graveyard: {}".format(card))
+            logger.error("Adding card to play but it already exists and is not in graveyard: {}", card)
             return False
 
+    def apply_pending_tags(self, card):
+        """Apply the tag updates that came in before card was revealed.
+        """
+        for tag, value in self.pending_tags.release(card.id):
+            logger.info("Applying held back tag update to {}: {} = {}", card, tag, value)
+            self.set_card_tag(card, tag, value)
+
     def remove_card_from_game(self, card):
         self.all_cards.pop(card.id)
         self.cards_in_play.pop(card.id)
@@ -187,24 +332,28 @@ class GameState(object):
         """
         card = card_from_id(cardId, card_id)
         if card:
-            logger.info("DRAW CARD: {}".format(card))
-            card.zone = "HAND"
-            self.add_card_to_game(card)
-            self.tingle.hand.append(card)
+            logger.info("DRAW CARD: {}", card)
+            card.zone = HAND
+            if not self.add_card_to_game(card) and card.id not in self.graveyard:
+                # A card we already have coming back to hand (e.g. Sap), keep using it
+                card = self.card_with_id(card.id)
+            self.zones.move(card, self.tingle.name, HAND)
             self.drew_card_this_turn = True
+            if self.deck_tracker:
+                self.deck_tracker.draw(cardId)
+            self.changes.publish(changes.CARD_DRAWN, self.tingle.name, card)
         else:
-            logger.error("Trying to add card {} (card_id={}) to HAND but no card with that name found".\
-                          format(cardId, card_id))
-        logger.info("Cards in HAND:\n"+ pprint.pformat(self.tingle.hand))
+            logger.error("Trying to add card {} (card_id={}) to HAND but no card with that name found",
+                          cardId, card_id)
+        logger.info("Cards in HAND:\n{}", pretty(self.tingle.hand))
         
     def play_minion(self, cardId, card_id):
         # If the minion was already in our hand, use that one
         card = self.card_with_id(card_id)
         if card:
-            card.zone = "PLAY"
-            self.tingle.minions.append(card)
-            logger.info("TINGLE plays minion from hand: {}".format(card))
-            self.tingle.spend_mana(int(card.cost))
+            self.zones.move(card, self.tingle.name, PLAY)
+            logger.info("TINGLE plays minion from hand: {}", card)
+            self.tingle.spend_mana(card.cost)
             return
 
         # this is a minion that was not in our hand (or in play)
@@ -214,25 +363,25 @@ class GameState(object):
                 minion.zone = "PLAY"
                 # if its a hero or hero power, add it to game but not our play area
                 if isinstance(minion, HeroPower) or isinstance(minion, Weapon):
-                    logger.info("Moving Hero Power/Weapon to play but not as a minion: {}".\
-                                 format(minion))
+                    logger.info("Moving Hero Power/Weapon to play but not as a minion: {}",
+                                 minion)
                     self.add_card_to_game(minion)
                     return
                 
                 if isinstance(minion, Hero):
-                    logger.info("Adding our hero to play: {}".format(minion))
+                    logger.info("Adding our hero to play: {}", minion)
                     self.add_card_to_game(minion)
                     self.tingle.hero = minion
                     return
                 
                 logger.info("Playing a minion that was not in our hand!")
                 if self.add_card_to_game(minion):
-                    self.tingle.minions.append(minion)
-                    logger.info("TINGLE plays: {}".format(minion))
-                    logger.info("TINGLE's minions:\n"+pprint.pformat(self.tingle.minions))
+                    self.zones.move(minion, self.tingle.name, PLAY)
+                    logger.info("TINGLE plays: {}", minion)
+                    logger.info("TINGLE's minions:\n{}", pretty(self.tingle.minions))
             else:
-                logger.error("Trying to add minion {} (card_id={}) to PLAY but no minion found with that name".\
-                             format(cardId, card_id))
+                logger.error("Trying to add minion {} (card_id={}) to PLAY but no minion found with that name",
+                             cardId, card_id)
 
     def opp_play_minion(self, cardId, card_id, pos):
         """The opponent plays a minion with a specific position.
@@ -240,27 +389,27 @@ class GameState(object):
         minion = card_from_id(cardId, card_id)
         if minion:
             minion.zone = "PLAY"
-            minion.pos = pos
+            minion.pos = int(pos)
             # if its a hero power or weapon, add it to game but not our play area
             if isinstance(minion, HeroPower) or isinstance(minion, Weapon):
-                logger.info("Moving Hero Power/Weapon to play but not as minion: {}".\
-                             format(minion))
+                logger.info("Moving Hero Power/Weapon to play but not as minion: {}",
+                             minion)
                 self.add_card_to_game(minion)
                 return
             
             if isinstance(minion, Hero):
-                logger.info("Adding opponent hero to play: {}".format(minion))
+                logger.info("Adding opponent hero to play: {}", minion)
                 self.add_card_to_game(minion)
                 self.opponent.hero = minion
                 return
 
             if self.add_card_to_game(minion):
-                self.opponent.minions.append(minion)
-                logger.info("OPPONENT plays: {}".format(minion))
-                logger.info("OPPONENT's minions:\n"+pprint.pformat(self.opponent.minions))
+                self.zones.move(minion, self.opponent.name, PLAY)
+                logger.info("OPPONENT plays: {}", minion)
+                logger.info("OPPONENT's minions:\n{}", pretty(self.opponent.minions))
         else:
-            logger.error("Trying to add opponent minion {} (card_id={}) to PLAY but no minion found with that name.".\
-                         format(cardId, card_id))
+            logger.error("Trying to add opponent minion {} (card_id={}) to PLAY but no minion found with that name.",
+                         cardId, card_id)
 
     def hero_power(self, player, card_id, target_id=None):
         """
@@ -270,41 +419,44 @@ class GameState(object):
         hpower = self.card_with_id(card_id)
         if hpower:
             if player == self.tingle.num:
-                logger.info("TINGLE plays hero power {} -> {}".\
-                             format(hpower, target_id))
+                logger.info("TINGLE plays hero power {} -> {}",
+                             hpower, target_id)
             else:
-                logger.info("OPPONENT plays hero power {} -> {}".\
-                             format(hpower, target_id))
+                logger.info("OPPONENT plays hero power {} -> {}",
+                             hpower, target_id)
         else:
-            logger.error("Trying to play a hero power that we don't know exists {}".\
-                          format(card_id))
+            logger.error("Trying to play a hero power that we don't know exists {}",
+                          card_id)
             
     def opp_play_spell(self, cardId, card_id):
         spell = card_from_id(cardId, card_id)
         if spell:
             spell.zone = "PLAY"
-            logger.info("OPPONENT plays: {}".format(spell))
+            logger.info("OPPONENT plays: {}", spell)
             self.add_card_to_game(spell)
         else:
-            logger.error("Trying to add opponent spell {} (card_id={}) to PLAY but no spell found with that name.".\
-                         format(cardId, card_id))
+            logger.error("Trying to add opponent spell {} (card_id={}) to PLAY but no spell found with that name.",
+                         cardId, card_id)
 
     def update_zone(self, card_id, player, zone):
         card = self.card_with_id(card_id)
-        if card and card.zone != "GRAVEYARD":
-            logger.info("Update {} to zone {}".format(card, zone))
-            if zone == "GRAVEYARD":
+        if card and card.zone not in DEAD_ZONES:
+            logger.info("Update {} to zone {}", card, zone)
+            if zone == GRAVEYARD:
                 self.send_to_graveyard(card_id)
-            if zone == "DECK":
-                if card in self.tingle.hand:
-                    self.tingle.hand.remove(card)
+            if zone == DECK:
+                if self.zones.contains(card, self.tingle.name, HAND):
+                    if self.deck_tracker:
+                        self.deck_tracker.put_back(card.template.cardId)
+                self.zones.move(card, None, DECK)
                 self.remove_card_from_game(card)
-            if zone == "PLAY":
-                if card in self.tingle.hand:
-                    self.tingle.hand.remove(card)
-                    card.zone = "PLAY"
-            if zone == "SETASIDE":
-                self.send_to_graveyard(card_id)
+            if zone == PLAY:
+                if self.zones.contains(card, self.tingle.name, HAND):
+                    # Minions join the field when the play itself comes through
+                    self.zones.remove(card)
+                    card.zone = PLAY
+            if zone == SETASIDE:
+                self.send_to_graveyard(card_id, SETASIDE)
             # if zone == "PLAY":
             #     if player == "1":
             #         logger.info("TINGLE puts minion into play: {}".format(card))
@@ -321,78 +473,125 @@ class GameState(object):
             #logger.debug("No card id {} to give target to".format(id))
             pass
         elif not target:
-            logger.error("No target id {} for card {}".format(target_id, card))
+            logger.error("No target id {} for card {}", target_id, card)
         else:
-            logger.info("{} has a target: {}".format(card, target))
+            logger.info("{} has a target: {}", card, target)
             
     def perform_attack(self, att_id, def_id):
         """Character with att_id attacks character with def_id.
         """
         att_card = self.card_with_id(att_id)
         def_card = self.card_with_id(def_id)
-        logger.info("ATTACK: {} -> {}".format(att_card, def_card))        
+        logger.info("ATTACK: {} -> {}", att_card, def_card)        
         att_card.performs_attack()
 
     def update_card_tag(self, card_id, tag, value):
         """Update a specific property of a card.
-        TODO: If a card doesn't exist yet in our game, we create a stub to store the tag change until
-        the card is revealed.
+        If the card doesn't exist yet in our game, the update is held back
+        and applied when the card is revealed (see PendingTags).
+        Numeric values are turned into ints here, once.
         """
+        value = typed_value(tag, value)
+        self.pending_tags.tick()
         card = self.card_with_id(card_id)
         if not card:
-            logger.warn("No id {} found to perform tag update for {} = {}".format(card_id, tag, value))
-            # Push this update off until later (we might have more information by then)
-            #self.add_tag_update_to_queue(card_id, tag, value)
+            logger.debug("No id {} found yet, holding tag update {} = {}", card_id, tag, value)
+            self.pending_tags.hold(card_id, tag, value)
             return
-        if card.zone == "GRAVEYARD":
+        self.set_card_tag(card, tag, value)
+
+    def set_card_tag(self, card, tag, value):
+        """Apply a tag update to a card we know.
+        """
+        if card.zone in DEAD_ZONES:
             # we don't care
             return
         else:
             if tag == "ATK":
                 card.attack = value
-                logger.info("{} has {} ATTACK".format(card, card.attack))                
+                logger.info("{} has {} ATTACK", card, card.attack)                
             elif tag == "DAMAGE":
                 card.damage = value
-                logger.info("{} has {} DAMAGE".format(card, card.damage))
-                if int(card.damage) >= int(card.health):
-                    logger.info("{} has fatal damage".format(card))
+                logger.info("{} has {} DAMAGE", card, card.damage)
+                if card.damage >= card.health:
+                    logger.info("{} has fatal damage", card)
             elif tag == "HEALTH":
                 card.health = value
-                logger.info("{} has {} HEALTH".format(card, card.health))
+                logger.info("{} has {} HEALTH", card, card.health)
             elif tag == "ARMOR":
                 card.armor = value
-                logger.info("{} has {} ARMOR".format(card, card.armor))
+                logger.info("{} has {} ARMOR", card, card.armor)
             elif tag == "COST":
                 card.cost = value
-                logger.info("{} has {} cost".format(card, card.cost))
+                logger.info("{} has {} cost", card, card.cost)
             elif tag == "CONTROLLER":
-                self.set_card_controller(card_id, value)
+                self.set_card_controller(card.id, value)
             else:
                 pass
                 #logger.debug("Unused tag {}".format(tag))
 
+    def record_tag(self, card_id, tag, value):
+        """Remember any tag change of an entity, whether or not we know the card yet.
+        Mechanic tags (TAUNT, FROZEN...) also update the card's flags.
+        """
+        self.tags.set(int(card_id), tag, value)
+        bit = TAG_MECHANICS.get(tag)
+        if bit:
+            card = self.card_with_id(card_id)
+            if card:
+                card.set_flag(bit, value != '0')
+
+    def sync_flags(self, card):
+        """Set the mechanic flags of a card we just learned about from the tags
+        the log gave its entity before that.
+        """
+        entity = int(card.id)
+        for tag, bit in TAG_MECHANICS.items():
+            value = self.tags.get(entity, tag)
+            if value is not None:
+                card.set_flag(bit, value)
+
+    def card_tag(self, card_id, tag, default=None):
+        """Returns the last value the log gave for a tag of the entity with card_id.
+        """
+        return self.tags.get(int(card_id), tag, default)
+
     def set_card_controller(self, card_id, controller):
         """Set card's controller
         """
         card = self.card_with_id(card_id)
         if card:
-            if controller == self.num:
-                logger.info("{} is now under TINGLE's control".format(card))
-                self.opponent.minions.remove(card)
-                self.tingle.minions.append(card)
-            elif controller == self.opp_num:
-                logger.info("{} is now under OPPONENT's control".format(card))
-                self.tingle.minions.remove(card)
-                self.opponent.minions.append(card)
+            if str(controller) == self.tingle.num:
+                player = self.tingle
+            elif str(controller) == self.opponent.num:
+                player = self.opponent
             else:
                 logger.error("Can't have no controller")
+                return
+            where = self.zones.where(card)
+            if where and where[0] != player.name:
+                logger.info("{} is now under {}'s control", card, player.name)
+                self.zones.move(card, player.name, where[1])
                 
         else:
-            logger.error("Can't find card id {} to change controller".format(card_id))
+            logger.error("Can't find card id {} to change controller", card_id)
             
     def card_with_id(self, card_id):
         return self.all_cards.get(card_id)
 
+    def board(self, player):
+        """Returns the boardarray.Board of player, brought up to date.
+        """
+        board = self.boards[player.name]
+        board.sync(player)
+        return board
+
+    def snapshot(self):
+        """Returns a copy-on-write Snapshot of the heroes, hands, boards and mana
+        to try out plays on (see snapshot.py).
+        """
+        return take_snapshot(self)
+
     def update_card_pos(self, card_id, pos):
         """Update a card's position.
         Card with id gets position pos.
@@ -401,21 +600,28 @@ class GameState(object):
         if not card:
             logger.warn("Trying to update ID of a card we haven't seen before.")
             return
-        if card.zone == "GRAVEYARD":
+        if card.zone in DEAD_ZONES:
             # we don't care
             return
+        pos = int(pos)
+        if pos == card.pos:
+            return
         card.pos = pos
-        logger.debug("Update card {} to position {} in {}".\
-                     format(card, card.pos, card.zone))
+        logger.debug("Update card {} to position {} in {}",
+                     card, card.pos, card.zone)
+        where = self.zones.where(card)
+        self.changes.publish(changes.POSITION_CHANGED, where[0] if where else None, card, pos)
 
     def set_won(self):
         logger.info("TINGLE wins!")
         self.game_started = False
         self.game_ended = True
+        self.changes.publish(changes.GAME_OVER, value="WON")
         kooloolimpah.magic()
 
     def set_lost(self):
         logger.info("TINGLE lost!")
         self.game_started = False
         self.game_ended = True
+        self.changes.publish(changes.GAME_OVER, value="LOST")
         kooloolimpah.grouch()
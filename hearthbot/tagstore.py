@@ -0,0 +1,205 @@
+"""
+A compact store of every tag value of every entity in a game.
+
+The power log reports everything about an entity as TAG_CHANGEs: ATK, DAMAGE,
+FROZEN, DIVINE_SHIELD, EXHAUSTED, NUM_ATTACKS_THIS_TURN, ZONE... The GameState
+only turns a few of them into card attributes, the rest end up here.
+
+Tags are given integer codes (known tags have fixed codes, new ones are added
+as they're seen). Each tag is a column: an array of ints indexed by entity id,
+so a whole game fits in a few KB. Word values (ZONE=PLAY) are stored as the
+code of the word, offset by WORD_BASE so they can't be taken for a number:
+each value keeps its own type, even when a tag has both.
+
+Optionally the store also keeps the history of changes, which can be asked for
+by entity or by tag. The history is capped: when it fills up, the oldest half
+is thrown away.
+"""
+
+import array
+import logging
+
+logger = logging.getLogger('TAGS')
+
+# Tags with fixed codes (in this order). Others are given codes after these.
+KNOWN_TAGS = ['ZONE', 'ZONE_POSITION', 'CONTROLLER', 'CARDTYPE',
+              'ATK', 'HEALTH', 'DAMAGE', 'PREDAMAGE', 'ARMOR', 'COST', 'DURABILITY',
+              'EXHAUSTED', 'NUM_ATTACKS_THIS_TURN', 'NUM_TURNS_IN_PLAY', 'JUST_PLAYED',
+              'ATTACKING', 'DEFENDING', 'CARD_TARGET', 'ATTACHED', 'LAST_AFFECTED_BY',
+              'TAUNT', 'DIVINE_SHIELD', 'CHARGE', 'STEALTH', 'WINDFURY', 'FROZEN',
+              'SILENCED', 'ENRAGED', 'IMMUNE', 'CANT_ATTACK', 'TO_BE_DESTROYED',
+              'SECRET']
+
+# Tags whose values are words (ZONE=PLAY). The rest of KNOWN_TAGS are numbers.
+WORD_TAGS = frozenset(['ZONE', 'CARDTYPE', 'PLAYSTATE', 'STEP', 'NEXT_STEP',
+                       'MULLIGAN_STATE', 'CLASS', 'RARITY', 'FACTION'])
+
+def typed_value(tag, value):
+    """Returns a tag value from the log as the type it has: the string itself
+    for word tags, otherwise an int. Unknown tags are ints if they look like one.
+    """
+    if tag in WORD_TAGS or isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+# The value of a tag an entity has never had
+UNSET = -2**31
+# Words are stored as WORD_BASE + their code, below any number a tag is given
+WORD_BASE = UNSET + 1
+NUMBER_MIN = -2**30
+
+# History entries kept by default
+HISTORY_SIZE = 50000
+
+class TagStore(object):
+    def __init__(self, history=True, history_size=HISTORY_SIZE):
+        """Holds the tags of all entities.
+
+        Args:
+            - history: Whether to remember every change, not just the latest values
+            - history_size: The most changes to remember
+        """
+        self.tag_codes = {}
+        self.tag_names = []
+        for tag in KNOWN_TAGS:
+            self.tag_code(tag)
+        # Tags whose values are always words, and the codes of the words
+        self.word_tags = frozenset(self.tag_code(tag) for tag in WORD_TAGS)
+        self.word_codes = {}
+        self.words = []
+        # Tag code -> array of values indexed by entity id
+        self.columns = []
+
+        self.history = history
+        self.history_size = history_size
+        # Parallel arrays of (entity, tag code, value) changes
+        self.hist_entity = array.array('i')
+        self.hist_tag = array.array('i')
+        self.hist_value = array.array('i')
+
+    def __repr__(self):
+        return "TagStore({} tags, {} changes in history)".format(len(self.tag_names),
+                                                                 len(self.hist_entity))
+
+    def tag_code(self, tag):
+        """Returns the integer code of a tag name, giving it one if it's new.
+        """
+        code = self.tag_codes.get(tag)
+        if code is None:
+            code = len(self.tag_names)
+            self.tag_codes[tag] = code
+            self.tag_names.append(tag)
+        return code
+
+    def encode(self, code, value, add=True):
+        """Turn a tag value from the log into the int we store: a number as itself
+        (typed_value's rules), a word as WORD_BASE + its code.
+        Returns None for a word that hasn't been seen if not add.
+        """
+        if isinstance(value, (int, long)):
+            if value < NUMBER_MIN:
+                raise ValueError("Tag value {} is too small to store".format(value))
+            return value
+        if code not in self.word_tags:
+            try:
+                number = int(value)
+            except ValueError:
+                pass
+            else:
+                return self.encode(code, number)
+        word = self.word_codes.get(value)
+        if word is None:
+            if not add:
+                return None
+            word = len(self.words)
+            self.word_codes[value] = word
+            self.words.append(value)
+        return WORD_BASE + word
+
+    def decode(self, code, stored):
+        if stored == UNSET:
+            return None
+        if stored < NUMBER_MIN:
+            return self.words[stored - WORD_BASE]
+        return stored
+
+    def column(self, code):
+        while len(self.columns) <= code:
+            self.columns.append(array.array('i'))
+        return self.columns[code]
+
+    def set(self, entity, tag, value):
+        """Record that an entity (int id) has value for tag.
+        """
+        code = self.tag_code(tag)
+        stored = self.encode(code, value)
+        column = self.column(code)
+        if entity >= len(column):
+            column.extend([UNSET] * (entity + 1 - len(column)))
+        column[entity] = stored
+
+        if self.history:
+            if len(self.hist_entity) >= self.history_size:
+                self.trim_history()
+            self.hist_entity.append(entity)
+            self.hist_tag.append(code)
+            self.hist_value.append(stored)
+
+    def trim_history(self):
+        """Throw away the oldest half of the history.
+        """
+        keep = self.history_size // 2
+        self.hist_entity = self.hist_entity[-keep:]
+        self.hist_tag = self.hist_tag[-keep:]
+        self.hist_value = self.hist_value[-keep:]
+
+    def get(self, entity, tag, default=None):
+        """Returns the current value of tag for an entity (int id).
+        Numbers come back as ints, words as strings.
+        """
+        code = self.tag_codes.get(tag)
+        if code is None or code >= len(self.columns):
+            return default
+        column = self.columns[code]
+        if entity >= len(column) or column[entity] == UNSET:
+            return default
+        return self.decode(code, column[entity])
+
+    def entity_tags(self, entity):
+        """Returns a dict of all the tags an entity (int id) has.
+        """
+        tags = {}
+        for code, column in enumerate(self.columns):
+            if entity < len(column) and column[entity] != UNSET:
+                tags[self.tag_names[code]] = self.decode(code, column[entity])
+        return tags
+
+    def entities_with(self, tag, value=None):
+        """Returns the ids of the entities that have tag (set to value, if given).
+        """
+        code = self.tag_codes.get(tag)
+        if code is None or code >= len(self.columns):
+            return []
+        column = self.columns[code]
+        if value is None:
+            return [e for e, v in enumerate(column) if v != UNSET]
+        stored = self.encode(code, value, add=False)
+        if stored is None:
+            return []
+        return [e for e, v in enumerate(column) if v == stored]
+
+    def entity_history(self, entity):
+        """Returns the remembered changes to an entity as [(tag, value)], oldest first.
+        """
+        return [(self.tag_names[t], self.decode(t, v)) for e, t, v in
+                zip(self.hist_entity, self.hist_tag, self.hist_value) if e == entity]
+
+    def tag_history(self, tag):
+        """Returns the remembered changes to a tag as [(entity, value)], oldest first.
+        """
+        code = self.tag_codes.get(tag)
+        return [(e, self.decode(t, v)) for e, t, v in
+                zip(self.hist_entity, self.hist_tag, self.hist_value) if t == code]
@@ -0,0 +1,246 @@
+"""
+Follows the hearthstone log as it is written and feeds new lines to the parser.
+
+Instead of sleeping and re-reading the log every few seconds, the tailer blocks
+until the log actually changes. On Linux it is woken by inotify, everywhere
+else (OS X, where Hearthstone writes ~/Library/Logs/Unity/Player.log) it falls
+back to polling the file's size with os.stat.
+
+Hearthstone truncates or recreates its log when it starts up. When that
+happens the tailer rewinds the parser to the start of the new log and resets
+the game state.
+"""
+
+import os, sys
+import time
+import select
+import logging
+
+logger = logging.getLogger('TAILER')
+
+# inotify event masks (see <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+class StatWatcher(object):
+    def __init__(self, filepath, interval=0.05):
+        """Notices changes to a file by polling os.stat.
+
+        Args:
+            - filepath: The file to watch
+            - interval: Seconds between stat calls
+        """
+        self.filepath = filepath
+        self.interval = interval
+        self.last = self.fingerprint()
+
+    def fingerprint(self):
+        try:
+            st = os.stat(self.filepath)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+    def wait(self, timeout=None):
+        """Block until the file changes or timeout seconds pass.
+        Returns True if the file changed.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            current = self.fingerprint()
+            if current != self.last:
+                self.last = current
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+class InotifyWatcher(object):
+    def __init__(self, filepath):
+        """Notices changes to a file with inotify. Raises OSError if inotify
+        is not available on this platform.
+
+        The directory is watched rather than the file, so we also hear about the
+        log being deleted and recreated.
+        """
+        import ctypes, ctypes.util
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or not libc_name:
+            raise OSError("inotify is not available on {}".format(sys.platform))
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not available in {}".format(libc_name))
+
+        self.filepath = filepath
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        dirpath = os.path.dirname(os.path.abspath(filepath))
+        wd = self.libc.inotify_add_watch(self.fd, dirpath, WATCH_MASK)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed on {}".format(dirpath))
+
+    def wait(self, timeout=None):
+        """Block until something in the log's directory changes or timeout seconds pass.
+        Returns True if something changed.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        # Drain the queued events, we only care that something happened
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except OSError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+def make_watcher(filepath):
+    """Returns the best watcher available for this platform.
+    """
+    try:
+        return InotifyWatcher(filepath)
+    except (OSError, AttributeError) as e:
+        logger.info("Falling back to polling the log: {}".format(e))
+        return StatWatcher(filepath)
+
+class LogTailer(object):
+    def __init__(self, parser, watcher=None):
+        """Feed a parser the lines of its log as soon as they are written.
+
+        Args:
+            - parser: A cardlogger.Parser
+            - watcher: How to wait for the log to change. Defaults to the best for this platform.
+        """
+        self.parser = parser
+        self.watcher = watcher or make_watcher(parser.hs_filepath)
+        self.inode = self.current_inode()
+        # Called with (parser, num_lines) after every batch of new lines
+        self.callbacks = []
+        # Called with (parser) after the log was truncated or recreated
+        self.reset_callbacks = []
+        self.running = False
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def add_reset_callback(self, callback):
+        self.reset_callbacks.append(callback)
+
+    def current_inode(self):
+        try:
+            return os.stat(self.parser.hs_filepath).st_ino
+        except OSError:
+            return None
+
+    def check_restart(self):
+        """If the log was truncated or replaced since we last read it, start
+        reading the new log from the beginning with a fresh game state.
+        Returns True if the log was restarted.
+        """
+        try:
+            st = os.stat(self.parser.hs_filepath)
+        except OSError:
+            # In the middle of being recreated
+            return False
+        if st.st_ino == self.inode and st.st_size >= self.parser.pos:
+            return False
+
+        if st.st_ino != self.inode:
+            logger.info("Log file was recreated, starting from the top")
+        else:
+            logger.info("Log file was truncated ({} < {}), starting from the top".\
+                        format(st.st_size, self.parser.pos))
+        self.inode = st.st_ino
+        self.parser.restart_log()
+        for callback in self.reset_callbacks:
+            callback(self.parser)
+        return True
+
+    def poll(self):
+        """Process whatever is in the log right now, without blocking.
+        Returns the number of lines processed.
+        """
+        self.check_restart()
+        num_lines = self.parser.process_log()
+        if num_lines:
+            for callback in self.callbacks:
+                callback(self.parser, num_lines)
+        return num_lines
+
+    def wait_for_batch(self, timeout=None):
+        """Block until new lines are written to the log (or timeout seconds pass)
+        and process them.
+        Returns the number of lines processed, 0 on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        num_lines = self.poll()
+        while not num_lines:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+            self.watcher.wait(remaining)
+            num_lines = self.poll()
+        return num_lines
+
+    def wait_until(self, condition, timeout=None):
+        """Process batches until condition() is true or timeout seconds pass.
+        Returns the value of condition().
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        self.poll()
+        while not condition():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+            self.wait_for_batch(remaining)
+        return condition()
+
+    def wait_for_change(self, subscription, timeout=None):
+        """Process batches until subscription (a changes.Subscription) has a change
+        or timeout seconds pass. Returns the change, None on timeout.
+        """
+        self.poll()
+        return subscription.wait(self.wait_for_batch, timeout)
+
+    def wait_for_quiet(self, quiet_time):
+        """Process batches until the log has been silent for quiet_time seconds.
+        Used to wait for animations to finish printing.
+        """
+        while self.wait_for_batch(quiet_time):
+            logger.info("Log is still printing, waiting for it to quiesce...")
+
+    def run(self):
+        """Process the log forever (until stop is called), handing every batch
+        to the callbacks.
+        """
+        self.running = True
+        while self.running:
+            self.wait_for_batch(1)
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        self.stop()
+        self.watcher.close()
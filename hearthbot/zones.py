@@ -0,0 +1,127 @@
+"""
+Where every card of a game is: which player controls it and which zone it's in.
+
+Cards are kept per (controller, zone) in ordered dicts keyed by card id, and
+every card id remembers its (controller, zone), so moving a card, asking where
+it is, or whether it's somewhere is O(1) instead of searching lists.
+Minions in PLAY come back in board order (by position).
+
+Only minions go in PLAY: heroes, hero powers, weapons and spells being cast
+aren't on the board, so they are not in a zone until they die.
+
+With debug on, every move is followed by a full check of the index.
+"""
+
+import logging
+import collections
+
+logger = logging.getLogger('ZONES')
+
+HAND = 'HAND'
+PLAY = 'PLAY'
+DECK = 'DECK'
+GRAVEYARD = 'GRAVEYARD'
+SETASIDE = 'SETASIDE'
+ZONES = (HAND, PLAY, DECK, GRAVEYARD, SETASIDE)
+# Cards in these zones are out of the game for good
+DEAD_ZONES = (GRAVEYARD, SETASIDE)
+
+# Check the whole index after every change in every ZoneIndex (slow, for tests and debugging)
+DEBUG = False
+
+# The most cards a zone can hold
+ZONE_LIMITS = {HAND: 10, PLAY: 7}
+
+class ZoneError(Exception):
+    pass
+
+def by_position(card):
+    # Cards without a position go last
+    return (card.pos is None, card.pos)
+
+class ZoneIndex(object):
+    def __init__(self, debug=None):
+        """Tracks the (controller, zone) of cards.
+
+        Args:
+            - debug: Check the whole index after every change (slow). Defaults to DEBUG.
+        """
+        self.debug = DEBUG if debug is None else debug
+        # (controller, zone) -> OrderedDict of card id -> card
+        self.zones = collections.defaultdict(collections.OrderedDict)
+        # card id -> (controller, zone)
+        self.location = {}
+
+    def __repr__(self):
+        return "ZoneIndex({})".format(", ".join("{} {}: {}".format(c, z, len(cards))
+                                               for (c, z), cards in sorted(self.zones.items())
+                                               if cards))
+
+    def where(self, card):
+        """Returns (controller, zone) of card, or None if it isn't in a zone.
+        """
+        return self.location.get(card.id)
+
+    def contains(self, card, controller, zone):
+        return self.location.get(card.id) == (controller, zone)
+
+    def count(self, controller, zone):
+        return len(self.zones[(controller, zone)])
+
+    def cards(self, controller, zone):
+        """Returns a new list of the cards a controller has in a zone.
+        Minions in PLAY are in board order, other zones in the order cards got there.
+        """
+        cards = self.zones[(controller, zone)].values()
+        if zone == PLAY:
+            cards.sort(key=by_position)
+        return cards
+
+    def move(self, card, controller, zone):
+        """Move card to a controller's zone, and set card.zone.
+        controller None keeps the controller the card has (if any).
+        """
+        key = self.location.get(card.id)
+        if controller is None and key is not None:
+            controller = key[0]
+        if key != (controller, zone):
+            if key is not None:
+                del self.zones[key][card.id]
+            cards = self.zones[(controller, zone)]
+            limit = ZONE_LIMITS.get(zone)
+            if limit is not None and len(cards) >= limit:
+                logger.warn("{} {} already holds {} cards, adding {}".format(controller, zone,
+                                                                            len(cards), card))
+            cards[card.id] = card
+            self.location[card.id] = (controller, zone)
+        else:
+            # Same place, but make sure it's this card object with that id
+            self.zones[key][card.id] = card
+        card.zone = zone
+        if self.debug:
+            self.validate()
+
+    def remove(self, card):
+        """Take card out of whatever zone it's in.
+        """
+        key = self.location.pop(card.id, None)
+        if key is not None:
+            del self.zones[key][card.id]
+        if self.debug:
+            self.validate()
+
+    def validate(self):
+        """Check that every card is in exactly one zone and knows it.
+        Raises ZoneError if not.
+        """
+        seen = 0
+        for key, cards in self.zones.items():
+            for card_id, card in cards.items():
+                if self.location.get(card_id) != key:
+                    raise ZoneError("{} is in {} but located at {}".format(
+                        card, key, self.location.get(card_id)))
+                if card.zone != key[1]:
+                    raise ZoneError("{} is in {} but its zone is {}".format(card, key, card.zone))
+                seen += 1
+        if seen != len(self.location):
+            raise ZoneError("{} cards in zones but {} located".format(seen, len(self.location)))
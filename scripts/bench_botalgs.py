@@ -0,0 +1,82 @@
+"""Benchmarks the bot's decisions:
+- picking the cards to play: play_with_max_mana (a knapsack over mana and
+  board slots) against trying every combination of the hand (how
+  play_with_max_mana used to do it), for hands of every size with 10 mana
+- planning the attacks (plan_attacks) on full boards, 7 minions a side
+
+Run from the repository root:
+    python scripts/bench_botalgs.py
+"""
+
+import os, sys
+import random
+import timeit
+import itertools
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hearthbot import botalgs
+from hearthbot.carddata import card_from_id, TAUNT, DIVINE_SHIELD
+
+MANA = 10
+HANDS = 20
+NUMBER = 20
+BOARDS = 200
+
+def play_with_combinations(hand, avail_mana):
+    """play_with_max_mana the old way: for the most cards first, try every combination
+    of that many and keep the one spending the most mana.
+    """
+    for size in reversed(range(1, len(hand) + 1)):
+        (best_mana, best_play) = (0, None)
+        for play in itertools.combinations(hand, size):
+            mana = botalgs.cost_to_play_cards(play)
+            if best_mana < mana <= avail_mana:
+                (best_mana, best_play) = (mana, play)
+        if best_play:
+            return (best_mana, list(best_play))
+    return (0, [])
+
+def random_hand(rand, size):
+    hand = [card_from_id('CS2_065', str(i)) for i in range(size)]
+    for card in hand:
+        card.cost = rand.randint(1, 10)
+    return hand
+
+def random_board(rand, first_id):
+    board = [card_from_id('CS2_065', str(first_id + i)) for i in range(7)]
+    for minion in board:
+        (minion.attack, minion.health, minion.flags) = (rand.randint(1, 7), rand.randint(1, 8), 0)
+        minion.set_flag(TAUNT, rand.random() < 0.25)
+        minion.set_flag(DIVINE_SHIELD, rand.random() < 0.1)
+    return board
+
+def time_plays(play, hands):
+    return timeit.timeit(lambda: [play(hand, MANA) for hand in hands],
+                         number=NUMBER) / (NUMBER * len(hands))
+
+def main():
+    rand = random.Random(24)
+    print("{:<6} {:>14} {:>14} {:>8}".format('cards', 'combos us', 'knapsack us', 'speedup'))
+    for size in range(1, 11):
+        hands = [random_hand(rand, size) for i in range(HANDS)]
+        for hand in hands:
+            old = play_with_combinations(hand, MANA)
+            new = botalgs.play_with_max_mana(hand, MANA)
+            assert (old[0], len(old[1])) == (new[0], len(new[1]))
+        combos = time_plays(play_with_combinations, hands)
+        knapsack = time_plays(botalgs.play_with_max_mana, hands)
+        print("{:<6} {:>14.1f} {:>14.1f} {:>7.1f}x".format(size, combos * 1e6, knapsack * 1e6,
+                                                          combos / knapsack))
+
+    hero = card_from_id('HERO_01', '99')
+    times = []
+    for i in range(BOARDS):
+        (us, them) = (random_board(rand, 0), random_board(rand, 10))
+        times.append(timeit.timeit(lambda: botalgs.plan_attacks(us, them, hero=hero), number=1))
+    times.sort()
+    print("plan_attacks 7v7: median {:.2f}ms, 95% {:.2f}ms, worst {:.2f}ms".format(
+        times[len(times) // 2] * 1e3, times[len(times) * 95 // 100] * 1e3, times[-1] * 1e3))
+
+if __name__ == '__main__':
+    main()
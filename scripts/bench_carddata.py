@@ -0,0 +1,44 @@
+"""Benchmarks the card database:
+- loading it from AllSets.json against loading the compiled cache
+- looking up cards by id with the indexes against walking the whole
+  database (how CardData.find_card used to do it)
+
+Run from the repository root:
+    python scripts/bench_carddata.py
+"""
+
+import os, sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hearthbot.carddata import CardData, get_card_data
+
+# A card from near the start and the end of the scan, and one that doesn't exist
+CARD_IDS = ['GAME_004', 'CS2_065', 'GVG_110', 'NOT_A_CARD']
+NUMBER = 2000
+LOADS = 20
+
+def scan_card(card_data, cardId):
+    for k in card_data.cardDB.keys():
+        for d in card_data.cardDB[k]:
+            if d.get('id') == cardId:
+                return d
+    return None
+
+def main():
+    card_data = get_card_data()
+    json_load = timeit.timeit(lambda: CardData(use_cache=False), number=LOADS) / LOADS
+    cache_load = timeit.timeit(lambda: CardData(), number=LOADS) / LOADS
+    print("load: json {:.1f}ms, cache {:.1f}ms".format(json_load * 1e3, cache_load * 1e3))
+
+    print("{:<12} {:>12} {:>12} {:>8}".format('cardId', 'scan us', 'index us', 'speedup'))
+    for cardId in CARD_IDS:
+        assert scan_card(card_data, cardId) is card_data.find_card(cardId)
+        scan = timeit.timeit(lambda: scan_card(card_data, cardId), number=NUMBER) / NUMBER
+        index = timeit.timeit(lambda: card_data.find_card(cardId), number=NUMBER) / NUMBER
+        print("{:<12} {:>12.2f} {:>12.3f} {:>7.0f}x".format(cardId, scan * 1e6, index * 1e6,
+                                                           scan / index))
+
+if __name__ == '__main__':
+    main()
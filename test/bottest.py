@@ -1,11 +1,16 @@
 import unittest
+import logging
 import os, sys
+import tempfile
+import time
+import random
+import itertools
 
 # Add hearthbot to the path for testing
 hearthbot_home = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(hearthbot_home)
 
-from hearthbot import state, botalgs
+from hearthbot import state, zones, boardarray, changes, checkpoint, hotlog, positions, kooloolimpah, botalgs, carddata, deck, cardlogger, tailer, logindex, replay, events, archive, tagstore
 
 class TestBot(unittest.TestCase):
     def test_spend_max_mana(self):
@@ -14,13 +19,912 @@ class TestBot(unittest.TestCase):
         gstate.set_our_turn()
         gstate.add_card_to_hand('CS2_065', '01')
         voidwalker = gstate.tingle.hand[0]
-        self.assertEqual((1, [voidwalker]), botalgs.spend_max_mana(gstate.tingle))
+        self.assertEqual((1, [voidwalker], False), botalgs.spend_max_mana(gstate.tingle))
 
     def test_cards_to_play_empty(self):
         gstate = state.GameState()
         gstate.start_game()
         gstate.set_our_turn()
-        self.assertEqual((0, []), botalgs.cards_to_play(gstate.tingle))
-        
+        self.assertEqual((0, [], False), botalgs.cards_to_play(gstate.tingle))
+
+    def test_play_with_max_mana_matches_combinations(self):
+        rand = random.Random(24)
+        for n in range(200):
+            hand = [carddata.card_from_id('CS2_065', str(i)) for i in range(rand.randint(0, 10))]
+            for card in hand:
+                card.cost = rand.randint(1, 10)
+            mana = rand.randint(0, 10)
+            # The most cards, then the most mana, of every combination that fits
+            best = max((len(play), botalgs.cost_to_play_cards(play))
+                       for size in range(len(hand) + 1)
+                       for play in itertools.combinations(hand, size)
+                       if botalgs.cost_to_play_cards(play) <= mana)
+            (new_mana, new_cards) = botalgs.play_with_max_mana(hand, mana)
+            self.assertEqual(best, (len(new_cards), new_mana))
+            self.assertEqual(new_mana, botalgs.cost_to_play_cards(new_cards))
+            self.assertEqual(len(new_cards), len(set(new_cards)))
+
+    def test_spend_max_mana_limits(self):
+        gstate = state.GameState()
+        gstate.start_game()
+        gstate.set_our_turn()
+        gstate.tingle.mana = 5
+        for i, cardId in enumerate(['CS2_065', 'CS2_179', 'CS2_122', 'CS2_065']):
+            gstate.add_card_to_hand(cardId, '0{}'.format(i))
+        hand = dict((c.id, c) for c in gstate.tingle.hand)
+        self.assertEqual((5, [hand['00'], hand['02'], hand['03']], False),
+                         botalgs.spend_max_mana(gstate.tingle))
+        # One free slot: the most expensive minion
+        self.assertEqual((4, [hand['01']], False), botalgs.spend_max_mana(gstate.tingle, 1))
+        # As many cards and room for the hero power
+        self.assertEqual((3, [hand['02']], True), botalgs.spend_max_mana(gstate.tingle, 1, 2))
+
+    def test_spend_max_mana_coin(self):
+        gstate = state.GameState()
+        gstate.start_game()
+        gstate.set_our_turn()
+        gstate.tingle.mana = 3
+        gstate.add_card_to_hand('GAME_005', '01')
+        gstate.add_card_to_hand('CS2_179', '02')
+        (coin, senjin) = (gstate.card_with_id('01'), gstate.card_with_id('02'))
+        self.assertEqual((4, [coin, senjin], False), botalgs.spend_max_mana(gstate.tingle))
+
+        # The coin and a 2 drop with 3 mana: the coin pays for the hero power
+        gstate.tingle.mana = 3
+        gstate.add_card_to_hand('CS2_120', '03')
+        gstate.send_to_graveyard('02')
+        crocolisk = gstate.card_with_id('03')
+        self.assertEqual((2, [coin, crocolisk], True),
+                         botalgs.cards_to_play(gstate.tingle, botalgs.HERO_POWER_COST))
+        # Once it's used, with 1 mana left
+        gstate.tingle.spend_mana(botalgs.HERO_POWER_COST)
+        self.assertEqual((2, [coin, crocolisk], False), botalgs.cards_to_play(gstate.tingle))
+
+    def minion(self, card_id, attack, health, flags=0):
+        minion = carddata.card_from_id('CS2_065', card_id)
+        (minion.attack, minion.health, minion.flags) = (attack, health, flags)
+        return minion
+
+    def test_plan_attacks_keeps_minions_alive(self):
+        (small, big) = (self.minion('01', 2, 3), self.minion('02', 3, 2))
+        enemy = self.minion('21', 2, 2)
+        trade = botalgs.plan_attacks([big, small], [enemy])
+        # The one that survives the trade takes it, the other goes face
+        self.assertEqual([(small, enemy), (big, None)], trade.attacks)
+        self.assertEqual([], trade.lost)
+        self.assertEqual(3, trade.face)
+
+    def test_plan_attacks_taunt(self):
+        attackers = [self.minion('01', 2, 1), self.minion('02', 1, 5), self.minion('03', 4, 4)]
+        taunt = self.minion('21', 1, 3, carddata.TAUNT)
+        other = self.minion('22', 5, 5)
+        trade = botalgs.plan_attacks(attackers, [other, taunt])
+        self.assertEqual(taunt, trade.attacks[0][1])
+        self.assertTrue(taunt in trade.killed)
+        # Too big to take on with what's left once the taunt is down
+        self.assertFalse(other in trade.killed)
+
+        # Can't kill the taunt: hit it with everything, losing nothing
+        wall = self.minion('23', 0, 20, carddata.TAUNT)
+        trade = botalgs.plan_attacks(attackers, [other, wall])
+        self.assertEqual(set([wall]), set(d for a, d in trade.attacks))
+        self.assertEqual([], trade.lost)
+
+    def test_plan_attacks_divine_shield(self):
+        attackers = [self.minion('01', 3, 3), self.minion('02', 1, 3)]
+        shielded = self.minion('21', 1, 3, carddata.DIVINE_SHIELD)
+        trade = botalgs.plan_attacks(attackers, [shielded])
+        # The small one takes the shield
+        self.assertEqual([(attackers[1], shielded), (attackers[0], shielded)], trade.attacks)
+
+    def test_plan_attacks_hitting_taunts(self):
+        attackers = [self.minion('01', 4, 6), self.minion('02', 2, 4)]
+        big = self.minion('21', 6, 3, carddata.TAUNT)
+        small = self.minion('22', 3, 4, carddata.TAUNT)
+        other = self.minion('23', 4, 1)
+        trade = botalgs.plan_attacks(attackers, [big, small, other])
+        # Both kill the small taunt, leaving the big one
+        self.assertEqual(10, trade.score)
+        self.assertEqual([small], trade.killed)
+        self.assertEqual([(attackers[1], small), (attackers[0], small)], trade.attacks)
+
+    def play_out(self, attackers, defenders, attacks, objective):
+        """Score of attacks, or None if one of them can't be made.
+        """
+        health = dict((m, m.remaining_health()) for m in attackers + defenders)
+        shields = set(m for m in attackers + defenders if m.has(carddata.DIVINE_SHIELD))
+        score = 0
+        for attacker, defender in attacks:
+            taunts = [d for d in defenders if d.has(carddata.TAUNT) and health[d] > 0]
+            if defender is None:
+                if taunts:
+                    return None
+                score += objective.face_value * attacker.attack
+                continue
+            if health[defender] <= 0 or taunts and defender not in taunts:
+                return None
+            for minion, damage in ((defender, attacker.attack), (attacker, defender.attack)):
+                if minion in shields and damage > 0:
+                    shields.remove(minion)
+                else:
+                    health[minion] -= damage
+            if health[defender] <= 0:
+                score += objective.kill_value(defender)
+            if health[attacker] <= 0:
+                score -= objective.loss_value(attacker)
+        return score
+
+    def test_plan_attacks_against_every_order(self):
+        rand = random.Random(25)
+        objective = botalgs.TradeObjective()
+        def minion(card_id, flags):
+            if rand.random() < 0.2:
+                flags |= carddata.DIVINE_SHIELD
+            return self.minion(card_id, rand.randint(1, 6), rand.randint(1, 6), flags)
+        for board in range(150):
+            attackers = [minion(str(i), 0) for i in range(rand.randint(1, 3))]
+            defenders = [minion(str(20 + i), carddata.TAUNT if rand.random() < 0.6 else 0)
+                         for i in range(rand.randint(1, 3))]
+            best = None
+            for order in itertools.permutations(attackers):
+                for targets in itertools.product(defenders + [None], repeat=len(order)):
+                    score = self.play_out(attackers, defenders, zip(order, targets), objective)
+                    if score is not None and (best is None or score > best):
+                        best = score
+            trade = botalgs.plan_attacks(attackers, defenders)
+            self.assertEqual(trade.score,
+                             self.play_out(attackers, defenders, trade.attacks, objective))
+            self.assertEqual(best, trade.score)
+
+    def test_plan_attacks_lethal_and_objective(self):
+        attackers = [self.minion('01', 3, 4), self.minion('02', 3, 4)]
+        enemy = self.minion('21', 3, 2)
+        hero = carddata.card_from_id('HERO_01', '20')
+        self.assertEqual([enemy], botalgs.plan_attacks(attackers, [enemy]).killed)
+        hero.damage = hero.health - 6
+        trade = botalgs.plan_attacks(attackers, [enemy], hero=hero)
+        self.assertEqual(6, trade.face)
+
+        class Face(botalgs.TradeObjective):
+            face_value = 10
+        self.assertEqual(6, botalgs.plan_attacks(attackers, [enemy], Face()).face)
+
+    def test_card_data_indexes(self):
+        data = carddata.get_card_data()
+        self.assertEqual('Voidwalker', data.find_card('CS2_065')['name'])
+        self.assertEqual(None, data.find_card('NOT_A_CARD'))
+        self.assertEqual(['CS2_065'], [d['id'] for d in data.find_by_name(' voidwalker')])
+        self.assertEqual(['HERO_07'], [d['id'] for d in data.find_by_name('guldan')])
+        self.assertEqual(6, len(data.find_by_name('NEFARIAN')))
+        self.assertTrue(data.find_card('CS2_065') in data.cards_costing(1))
+        self.assertTrue(data.find_card('CS2_065') in data.cards_of_type('Minion'))
+        self.assertTrue(data.find_card('CS2_065') in data.cards_in_set('Basic'))
+
+    def test_cards_share_templates(self):
+        first = carddata.card_from_id('CS2_065', '6')
+        second = carddata.card_from_id('CS2_065', '7')
+        self.assertTrue(first.template is second.template)
+        self.assertRaises(AttributeError, setattr, first.template, 'cost', 0)
+        self.assertFalse(hasattr(first, '__dict__'))
+
+        clone = first.copy()
+        clone.damage = 2
+        self.assertEqual((0, 2), (first.damage, clone.damage))
+        self.assertEqual(('Voidwalker', 1, 3), (clone.name, clone.attack, clone.health))
+
+    def test_mechanic_flags(self):
+        gstate = state.GameState()
+        gstate.start_game()
+        # Frozen before we knew the card
+        gstate.record_tag('20', 'FROZEN', '1')
+        gstate.opp_play_minion('CS2_179', '20', '1')
+        shieldmasta = gstate.card_with_id('20')
+        self.assertTrue(shieldmasta.flags & carddata.TAUNT)
+        self.assertEqual(('Taunt', 'Frozen'), shieldmasta.mechanics)
+
+        gstate.record_tag('20', 'TAUNT', '0')
+        gstate.record_tag('20', 'DIVINE_SHIELD', '1')
+        self.assertFalse(shieldmasta.has(carddata.TAUNT))
+        self.assertEqual(carddata.FROZEN | carddata.DIVINE_SHIELD, shieldmasta.flags)
+        self.assertEqual(shieldmasta.key(), shieldmasta.copy().key())
+
+    def test_card_data_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        db_path = os.path.join(tmpdir, 'AllSets.json')
+        with open(db_path, 'w') as f:
+            f.write('{"Basic": [{"id": "CS2_065", "name": "Voidwalker", "type": "Minion", "cost": 1, "flavor": "..."}]}')
+        data = carddata.CardData(db_path)
+        self.assertTrue(os.path.exists(db_path + carddata.CACHE_SUFFIX))
+        self.assertEqual(None, data.find_card('CS2_065').get('flavor'))
+        self.assertEqual(1, carddata.CardData(db_path).find_card('CS2_065')['cost'])
+
+        # A changed db is recompiled, even with the same mtime
+        st = os.stat(db_path)
+        with open(db_path, 'w') as f:
+            f.write('{"Basic": [{"id": "CS2_065", "name": "Voidwalker", "type": "Minion", "cost": 2}]}')
+        os.utime(db_path, (st.st_atime, st.st_mtime))
+        self.assertEqual(2, carddata.CardData(db_path).find_card('CS2_065')['cost'])
+
+class TestZones(unittest.TestCase):
+    def test_moves_and_control(self):
+        gstate = state.GameState(debug_zones=True)
+        gstate.start_game()
+        gstate.set_player_number('1')
+        gstate.opp_play_minion('CS2_065', '20', '2')
+        gstate.opp_play_minion('CS2_179', '21', '1')
+        voidwalker, shieldmasta = gstate.card_with_id('20'), gstate.card_with_id('21')
+        # Board order, not the order they were played in
+        self.assertEqual([shieldmasta, voidwalker], gstate.opponent.minions)
+
+        gstate.update_card_tag('20', 'CONTROLLER', '1')
+        self.assertEqual([voidwalker], gstate.tingle.minions)
+        self.assertEqual(('TINGLE', zones.PLAY), gstate.zones.where(voidwalker))
+
+        gstate.send_to_graveyard('21')
+        self.assertEqual([], gstate.opponent.minions)
+        self.assertEqual(1, gstate.zones.count('OPPONENT', zones.GRAVEYARD))
+
+    def test_debug_catches_bad_zone(self):
+        index = zones.ZoneIndex(debug=True)
+        card = carddata.card_from_id('CS2_065', '6')
+        index.move(card, 'TINGLE', zones.HAND)
+        card.zone = zones.PLAY
+        self.assertRaises(zones.ZoneError, index.validate)
+
+class TestSnapshot(unittest.TestCase):
+    def test_snapshot_leaves_game_alone(self):
+        gstate = state.GameState()
+        gstate.start_game()
+        gstate.set_player_number('1')
+        gstate.tingle.mana = 5
+        gstate.add_card_to_hand('CS2_065', '01')
+        gstate.opp_play_minion('CS2_179', '21', '1')
+
+        snap = gstate.snapshot()
+        snap.play_minion('01')
+        self.assertEqual(('01',), snap.tingle.minions)
+        self.assertEqual(4, snap.tingle.mana_available())
+        self.assertEqual(['01'], [c.id for c in gstate.tingle.hand])
+        self.assertEqual(5, gstate.tingle.mana_available())
+
+        # Forks share cards until they change them
+        fork = snap.fork()
+        self.assertTrue(fork.card('21') is snap.card('21'))
+        fork.attack('01', '21')
+        self.assertEqual((), fork.tingle.minions)
+        self.assertEqual(1, fork.card('21').damage)
+        self.assertEqual(0, snap.card('21').damage)
+        self.assertEqual(('01',), snap.tingle.minions)
+        self.assertEqual(0, gstate.card_with_id('21').damage)
+
+    def test_fork_then_change_parent(self):
+        gstate = state.GameState()
+        gstate.start_game()
+        gstate.set_player_number('1')
+        gstate.opp_play_minion('CS2_179', '21', '1')
+        snap = gstate.snapshot()
+        snap.mutable('21').damage = 1
+        fork = snap.fork()
+        snap.mutable('21').damage = 2
+        self.assertEqual(1, fork.card('21').damage)
+        fork.mutable('21').damage = 3
+        self.assertEqual(2, snap.card('21').damage)
+        self.assertEqual(0, gstate.card_with_id('21').damage)
+
+    def test_divine_shield(self):
+        gstate = state.GameState()
+        gstate.start_game()
+        gstate.set_player_number('1')
+        gstate.opp_play_minion('CS2_179', '21', '1')
+        gstate.opp_play_minion('CS2_065', '22', '2')
+        gstate.record_tag('22', 'DIVINE_SHIELD', '1')
+        snap = gstate.snapshot()
+        snap.attack('21', '22')
+        self.assertEqual(0, snap.card('22').damage)
+        self.assertFalse(snap.card('22').has(carddata.DIVINE_SHIELD))
+        self.assertTrue(gstate.card_with_id('22').has(carddata.DIVINE_SHIELD))
+
+class TestPositions(unittest.TestCase):
+    def setUp(self):
+        self.gstate = gstate = state.GameState()
+        gstate.start_game()
+        gstate.set_player_number('1')
+        gstate.tingle.mana = 10
+        for i, card_id in enumerate(['01', '02', '03']):
+            gstate.add_card_to_hand('CS2_065', card_id)
+            gstate.update_card_pos(card_id, i + 1)
+        for i, card_id in enumerate(['11', '12']):
+            gstate.play_minion('CS2_179', card_id)
+            gstate.update_card_pos(card_id, i + 1)
+        gstate.opp_play_minion('CS2_065', '21', '1')
+        self.cache = positions.PositionCache()
+        self.cache.sync(gstate)
+
+    def test_drop_slot(self):
+        self.assertEqual(0, positions.drop_slot(0))
+        self.assertEqual(1, positions.drop_slot(2))
+        self.assertEqual(2, positions.drop_slot(3))
+
+    def test_play_moves_hand_and_board(self):
+        cache = self.cache
+        card = self.gstate.card_with_id('01')
+        self.assertEqual(3, cache.hand_index(self.gstate.card_with_id('03')))
+        cache.predict_play(card)
+        self.assertEqual(2, cache.hand_size())
+        self.assertEqual(2, cache.hand_index(self.gstate.card_with_id('03')))
+        # Dropped in the middle of two minions
+        self.assertEqual(['11', '01', '12'],
+                         [c.id for c in cache.minions(self.gstate.tingle.name)])
+        self.assertEqual(3, cache.board_slot(self.gstate.card_with_id('12')))
+        # The game state hasn't moved yet
+        self.assertEqual(3, len(self.gstate.tingle.hand))
+
+    def test_attack_kills(self):
+        cache = self.cache
+        attacker = self.gstate.card_with_id('11')
+        defender = self.gstate.card_with_id('21')
+        cache.predict_attack(attacker, defender)
+        self.assertEqual(0, cache.board_size(self.gstate.opponent.name))
+        self.assertTrue(cache.remaining_health(defender) <= 0)
+        self.assertEqual(0, self.gstate.card_with_id('21').damage)
+
+    def test_reconcile(self):
+        cache = self.cache
+        gstate = self.gstate
+        cache.predict_play(gstate.card_with_id('01'))
+        # The log agrees
+        gstate.play_minion('CS2_065', '01')
+        for i, card_id in enumerate(['11', '01', '12']):
+            gstate.update_card_pos(card_id, i + 1)
+        gstate.update_card_pos('02', 1)
+        gstate.update_card_pos('03', 2)
+        self.assertTrue(cache.reconcile(gstate))
+        self.assertEqual(0, cache.mispredictions)
+
+        # The log doesn't: the minion went to the right end
+        cache.predict_play(gstate.card_with_id('02'))
+        gstate.play_minion('CS2_065', '02')
+        gstate.update_card_pos('02', 4)
+        gstate.update_card_pos('03', 1)
+        self.assertFalse(cache.reconcile(gstate))
+        self.assertEqual(1, cache.mispredictions)
+        self.assertEqual(['11', '01', '12', '02'],
+                         [c.id for c in cache.minions(gstate.tingle.name)])
+
+class TestBoardArray(unittest.TestCase):
+    def setUp(self):
+        self.gstate = gstate = state.GameState()
+        gstate.start_game()
+        gstate.set_player_number('1')
+        gstate.opp_play_minion('CS2_179', '21', '1')
+        gstate.opp_play_minion('CS2_065', '22', '2')
+        # Give the 3/5 to Tingle and wake it up
+        gstate.update_card_tag('21', 'CONTROLLER', '1')
+        gstate.card_with_id('21').activate()
+
+    def test_sync_is_incremental(self):
+        gstate = self.gstate
+        ours = gstate.board(gstate.tingle)
+        self.assertEqual(['21'], ours.ids[1:ours.size + 1])
+        self.assertEqual(3, boardarray.total_attack(ours))
+        writes = ours.writes
+        gstate.board(gstate.tingle)
+        self.assertEqual(writes, ours.writes)
+        gstate.update_card_tag('21', 'DAMAGE', '4')
+        gstate.board(gstate.tingle)
+        self.assertEqual(writes + 1, ours.writes)
+        self.assertEqual(4, ours.columns['damage'][1])
+
+    def test_kills_and_lethal(self):
+        gstate = self.gstate
+        ours, theirs = gstate.board(gstate.tingle), gstate.board(gstate.opponent)
+        matrix = boardarray.kill_matrix(ours, theirs)
+        self.assertTrue(matrix[1][1])
+        self.assertFalse(matrix[2][1])
+        # No hero, and a taunt in the way
+        self.assertFalse(boardarray.is_lethal(ours, theirs))
+
+        snap = gstate.snapshot()
+        fork = snap.fork()
+        fork.attack('21', '22')
+        boards = [boardarray.Board(), boardarray.Board()]
+        boards[0].sync_snapshot(snap, snap.opponent)
+        boards[1].sync_snapshot(fork, fork.opponent)
+        self.assertEqual([4, 0], list(boardarray.score_boards(boards)))
+
+class TestChanges(unittest.TestCase):
+    def test_state_publishes_changes(self):
+        kooloolimpah.enabled = False
+        gstate = state.GameState()
+        seen = []
+        everything = gstate.changes.subscribe(callback=seen.append)
+        deaths = gstate.changes.subscribe([changes.MINION_DIED])
+        gstate.start_game()
+        gstate.set_player_number('1')
+        gstate.set_our_turn()
+        gstate.add_card_to_hand('CS2_065', '01')
+        gstate.opp_play_minion('CS2_179', '21', '1')
+        gstate.update_card_pos('21', '1')
+        gstate.update_card_pos('21', '2')
+        gstate.send_to_graveyard('21')
+        gstate.send_to_graveyard('01')
+        gstate.set_won()
+        self.assertEqual([changes.GAME_STARTED, changes.TURN_STARTED, changes.CARD_DRAWN,
+                          changes.POSITION_CHANGED, changes.MINION_DIED, changes.GAME_OVER],
+                         [c.kind for c in seen])
+        self.assertEqual('WON', seen[-1].value)
+
+        # Only the minion from the board died, not the card from the hand
+        died = deaths.get()
+        self.assertEqual(('OPPONENT', '21'), (died.player, died.card.id))
+        self.assertEqual(None, deaths.get())
+        gstate.changes.unsubscribe(everything)
+        gstate.set_lost()
+        self.assertEqual(6, len(seen))
+
+    def test_publish_formats_lazily(self):
+        feed = changes.ChangeFeed()
+        subscription = feed.subscribe([changes.MINION_DIED])
+        hotlog.set_level('CHANGES', logging.INFO)
+        Counted.formatted = 0
+        try:
+            feed.publish(changes.MINION_DIED, 'OPPONENT', Counted())
+        finally:
+            hotlog.set_level('CHANGES', logging.NOTSET)
+        # Not turned into text, since debug is off
+        self.assertEqual(0, Counted.formatted)
+        self.assertEqual(changes.MINION_DIED, subscription.get().kind)
+
+    def test_wait(self):
+        feed = changes.ChangeFeed()
+        turns = feed.subscribe([changes.TURN_STARTED])
+        pumped = []
+        def pump(timeout):
+            # Reading the log finds the turn starting
+            pumped.append(timeout)
+            feed.publish(changes.CARD_DRAWN)
+            feed.publish(changes.TURN_STARTED, 'TINGLE')
+        self.assertEqual('TINGLE', turns.wait(pump, 1).player)
+        self.assertEqual(1, len(pumped))
+        self.assertEqual(None, turns.wait(lambda timeout: None, 0.01))
+        self.assertRaises(ValueError, feed.subscribe, ['NOT_A_CHANGE'])
+
+class TestDeck(unittest.TestCase):
+    def test_load_deck(self):
+        bot_deck = deck.load_deck(deck.BOT_DECK)
+        self.assertEqual(30, bot_deck.size)
+        self.assertEqual(2, bot_deck.count('CS2_065'))
+        self.assertEqual((0, 14, 6, 6, 2, 0, 2, 0), bot_deck.curve)
+        self.assertEqual({'Minion': 26, 'Spell': 4}, bot_deck.type_counts)
+        self.assertRaises(AttributeError, setattr, bot_deck, 'size', 31)
+        self.assertEqual(30, deck.load_deck(os.path.join(hearthbot_home, 'sample_deck.hsdeck')).size)
+
+    def test_draws_update_what_is_left(self):
+        gstate = state.GameState(deck.load_deck(deck.BOT_DECK))
+        gstate.start_game()
+        gstate.add_card_to_hand('CS2_065', '01')
+        gstate.add_card_to_hand('GAME_005', '02')
+        tracker = gstate.deck_tracker
+        self.assertEqual((29, 13, 1, 1), (tracker.size, tracker.left_costing(1),
+                                          tracker.left('CS2_065'), tracker.unknown_draws))
+        # Mulliganed back into the deck
+        gstate.update_zone('01', '1', 'DECK')
+        self.assertEqual((30, 14), (tracker.size, tracker.left_costing(1)))
+
+class TestParser(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logpath = os.path.join(self.tmpdir, 'Player.log')
+        self.outpath = os.path.join(self.tmpdir, 'hearthstone.log')
+
+    def write_log(self, lines):
+        with open(self.logpath, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def test_draw_routes_to_draw_rule(self):
+        self.write_log([
+            '[Power] GameState.DebugPrintPower() - CREATE_GAME',
+            '(Filename: UnityEngineDebug.cpp Line: 49)',
+            '[Zone] ZoneChangeList.ProcessChanges() - id=1 local=False [name=Voidwalker id=6 zone=HAND zonePos=1 cardId=CS2_065 player=1] zone from  -> FRIENDLY HAND',
+        ])
+        parser = cardlogger.Parser(self.logpath, self.outpath)
+        parser.process_log()
+        self.assertEqual(['Voidwalker'], [c.name for c in parser.gstate.tingle.hand])
+        hits = parser.rule_hits()
+        self.assertEqual(1, hits['gamestart'])
+        self.assertEqual(1, hits['draw'])
+        self.assertEqual(0, hits['our_play'])
+
+    def test_partial_line_waits_for_newline(self):
+        draw = '[Zone] ZoneChangeList.ProcessChanges() - id=1 local=False [name=Voidwalker id=6 zone=HAND zonePos=1 cardId=CS2_065 player=1] zone from  -> FRIENDLY HAND'
+        self.write_log(['[Power] GameState.DebugPrintPower() - CREATE_GAME', 'Unity noise'])
+        with open(self.logpath, 'a') as f:
+            f.write(draw[:40])
+        parser = cardlogger.Parser(self.logpath, self.outpath)
+        self.assertEqual(1, parser.process_log())
+        self.assertEqual([], parser.gstate.tingle.hand)
+
+        with open(self.logpath, 'a') as f:
+            f.write(draw[40:] + '\n')
+        self.assertEqual(1, parser.process_log())
+        self.assertEqual(['Voidwalker'], [c.name for c in parser.gstate.tingle.hand])
+
+    def test_action_block_applied_at_end(self):
+        self.write_log([
+            '[Power] GameState.DebugPrintPower() - CREATE_GAME',
+            '[Zone] ZoneChangeList.ProcessChanges() - id=1 local=False [name=Voidwalker id=6 zone=HAND zonePos=1 cardId=CS2_065 player=1] zone from  -> FRIENDLY HAND',
+            '[Power] GameState.DebugPrintPower() - ACTION_START Entity=[name=Voidwalker id=6 zone=HAND zonePos=1 cardId=CS2_065 player=1] SubType=PLAY Index=0 Target=0',
+            '[Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=[name=Voidwalker id=6 zone=HAND zonePos=1 cardId=CS2_065 player=1] tag=COST value=0',
+        ])
+        parser = cardlogger.Parser(self.logpath, self.outpath)
+        parser.process_log()
+        self.assertFalse(parser.board_is_consistent())
+        self.assertEqual(1, parser.gstate.tingle.hand[0].cost)
+
+        self.write_log(['[Power] GameState.DebugPrintPower() - ACTION_END'])
+        parser.process_log()
+        self.assertTrue(parser.board_is_consistent())
+        self.assertEqual(1, parser.blocks_completed)
+        self.assertEqual(0, parser.gstate.tingle.hand[0].cost)
+
+    def test_actions_completed_counts_our_plays(self):
+        play = '[Power] GameState.DebugPrintPower() - ACTION_START Entity=[name=Voidwalker id=6 zone=HAND zonePos=1 cardId=CS2_065 player={}] SubType=PLAY Index=0 Target=0'
+        end = '[Power] GameState.DebugPrintPower() - ACTION_END'
+        self.write_log(['[Power] GameState.DebugPrintPower() - CREATE_GAME'])
+        parser = cardlogger.Parser(self.logpath, self.outpath)
+        parser.process_log()
+        parser.gstate.set_player_number('1')
+        self.write_log([
+            play.format(1), end,
+            # Deaths get a block of their own
+            '[Power] GameState.DebugPrintPower() - ACTION_START Entity=GameEntity SubType=DEATHS Index=0 Target=0', end,
+            play.format(2), end,
+        ])
+        parser.process_log()
+        self.assertEqual(3, parser.blocks_completed)
+        self.assertEqual(1, parser.actions_completed)
+
+    def test_failed_at_line(self):
+        broken = '[Power] GameState.DebugPrintPower() - BROKEN'
+        self.write_log(['[Power] GameState.DebugPrintPower() - CREATE_GAME',
+                        'Noise the reader skips', broken,
+                        '[Power] GameState.DebugPrintPower() - CREATE_GAME'])
+        parser = cardlogger.Parser(self.logpath, None)
+        def parse_next_line(line):
+            if line.startswith(broken):
+                raise ValueError(line)
+        parser.parse_next_line = parse_next_line
+        self.assertRaises(ValueError, parser.process_log)
+        with open(self.logpath, 'rb') as f:
+            self.assertEqual(f.read().index(broken), parser.failed_at)
+
+    def test_journal_replay(self):
+        self.write_log([
+            '[Power] GameState.DebugPrintPower() - CREATE_GAME',
+            '[Zone] ZoneChangeList.ProcessChanges() - id=1 local=False [name=Voidwalker id=6 zone=HAND zonePos=1 cardId=CS2_065 player=1] zone from  -> FRIENDLY HAND',
+            '[Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=[name=Voidwalker id=6 zone=HAND zonePos=1 cardId=CS2_065 player=1] tag=COST value=0',
+        ])
+        journal_path = os.path.join(self.tmpdir, 'game.journal')
+        parser = cardlogger.Parser(self.logpath, self.outpath)
+        parser.record_journal(journal_path)
+        parser.process_log()
+        self.assertEqual([events.GameStart(), events.DrawCard('CS2_065', '6'),
+                          events.EntityTag('6', 'COST', '0'), events.TagChange('6', 'COST', '0')],
+                         events.load_journal(journal_path))
+
+        gstate = state.GameState()
+        self.assertEqual(4, events.replay_journal(journal_path, gstate))
+        self.assertEqual(0, gstate.tingle.hand[0].cost)
+        self.assertEqual(0, gstate.card_tag('6', 'COST'))
+
+class TestTagStore(unittest.TestCase):
+    def test_values_and_history(self):
+        tags = tagstore.TagStore()
+        tags.set(12, 'ZONE', 'PLAY')
+        tags.set(12, 'FROZEN', '1')
+        tags.set(13, 'FROZEN', '1')
+        tags.set(12, 'FROZEN', '0')
+        self.assertEqual('PLAY', tags.get(12, 'ZONE'))
+        self.assertEqual(0, tags.get(12, 'FROZEN'))
+        self.assertEqual(None, tags.get(14, 'FROZEN'))
+        self.assertEqual([13], tags.entities_with('FROZEN', 1))
+        self.assertEqual({'ZONE': 'PLAY', 'FROZEN': 0}, tags.entity_tags(12))
+        self.assertEqual([('ZONE', 'PLAY'), ('FROZEN', 1), ('FROZEN', 0)], tags.entity_history(12))
+        self.assertEqual([(12, 1), (13, 1), (12, 0)], tags.tag_history('FROZEN'))
+
+    def test_numbers_and_words_in_one_tag(self):
+        tags = tagstore.TagStore()
+        tags.set(12, 'SOME_NEW_TAG', '3')
+        tags.set(13, 'SOME_NEW_TAG', 'WORD')
+        tags.set(14, 'SOME_NEW_TAG', '0')
+        # The numbers stored before the first word are still numbers
+        self.assertEqual([3, 'WORD', 0], [tags.get(e, 'SOME_NEW_TAG') for e in (12, 13, 14)])
+        self.assertEqual([14], tags.entities_with('SOME_NEW_TAG', 0))
+        self.assertEqual([13], tags.entities_with('SOME_NEW_TAG', 'WORD'))
+        self.assertEqual([], tags.entities_with('SOME_NEW_TAG', 'OTHER'))
+
+    def test_typed_values(self):
+        self.assertEqual(3, tagstore.typed_value('ATK', '3'))
+        self.assertEqual('PLAY', tagstore.typed_value('ZONE', 'PLAY'))
+        self.assertEqual(7, tagstore.typed_value('SOME_NEW_TAG', '7'))
+        self.assertEqual('WORD', tagstore.typed_value('SOME_NEW_TAG', 'WORD'))
+
+    def test_history_is_bounded(self):
+        tags = tagstore.TagStore(history_size=10)
+        for i in range(25):
+            tags.set(1, 'DAMAGE', i)
+        self.assertTrue(len(tags.entity_history(1)) <= 10)
+        self.assertEqual(('DAMAGE', 24), tags.entity_history(1)[-1])
+
+class TestPendingTags(unittest.TestCase):
+    def test_applied_when_card_revealed(self):
+        gstate = state.GameState()
+        gstate.start_game()
+        gstate.update_card_tag('07', 'ATK', '3')
+        gstate.update_card_tag('07', 'DAMAGE', '1')
+        self.assertEqual({'hits': 0, 'misses': 2, 'evictions': 0, 'pending': 2},
+                         gstate.pending_tags.stats())
+        gstate.opp_play_minion('CS2_065', '07', '1')
+        voidwalker = gstate.card_with_id('07')
+        self.assertEqual((3, 1), (voidwalker.attack, voidwalker.damage))
+        self.assertEqual({'hits': 2, 'misses': 2, 'evictions': 0, 'pending': 0},
+                         gstate.pending_tags.stats())
+
+    def test_eviction(self):
+        pending = state.PendingTags(per_entity=2, max_age=8)
+        for value in ('1', '2', '3'):
+            pending.tick()
+            pending.hold('07', 'DAMAGE', value)
+        # Over the cap: the oldest update goes
+        self.assertEqual(1, pending.evictions)
+        self.assertEqual([('DAMAGE', '2'), ('DAMAGE', '3')], list(
+            (tag, value) for when, tag, value in pending.pending['07']))
+        pending.hold('08', 'DAMAGE', '1')
+        for _ in range(10):
+            pending.tick()
+        # Too old: everything goes
+        self.assertEqual([], pending.release('08'))
+        self.assertEqual(4, pending.evictions)
+        self.assertEqual(0, len(pending))
+
+class TestLogIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logpath = os.path.join(self.tmpdir, 'Player.log')
+        lines = [
+            'Unity noise',
+            '[Power] GameState.DebugPrintPower() - CREATE_GAME',
+            '[Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=tingle tag=CURRENT_PLAYER value=1',
+            '[Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=tingle tag=CURRENT_PLAYER value=0',
+            '[Power] GameState.DebugPrintPower() -     TAG_CHANGE Entity=Innkeeper tag=CURRENT_PLAYER value=1',
+            '[Power] GameState.DebugPrintPower() - TAG_CHANGE Entity=tingle tag=PLAYSTATE value=WON',
+            '[Power] GameState.DebugPrintPower() - CREATE_GAME',
+        ]
+        with open(self.logpath, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.contents = open(self.logpath).read()
+
+    def test_game_and_turn_offsets(self):
+        index = logindex.load_index(self.logpath)
+        self.assertEqual(2, len(index))
+        self.assertTrue(self.contents[index.game_offset(2):].startswith('[Power] GameState.DebugPrintPower() - CREATE_GAME'))
+        self.assertTrue('Entity=Innkeeper' in self.contents[index.turn_offset(1, 2):].split('\n')[0])
+        self.assertEqual('WON', index.game(1)['results'][0][2])
+        self.assertEqual(None, index.game(2)['end'])
+        # The saved index is reused
+        self.assertTrue(os.path.exists(self.logpath + logindex.INDEX_SUFFIX))
+        self.assertEqual(index.games, logindex.load_index(self.logpath).games)
+
+    def test_parser_seek_turn(self):
+        parser = cardlogger.Parser(self.logpath, os.path.join(self.tmpdir, 'hearthstone.log'))
+        parser.seek_turn(1, 2)
+        self.assertEqual("THEIRS", parser.gstate.turn)
+        self.assertEqual(parser.index().turn_offset(1, 2), parser.pos)
+
+    def test_replay_game(self):
+        summary = replay.replay_game((self.logpath, 1, 0))
+        self.assertEqual(None, summary['exception'])
+        self.assertEqual(5, summary['lines'])
+        self.assertTrue(summary['game_ended'])
+
+class TestCheckpoint(unittest.TestCase):
+    def test_restore_every_turn(self):
+        kooloolimpah.enabled = False
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, checkpoint.CHECKPOINT_FILENAME)
+        parser = cardlogger.Parser(os.path.join(hearthbot_home, 'sample_logs', 'warlock_notap_bug.log'), None)
+        gstate = parser.gstate
+        writer = checkpoint.CheckpointWriter(path, keyframe_every=4)
+        writer.follow(gstate)
+        # What the state was at each checkpoint
+        captured = []
+        gstate.changes.subscribe([changes.TURN_STARTED],
+                                 lambda change: captured.append(checkpoint.capture(gstate)))
+        gstate.start_game()
+        parser.process_log()
+        writer.write(gstate, 'end')
+        captured.append(checkpoint.capture(gstate))
+        writer.close()
+
+        reader = checkpoint.CheckpointReader(path)
+        self.assertEqual(len(captured), len(reader))
+        self.assertTrue(len(reader) > 8)
+        for index in range(len(reader)):
+            self.assertEqual(captured[index], reader.load(index))
+        self.assertEqual('end', reader.label(len(reader) - 1))
+        self.assertEqual(3, reader.find_turn(4))
+
+        restored = reader.restore(len(reader) - 1)
+        self.assertEqual(captured[-1], checkpoint.capture(restored))
+        self.assertEqual([m.id for m in gstate.opponent.minions],
+                         [m.id for m in restored.opponent.minions])
+        # Deltas are much smaller than the whole state
+        self.assertTrue(reader.records[1][1] * 2 < reader.records[0][1])
+
+    def test_mechanics_kept_by_name(self):
+        gstate = state.GameState(None)
+        card = carddata.card_from_id('CS2_065', '05')
+        # Mechanics outside MECHANIC_NAMES get whatever bit is next when first seen
+        card.flags = carddata.TAUNT | carddata.mechanic_bit('Checkpoint Test')
+        gstate.all_cards[card.id] = card
+        sections = checkpoint.capture(gstate)
+        self.assertTrue(('Taunt', 'Checkpoint Test') in sections['cards']['05'])
+        self.assertEqual(card.flags, checkpoint.rebuild(sections).all_cards['05'].flags)
+
+    def test_keyframe_after_dropped_write(self):
+        path = os.path.join(tempfile.mkdtemp(), checkpoint.CHECKPOINT_FILENAME)
+        gstate = state.GameState(None)
+        writer = checkpoint.CheckpointWriter(path)
+        queue_write = writer.writer.write
+        for label in ('first', 'dropped', 'after'):
+            # As if the queue was full for the second one
+            writer.writer.write = queue_write if label != 'dropped' else lambda data: False
+            writer.write(gstate, label)
+        writer.close()
+        reader = checkpoint.CheckpointReader(path)
+        self.assertEqual(['first', 'after'], [reader.label(i) for i in range(len(reader))])
+        self.assertEqual([1, 1], [keyframe for _, _, keyframe, _ in reader.records])
+        reader.close()
+
+class Counted(object):
+    # Counts how often it is turned into text
+    formatted = 0
+
+    def __format__(self, spec):
+        Counted.formatted += 1
+        return 'counted'
+
+class TestHotLog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.records = []
+        self.handler = logging.Handler()
+        self.handler.emit = lambda record: self.records.append(self.handler.format(record))
+        logging.getLogger('HOTTEST').addHandler(self.handler)
+        Counted.formatted = 0
+
+    def tearDown(self):
+        logging.getLogger('HOTTEST').removeHandler(self.handler)
+        hotlog.set_trace(None)
+
+    def test_formats_lazily(self):
+        logger = hotlog.getLogger('HOTTEST')
+        hotlog.set_level('HOTTEST', logging.INFO)
+        logger.debug("{} {}", Counted(), hotlog.pretty([1, 2]))
+        self.assertEqual(0, Counted.formatted)
+        self.assertEqual([], self.records)
+        logger.info("{} and {}", Counted(), hotlog.pretty({'a': 1}))
+        logger.info("{no args, no formatting}")
+        self.assertEqual(["counted and {'a': 1}", "{no args, no formatting}"], self.records)
+        self.assertEqual(1, Counted.formatted)
+
+    def test_trace(self):
+        path = os.path.join(self.tmpdir, 'trace.hbt')
+        sink = hotlog.TraceSink(path)
+        hotlog.set_trace(sink)
+        logger = hotlog.getLogger('HOTTEST')
+        hotlog.set_level('HOTTEST', logging.ERROR)
+        for i in range(3):
+            logger.debug("Turn {}: {} mana", i, 2.5)
+        logger.info("Hand {}", [carddata.card_from_id('CS2_065', '6')])
+        # Longer than a 16 bit length
+        logger.info("{}", 'x' * 70000)
+        sink.close()
+        # Traced even though nothing was logged
+        self.assertEqual([], self.records)
+        messages = hotlog.read_trace(path)
+        self.assertEqual(["Turn 0: 2.5 mana", "Turn 1: 2.5 mana", "Turn 2: 2.5 mana",
+                          "Hand [Voidwalker (1:1/3) (id:6) (pos:None)]", 'x' * 70000],
+                         [text for _, _, _, text in messages])
+        self.assertEqual((logging.INFO, 'HOTTEST'), messages[-1][1:3])
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def test_async_writer_compresses(self):
+        path = os.path.join(self.tmpdir, 'hearthstone.log.gz')
+        writer = archive.AsyncWriter(path)
+        for i in range(100):
+            writer.write('line {}\n'.format(i))
+        writer.close()
+        self.assertEqual(0, writer.dropped)
+        lines = archive.open_archive(path).read().splitlines()
+        self.assertEqual(100, len(lines))
+        self.assertEqual('line 99', lines[-1])
+
+    def test_async_writer_close_without_thread(self):
+        writer = archive.AsyncWriter(os.path.join(self.tmpdir, 'tingle.log'), queue_size=1)
+        # The thread is gone, leaving the queue full
+        writer.queue.put(None)
+        writer.thread.join()
+        writer.write('lost\n')
+        self.assertTrue(writer.queue.full())
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logging.getLogger('ARCHIVE').addHandler(handler)
+        try:
+            # Returns instead of waiting on the queue forever
+            writer.close()
+        finally:
+            logging.getLogger('ARCHIVE').removeHandler(handler)
+        self.assertEqual([logging.ERROR], [record.levelno for record in records])
+
+    def test_async_writer_flush_without_thread(self):
+        handler = archive.AsyncLogHandler(os.path.join(self.tmpdir, 'tingle.log.gz'))
+        writer = handler.writer
+        writer.queue.put(None)
+        writer.thread.join()
+        writer.write('lost\n')
+        # As logging.shutdown does: returns instead of waiting on the queue forever
+        started = time.time()
+        handler.flush()
+        self.assertFalse(writer.flush())
+        self.assertTrue(time.time() - started < archive.CLOSE_TIMEOUT)
+        # The thread closed the file on its way out, so it's a whole gzip file
+        self.assertEqual('', archive.open_archive(writer.filepath).read())
+
+    def test_flight_recorder_keeps_latest(self):
+        recorder = archive.FlightRecorder(size=3)
+        for i in range(5):
+            recorder.record('line {}'.format(i))
+        self.assertEqual(['line 2', 'line 3', 'line 4'], [text for _, text in recorder.entries])
+
+class TestTailer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.logpath = os.path.join(self.tmpdir, 'Player.log')
+        open(self.logpath, 'w').close()
+        self.parser = cardlogger.Parser(self.logpath, os.path.join(self.tmpdir, 'hearthstone.log'))
+
+    def append(self, line):
+        with open(self.logpath, 'a') as f:
+            f.write(line + '\n')
+
+    def check_truncation(self, watcher):
+        log_tailer = tailer.LogTailer(self.parser, watcher)
+        batches = []
+        log_tailer.add_callback(lambda parser, n: batches.append(n))
+        self.assertEqual(0, log_tailer.wait_for_batch(0.05))
+
+        self.append('[Power] GameState.DebugPrintPower() - CREATE_GAME')
+        self.assertEqual(1, log_tailer.wait_for_batch(1))
+        self.assertTrue(self.parser.gstate.game_started)
+        self.assertEqual([1], batches)
+
+        # Hearthstone restarting empties the log
+        open(self.logpath, 'w').close()
+        self.assertEqual(0, log_tailer.wait_for_batch(0.05))
+        self.assertEqual(0, self.parser.pos)
+        self.assertFalse(self.parser.gstate.game_started)
+        log_tailer.close()
+
+    def test_stat_watcher_truncation(self):
+        self.check_truncation(tailer.StatWatcher(self.logpath, interval=0.01))
+
+    def test_default_watcher_truncation(self):
+        self.check_truncation(None)
+
 if __name__ == '__main__':
     unittest.main()